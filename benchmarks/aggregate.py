@@ -0,0 +1,120 @@
+"""Portfolio aggregation: per-account concat vs. dense asset matrix.
+
+Aggregates synthetic accounts with minute-level performance data both
+ways and checks they agree, then times incremental updates of the
+totals (refreshing one account, appending one row, removing and
+adding an account):
+
+    python benchmarks/aggregate.py [num_assets] [num_rows]
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import pandas as pd
+
+# repository root:
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from portfolio import portfolio
+
+class syntheticaccount:
+    def __init__(self,name,index,rng):
+        coins = np.cumsum(rng.uniform(0,1,len(index)))
+        prices = 100 + np.cumsum(rng.normal(0,1,len(index)))
+        deposits = np.cumsum(rng.uniform(0,50,len(index)))
+        self.name = name
+        self.performance_data = pd.DataFrame(
+            {
+                "usd_deposits": deposits,
+                "number_of_coins": coins,
+                "coin_price": prices,
+                "coin_usd_value": coins*prices,
+                "performance": coins*prices/deposits,
+                },
+            index=index,
+            )
+
+    def return_performance_data(self):
+        return self.performance_data.copy()
+
+def concat_aggregate(accounts):
+    # the previous aggregate_accounts:
+    deposit_frames = []
+    value_frames = []
+    coin_names = []
+    for account in accounts:
+        perf = account.return_performance_data()
+        deposit_frames.append(perf.usd_deposits)
+        value_frames.append(perf.coin_usd_value)
+        coin_names.append(account.name)
+    deposits_df = pd.concat(deposit_frames, axis=1, keys=coin_names)
+    deposits_df["total"] = deposits_df.sum(axis=1)
+    cvalues_df = pd.concat(value_frames, axis=1, keys=coin_names)
+    cvalues_df["total"] = cvalues_df.sum(axis=1)
+    perf_df = pd.DataFrame(
+        [cvalues_df.total,deposits_df.total],
+        index=["coin_usd_value","deposits_usd"],
+        ).transpose()
+    perf_df["performance"] = perf_df.coin_usd_value/perf_df.deposits_usd
+    return perf_df
+
+def matrix_aggregate(accounts):
+    lcc = portfolio("benchmark")
+    lcc.all_accounts = accounts
+    lcc.aggregate_accounts()
+    return lcc
+
+def timed(fn,*args):
+    ti = time.perf_counter()
+    results = fn(*args)
+    return results,time.perf_counter()-ti
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("num_assets",type=int,nargs="?",default=200,
+        help="assets in the portfolio")
+    parser.add_argument("num_rows",type=int,nargs="?",default=20000,
+        help="minutes of performance data per asset")
+    args = parser.parse_args()
+    num_assets = args.num_assets
+    num_rows = args.num_rows
+    rng = np.random.default_rng(0)
+    index = pd.date_range("2021-01-01",periods=num_rows,freq="min")
+    accounts = [
+        syntheticaccount("COIN%d"%ii,index,rng)
+        for ii in range(num_assets)
+        ]
+    old,old_seconds = timed(concat_aggregate,accounts)
+    import builtins
+    _print,builtins.print = builtins.print,lambda *args,**kwargs: None
+    try:
+        lcc,new_seconds = timed(matrix_aggregate,accounts)
+    finally:
+        builtins.print = _print
+    pd.testing.assert_frame_equal(old,lcc.total_performance,check_freq=False)
+    names = ["COIN%d"%ii for ii in range(0,num_assets,10)]
+    sub,sub_seconds = timed(lcc.sub_portfolio,names)
+    print("assets x rows:     %d x %d"%(num_assets,num_rows))
+    print("concat aggregate:  %.3f s"%old_seconds)
+    print("matrix aggregate:  %.3f s"%new_seconds)
+    print("sub-portfolio (%d): %.3f s"%(len(names),sub_seconds))
+
+    # incremental updates against a full rebuild:
+    account = accounts[num_assets//2]
+    df = account.performance_data.copy()
+    df.iloc[-60:,1] *= 1.01
+    account.performance_data = df
+    _,refresh_seconds = timed(lcc.refresh_account,account,False)
+    last = lcc.matrix.index[-1]
+    prices = pd.DataFrame(
+        {"COIN%d"%ii: [100.0] for ii in range(num_assets)},
+        index=[last+pd.Timedelta(minutes=1)],
+        )
+    _,append_seconds = timed(lcc.append_prices,prices)
+    _,remove_seconds = timed(lcc.remove_account,account)
+    _,add_seconds = timed(lcc.add_account,account)
+    print("refresh one (60 rows changed): %.4f s"%refresh_seconds)
+    print("append one row:    %.4f s"%append_seconds)
+    print("remove one:        %.4f s"%remove_seconds)
+    print("add one:           %.4f s"%add_seconds)
@@ -0,0 +1,91 @@
+"""Account discovery: registering every listed account vs. discover_accounts.
+
+Lists the accounts of both exchanges on the mock exchange, which
+returns a few funded currencies and many never-used ones, then sets
+up a portfolio two ways: registering every listed account (as the
+example scripts did for the accounts they named) and registering
+only what discover_accounts keeps. Reports requests per endpoint
+and wall time for each:
+
+    python benchmarks/discovery.py [empty_accounts]
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import pandas as pd
+
+# repository root:
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import cbpro._api
+import kucoin._api
+import cbpro.account
+import kucoin.account
+from portfolio import portfolio
+from common._store import set_cache_dir
+from common._memo import price_memo
+from mockexchange import mockexchange
+from refresh import write_keyfile
+
+def register_all(lcc,keyfile,start,end):
+    # one account per listed currency, as before discovery:
+    for currency,entry in cbpro.account.list_accounts(keyfile).iterrows():
+        lcc.register_account(cbpro.account.account(currency,entry.id,keyfile))
+    for currency in kucoin.account.list_accounts(keyfile).index:
+        if currency=="USDT":
+            continue
+        account = kucoin.account.account(currency,keyfile,verbose=False)
+        account.set_date_range(start,end)
+        lcc.register_account(account)
+
+def discover(lcc,keyfile,start,end):
+    report = lcc.discover_accounts(keyfile,keyfile,start,end)
+    for account in lcc.pending_accounts:
+        account.verbose_flag = False
+    return report
+
+def run(name,mock,register,keyfile,start,end):
+    set_cache_dir(tempfile.mkdtemp())
+    price_memo.clear()
+    mock.reset_stats()
+    lcc = portfolio(name)
+    ti = time.perf_counter()
+    register(lcc,keyfile,start,end)
+    registered = len(lcc.pending_accounts)
+    report = lcc.load_accounts()
+    seconds = time.perf_counter()-ti
+    stats = mock.stats()
+    print("%-13s %3d registered, %3d loaded, %5d requests, %.2f s"%(
+        name+":",
+        registered,
+        (report.status=="ok").sum(),
+        stats["requests"],
+        seconds,
+        ))
+    for endpoint,count in sorted(stats["by_endpoint"].items()):
+        print("    %-30s %5d"%(endpoint,count))
+    return lcc
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("empty_accounts",type=int,nargs="?",default=40,
+        help="never-used accounts listed per exchange")
+    args = parser.parse_args()
+    empty = args.empty_accounts
+    keyfile = os.path.join(tempfile.mkdtemp(),"api.secret")
+    write_keyfile(keyfile)
+    for bucket in list(cbpro._api.buckets.values())+list(kucoin._api.buckets.values()):
+        bucket.rate = bucket.capacity = bucket._tokens = 1e6
+    with mockexchange(empty_accounts=empty,latency=0.002) as mock:
+        cbpro._api.ENDPOINT = mock.url
+        kucoin._api.BASE_URL = mock.url
+        start = pd.Timestamp(mock.first,unit="s").date()
+        end = (pd.Timestamp(mock.last,unit="s") - pd.Timedelta(days=1)).date()
+        everything = run("register all",mock,register_all,keyfile,start,end)
+        discovered = run("discovered",mock,discover,keyfile,start,end)
+
+        # exactly the funded currencies are set up, on both exchanges:
+        names = sorted(account.name for account in discovered.all_accounts)
+        assert names==sorted(2*mock.currencies), names
+        print("discovered the %d funded accounts"%len(names))
@@ -0,0 +1,132 @@
+"""Live valuation: polling extract_performance vs. the websocket feeds.
+
+Sets up a portfolio of Coinbase and KuCoin accounts against the mock
+exchange, then keeps its latest row current two ways: re-running
+extract_performance on every account (the REST candle path), and
+following both exchanges' ticker feeds, which revalue the last row
+of each account and the portfolio totals in place:
+
+    python benchmarks/livefeed.py [seconds]
+
+Reports REST requests and time per refresh for polling, and updates,
+REST requests and time per update for the feeds, then checks the
+streamed valuation against a full recomputation.
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import numpy as np
+import pandas as pd
+
+# repository root:
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import cbpro._api
+import kucoin._api
+import cbpro.markets
+import kucoin.markets
+from portfolio import portfolio
+from common._store import set_cache_dir
+from common._memo import price_memo
+from common._matrix import assetmatrix
+from mockexchange import mockexchange
+from refresh import COINS, write_keyfile, make_cbpro, make_kucoin
+
+def setup(mock,keyfile):
+    start = pd.Timestamp(mock.first,unit="s").date()
+    end = pd.Timestamp.now().date()
+    lcc = portfolio("live")
+    for coin in COINS[:5]:
+        lcc.register_account(make_cbpro(coin,keyfile))
+        lcc.register_account(make_kucoin(coin,keyfile,start,end))
+    lcc.load_accounts()
+    return lcc
+
+def poll(lcc,mock):
+    # today's price the REST way, as a refresh did before:
+    price_memo.clear()
+    mock.reset_stats()
+    ti = time.perf_counter()
+    for account in lcc.all_accounts:
+        account.extract_performance()
+        lcc.refresh_account(account,setup=False)
+    return time.perf_counter()-ti,mock.stats()["requests"]
+
+def follow(lcc,mock,seconds):
+    mock.reset_stats()
+    applied = []
+    def timed(pair,price,when):
+        ti = time.perf_counter()
+        lcc._on_price(pair,price,when)
+        applied.append(time.perf_counter()-ti)
+    feeds = [
+        cbpro.markets.live_prices(["%s-USD"%coin for coin in COINS[:5]]),
+        kucoin.markets.live_prices(["%s-USDT"%coin for coin in COINS[:5]]),
+        ]
+    for feed in feeds:
+        feed.subscribe(timed)
+    for feed in feeds:
+        assert feed.wait(timeout=10), "no prices from the feed"
+    time.sleep(seconds)
+    for feed in feeds:
+        feed.stop()
+    return feeds,applied,mock.stats()
+
+def check(lcc,feeds):
+    prices = pd.concat([feed.snapshot() for feed in feeds])
+    for account in lcc.all_accounts:
+        last = account.performance_data.iloc[-1]
+        assert last.coin_price==prices[account.usd_pair], account.name
+        assert np.isclose(last.coin_usd_value,last.number_of_coins*last.coin_price)
+    expected = assetmatrix.from_accounts(lcc.all_accounts).performance()
+    pd.testing.assert_frame_equal(
+        lcc.total_performance,
+        expected,
+        rtol=1e-9,
+        check_freq=False,
+        )
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("seconds",type=float,nargs="?",default=3.0,
+        help="how long to follow the feeds")
+    args = parser.parse_args()
+    seconds = args.seconds
+    set_cache_dir(tempfile.mkdtemp())
+    keyfile = os.path.join(tempfile.mkdtemp(),"api.secret")
+    write_keyfile(keyfile)
+    for bucket in list(cbpro._api.buckets.values())+list(kucoin._api.buckets.values()):
+        bucket.rate = bucket.capacity = bucket._tokens = 1e6
+    end = pd.Timestamp.now().floor("D")
+    with mockexchange(
+        entries=5000,
+        start="2025-01-01",
+        end=end,
+        tick_interval=0.01,
+        latency=0.005,
+        ) as mock:
+        cbpro._api.ENDPOINT = mock.url
+        cbpro._api.WEBSOCKET_URL = mock.ws_url
+        kucoin._api.BASE_URL = mock.url
+        lcc = setup(mock,keyfile)
+        print("accounts:         %d"%len(lcc.all_accounts))
+        seconds_poll,requests = poll(lcc,mock)
+        print("polling refresh:  %d REST requests, %.3f s"%(requests,seconds_poll))
+        feeds,applied,stats = follow(lcc,mock,seconds)
+        rest = {
+            name: count for name,count in stats["by_endpoint"].items()
+            if not name.startswith("ws:")
+            }
+        print("live feeds:       %d updates in %.0f s, %d REST requests %s"%(
+            len(applied),
+            seconds,
+            sum(rest.values()),
+            rest,
+            ))
+        print("per update:       %.1f us (median), %.1f us (p99)"%(
+            1e6*np.median(applied),
+            1e6*np.percentile(applied,99),
+            ))
+        check(lcc,feeds)
+        print("valuation check:  ok")
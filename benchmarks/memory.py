@@ -0,0 +1,119 @@
+"""Peak memory of the extract pipeline: copying vs. shallow accessors.
+
+Runs extract_deposits, extract_balance_sheet and extract_performance
+on a KuCoin account holding a synthetic ledger, once with the
+return_* accessors deep copying (the previous behaviour) and once
+with the default shallow frames, each in a fresh process:
+
+    python benchmarks/memory.py [num_rows]
+"""
+import os
+import sys
+import argparse
+import resource
+import subprocess
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+# repository root:
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import kucoin._api
+from kucoin.account import account
+from common._store import set_cache_dir
+from mockexchange import mockexchange
+
+START = "2019-01-01"
+END = "2021-12-31"
+ACCESSORS = [
+    "return_ledger",
+    "return_usd_fills",
+    "return_deposits",
+    "return_balance_sheet",
+    "return_performance_data",
+    ]
+
+def synthetic_account(num_rows):
+    rng = np.random.default_rng(0)
+    first = pd.Timestamp(START).value
+    last = pd.Timestamp(END).value
+    index = pd.to_datetime(np.sort(rng.integers(first,last,num_rows)))
+    amounts = rng.uniform(-0.5,1.0,num_rows)
+    ledger = pd.DataFrame(
+        {
+            "id": ["%024x"%ii for ii in range(num_rows)],
+            "currency": "BTC",
+            "amount": amounts,
+            "fee": 0.0,
+            "balance": np.cumsum(amounts),
+            "accountType": "TRADE",
+            "bizType": "Exchange",
+            "direction": np.where(amounts < 0,"out","in"),
+            "context": "{}",
+            },
+        index=index.rename("createdAt"),
+        )
+    fills = ledger.iloc[::2]
+    usd_fills = pd.DataFrame(
+        {
+            "symbol": "BTC-USDT",
+            "side": np.where(fills.amount < 0,"sell","buy"),
+            "price": 100.0,
+            "size": fills.amount.abs().to_numpy(),
+            "funds": 100.0*fills.amount.abs().to_numpy(),
+            "fee": 0.1,
+            },
+        index=fills.index,
+        )
+    coin = account("BTC",verbose=False)
+    coin.set_date_range(START,END)
+    coin.ledger = ledger
+    coin.usd_fills = usd_fills
+    return coin
+
+def run(mode,num_rows):
+    if mode=="copy":
+        for name in ACCESSORS:
+            method = getattr(account,name)
+            setattr(account,name,lambda self,_m=method: _m(self,copy=True))
+    coin = synthetic_account(num_rows)
+    set_cache_dir(None)
+    with mockexchange() as mock:
+        kucoin._api.BASE_URL = mock.url
+        baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        tracemalloc.start()
+        coin.extract_deposits()
+        coin.extract_balance_sheet()
+        coin.extract_performance()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print("%s %d %d %d"%(mode,peak,baseline,rss))
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("num_rows",type=int,nargs="?",default=1000000,
+        help="rows of the synthetic ledger")
+    # run one mode in this process (how each mode is started):
+    parser.add_argument("--mode",choices=["copy","view"],
+        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    num_rows = args.num_rows
+    if args.mode is not None:
+        run(args.mode,num_rows)
+        sys.exit()
+    print("ledger rows: %d"%num_rows)
+    for mode in ["copy","view"]:
+        output = subprocess.run(
+            [sys.executable,__file__,str(num_rows),"--mode",mode],
+            capture_output=True,
+            text=True,
+            check=True,
+            ).stdout.split("\n")
+        mode,peak,baseline,rss = output[-2].split()
+        print("%s accessors: pipeline peak %.0f MB, max RSS %.0f MB (%.0f MB above setup)"%(
+            mode,
+            int(peak)/2**20,
+            int(rss)/1024,
+            (int(rss)-int(baseline))/1024,
+            ))
@@ -0,0 +1,644 @@
+"""Local stand-in for the Coinbase and KuCoin REST and websocket APIs.
+
+Serves deterministic synthetic data for every endpoint the two
+apiwrappers use, with configurable data volume, latency and a
+server-side rate limit:
+
+    Coinbase: /accounts, /accounts/{id}/ledger, /fills,
+              /products/{pair}/candles
+    KuCoin:   /api/v1/accounts, /api/v1/accounts/ledgers,
+              /api/v1/fills, /api/v1/market/candles,
+              /api/v1/bullet-public
+
+plus both websocket ticker feeds, which push one price per
+subscribed pair every `tick_interval` seconds.
+
+Usage:
+
+    with mockexchange(entries=5000, latency=0.02) as mx:
+        cbpro._api.ENDPOINT = mx.url
+        cbpro._api.WEBSOCKET_URL = mx.ws_url
+        kucoin._api.BASE_URL = mx.url
+        ...
+        print(mx.stats())
+"""
+import os
+import sys
+import json
+import time
+import zlib
+import threading
+from collections import Counter, deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qsl
+import numpy as np
+import pandas as pd
+
+# repository root, for the websocket frame helpers:
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common._websocket import (
+    accept_key,
+    encode_frame,
+    read_frame,
+    TEXT,
+    CLOSE,
+    PING,
+    PONG,
+    )
+
+KUCOIN_CANDLE_TYPES = {
+    "1min": 60,
+    "3min": 180,
+    "5min": 300,
+    "15min": 900,
+    "30min": 1800,
+    "1hour": 3600,
+    "2hour": 7200,
+    "4hour": 14400,
+    "6hour": 21600,
+    "8hour": 28800,
+    "12hour": 43200,
+    "1day": 86400,
+    "1week": 604800,
+    }
+
+class mockexchange:
+    def __init__(
+        self,
+        entries=1000,
+        start="2021-01-01",
+        end="2022-01-01",
+        latency=0.0,
+        rate_limit=None,
+        max_span=None,
+        tick_interval=0.05,
+        currencies=("BTC","ETH","SOL","ADA","DOT","LINK","ATOM","ALGO","XTZ","UNI"),
+        empty_accounts=40,
+        seed=0,
+        ):
+        """`entries` ledger rows per account (half as many fills),
+        spread over [start, end). `latency` seconds are added to every
+        response and more than `rate_limit` requests per second are
+        answered with 429. KuCoin ledger and fills requests spanning
+        more than `max_span` seconds are rejected. The websocket feeds
+        push a price per pair every `tick_interval` seconds. Account
+        listings hold `currencies` with their ledger balance plus
+        `empty_accounts` currencies that were never used."""
+        self.entries = entries
+        self.first = int(pd.Timestamp(start).timestamp())
+        self.last = int(pd.Timestamp(end).timestamp())
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.max_span = max_span
+        self.tick_interval = tick_interval
+        self.currencies = list(currencies)
+        self.empty_accounts = empty_accounts
+        self.seed = seed
+        self.requests = Counter()
+        self.rejected = 0
+        self.ticks = 0
+        self._closing = threading.Event()
+        self._recent = deque()
+        self._data = {}
+        self._lock = threading.Lock()
+        self._server = None
+
+    # -- server lifecycle ---------------------------------------------
+    def start(self):
+        mock = self
+
+        class handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                if self.headers.get("Upgrade","").lower()=="websocket":
+                    mock._websocket(self)
+                else:
+                    mock._handle(self)
+
+            def do_POST(self):
+                mock._handle(self)
+
+            def log_message(self,*args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1",0),handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever,daemon=True).start()
+        self.url = "http://127.0.0.1:%d"%self._server.server_address[1]
+        self.ws_url = "ws://127.0.0.1:%d/ws-feed"%self._server.server_address[1]
+        self._closing.clear()
+        return self
+
+    def stop(self):
+        self._closing.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self,*exc):
+        self.stop()
+
+    def stats(self):
+        return {
+            "requests": sum(self.requests.values()),
+            "rejected": self.rejected,
+            "ticks": self.ticks,
+            "by_endpoint": dict(self.requests),
+            }
+
+    def reset_stats(self):
+        with self._lock:
+            self.requests.clear()
+            self.rejected = 0
+            self.ticks = 0
+
+    # -- request handling ---------------------------------------------
+    def _handle(self,request):
+        parts = urlsplit(request.path)
+        path = parts.path
+        query = dict(parse_qsl(parts.query))
+        endpoint = self._endpoint_name(path)
+        with self._lock:
+            self.requests[endpoint] += 1
+            limited = self._over_limit()
+            if limited:
+                self.rejected += 1
+        if self.latency:
+            time.sleep(self.latency)
+        headers = {}
+        if limited:
+            status,body = 429,self._rate_limited(path)
+        else:
+            try:
+                status,body,headers = self._route(path,query)
+            except (KeyError, ValueError) as exc:
+                status,body = 400,{"message": "bad request: %s"%exc}
+        payload = json.dumps(body).encode()
+        request.send_response(status)
+        request.send_header("Content-Type","application/json")
+        request.send_header("Content-Length",str(len(payload)))
+        for key,value in headers.items():
+            request.send_header(key,value)
+        request.end_headers()
+        request.wfile.write(payload)
+
+    def _endpoint_name(self,path):
+        if path.startswith("/accounts/") and path.endswith("/ledger"):
+            return "/accounts/{id}/ledger"
+        if path.startswith("/products/") and path.endswith("/candles"):
+            return "/products/{pair}/candles"
+        return path
+
+    def _over_limit(self):
+        if self.rate_limit is None:
+            return False
+        now = time.monotonic()
+        while self._recent and self._recent[0] <= now-1.0:
+            self._recent.popleft()
+        if len(self._recent) >= self.rate_limit:
+            return True
+        self._recent.append(now)
+        return False
+
+    def _rate_limited(self,path):
+        if path.startswith("/api/"):
+            return {"code": "429000", "msg": "Too Many Requests"}
+        return {"message": "Rate limit exceeded"}
+
+    def _route(self,path,query):
+        if path=="/accounts":
+            return self._cbpro_accounts()
+        if path=="/api/v1/accounts":
+            return self._kucoin_accounts()
+        if path.startswith("/accounts/") and path.endswith("/ledger"):
+            return self._cbpro_ledger(path.split("/")[2],query)
+        if path=="/fills":
+            return self._cbpro_fills(query)
+        if path.startswith("/products/") and path.endswith("/candles"):
+            return self._cbpro_candles(path.split("/")[2],query)
+        if path=="/api/v1/accounts/ledgers":
+            return self._kucoin_span_error(query) or self._kucoin_ledger(query)
+        if path=="/api/v1/fills":
+            return self._kucoin_span_error(query) or self._kucoin_fills(query)
+        if path=="/api/v1/market/candles":
+            return self._kucoin_candles(query)
+        if path=="/api/v1/bullet-public":
+            return self._kucoin_bullet()
+        return 404,{"message": "NotFound"},{}
+
+    # -- synthetic data -----------------------------------------------
+    def _records(self,key,currency=None):
+        """Sorted entry times and amounts for one account, cached.
+        Never-used currencies have none."""
+        entries = 0 if currency in self._unused() else self.entries
+        with self._lock:
+            if key not in self._data:
+                rng = np.random.default_rng(
+                    [self.seed,zlib.crc32(key.encode())],
+                    )
+                times = np.sort(rng.integers(self.first,self.last,entries))
+                amounts = rng.uniform(-0.5,1.0,entries).round(8)
+                self._data[key] = (times,amounts,np.cumsum(amounts))
+            return self._data[key]
+
+    def price(self,times):
+        times = np.asarray(times,dtype=np.float64)
+        return 100.0 + 20.0*np.sin(times/2.0e6) + times*1e-7
+
+    def _unused(self):
+        return ["X%03d"%ii for ii in range(self.empty_accounts)]
+
+    def _listed(self,ledger_key):
+        # (currency, balance) of every account, used ones first:
+        listed = [
+            (currency,float(self._records(ledger_key(currency))[2][-1]))
+            for currency in self.currencies
+            ]
+        listed += [(currency,0.0) for currency in self._unused()]
+        return listed
+
+    # -- Coinbase -----------------------------------------------------
+    def _cbpro_accounts(self):
+        listed = self._listed(
+            lambda currency: "cbpro-ledger-%s-account"%currency.lower(),
+            )
+        accounts = [
+            {
+                "id": "%s-account"%currency.lower(),
+                "currency": currency,
+                "balance": "%.8f"%balance,
+                "available": "%.8f"%balance,
+                "hold": "0.0000000000000000",
+                "profile_id": "profile",
+                "trading_enabled": True,
+                }
+            for currency,balance in listed
+            ]
+        return 200,accounts,{}
+
+    def _cbpro_ledger(self,account_id,query):
+        times,amounts,balances = self._records(
+            "cbpro-ledger-%s"%account_id,
+            account_id.split("-")[0].upper(),
+            )
+        ids = np.arange(1,len(times)+1)
+        rows = self._cbpro_page(ids,query)
+        page = [
+            {
+                "id": str(ids[ii]),
+                "amount": "%.8f"%amounts[ii],
+                "balance": "%.8f"%balances[ii],
+                "created_at": _iso(times[ii]),
+                "type": "match",
+                "details": {
+                    "order_id": "order-%d"%ids[ii],
+                    "product_id": "%s-USD"%account_id,
+                    "trade_id": str(ids[ii]),
+                    },
+                }
+            for ii in rows
+            ]
+        return 200,page,self._cbpro_cursors(page,"id")
+
+    def _cbpro_fills(self,query):
+        product_id = query["product_id"]
+        times,amounts,balances = self._records(
+            "cbpro-fills-%s"%product_id,
+            product_id.split("-")[0],
+            )
+        times = times[::2]
+        ids = np.arange(1,len(times)+1)
+        rows = self._cbpro_page(ids,query)
+        prices = self.price(times)
+        page = []
+        for ii in rows:
+            size = abs(amounts[2*ii])
+            page.append({
+                "created_at": _iso(times[ii]),
+                "trade_id": int(ids[ii]),
+                "product_id": product_id,
+                "order_id": "order-%d"%ids[ii],
+                "liquidity": "T",
+                "price": "%.2f"%prices[ii],
+                "size": "%.8f"%size,
+                "fee": "%.8f"%(0.005*size*prices[ii]),
+                "side": "buy" if amounts[2*ii] >= 0 else "sell",
+                "settled": True,
+                "usd_volume": "%.8f"%(size*prices[ii]),
+                })
+        return 200,page,self._cbpro_cursors(page,"trade_id")
+
+    def _cbpro_page(self,ids,query):
+        # newest first; `after` pages towards older entries and
+        # `before` towards newer ones:
+        limit = min(int(query.get("limit",100)),1000)
+        if "after" in query:
+            stop = np.searchsorted(ids,int(query["after"]))
+            return range(stop-1,max(stop-limit,0)-1,-1)
+        if "before" in query:
+            first = np.searchsorted(ids,int(query["before"]),side="right")
+            return range(min(first+limit,len(ids))-1,first-1,-1)
+        return range(len(ids)-1,max(len(ids)-limit,0)-1,-1)
+
+    def _cbpro_cursors(self,page,key):
+        if len(page)==0:
+            return {}
+        return {
+            "CB-BEFORE": str(page[0][key]),
+            "CB-AFTER": str(page[-1][key]),
+            }
+
+    def _cbpro_candles(self,pair,query):
+        granularity = int(query["granularity"])
+        start = int(pd.Timestamp(query["start"]).timestamp())
+        end = int(pd.Timestamp(query["end"]).timestamp())
+        times = self._candle_times(start,end,granularity)
+        if len(times) > 300:
+            return 400,{"message": "too many candles requested"},{}
+        opens = self.price(times)
+        closes = self.price(times+granularity)
+        rows = [
+            [
+                int(t),
+                round(min(o,c)*0.99,2),
+                round(max(o,c)*1.01,2),
+                round(o,2),
+                round(c,2),
+                1000.0,
+                ]
+            for t,o,c in zip(times[::-1],opens[::-1],closes[::-1])
+            ]
+        return 200,rows,{}
+
+    # -- KuCoin -------------------------------------------------------
+    def _kucoin_accounts(self):
+        listed = self._listed(lambda currency: "kucoin-ledger-%s"%currency)
+        accounts = []
+        for currency,balance in listed:
+            for kind,amount in [("main",0.0),("trade",balance)]:
+                accounts.append({
+                    "id": "%s-%s"%(currency.lower(),kind),
+                    "currency": currency,
+                    "type": kind,
+                    "balance": "%.8f"%amount,
+                    "available": "%.8f"%amount,
+                    "holds": "0",
+                    })
+        return 200,{"code": "200000", "data": accounts},{}
+
+    def _kucoin_ledger(self,query):
+        currency = query["currency"]
+        times,amounts,balances = self._records(
+            "kucoin-ledger-%s"%currency,
+            currency,
+            )
+        start,end = int(query["startAt"]),int(query["endAt"])
+        lo = np.searchsorted(times*1000,start)
+        hi = np.searchsorted(times*1000,end)
+        items = [
+            {
+                "id": "%s%08d"%(currency.lower(),ii),
+                "currency": currency,
+                "amount": "%.8f"%abs(amounts[ii]),
+                "fee": "0",
+                "balance": "%.8f"%balances[ii],
+                "accountType": "TRADE",
+                "bizType": "Exchange",
+                "direction": "in" if amounts[ii] >= 0 else "out",
+                "createdAt": int(times[ii])*1000,
+                "context": "{}",
+                }
+            for ii in range(lo,hi)
+            ]
+        return self._kucoin_page(items,query)
+
+    def _kucoin_fills(self,query):
+        symbol = query["symbol"]
+        times,amounts,balances = self._records(
+            "kucoin-fills-%s"%symbol,
+            symbol.split("-")[0],
+            )
+        times,amounts = times[::2],amounts[::2]
+        start,end = int(query["startAt"]),int(query["endAt"])
+        lo = np.searchsorted(times*1000,start)
+        hi = np.searchsorted(times*1000,end)
+        prices = self.price(times)
+        items = []
+        for ii in range(lo,hi):
+            size = abs(amounts[ii])
+            items.append({
+                "symbol": symbol,
+                "tradeId": "%d"%ii,
+                "orderId": "order-%d"%ii,
+                "side": "buy" if amounts[ii] >= 0 else "sell",
+                "price": "%.4f"%prices[ii],
+                "size": "%.8f"%size,
+                "funds": "%.8f"%(size*prices[ii]),
+                "fee": "%.8f"%(0.001*size*prices[ii]),
+                "feeCurrency": "USDT",
+                "liquidity": "taker",
+                "createdAt": int(times[ii])*1000,
+                })
+        return self._kucoin_page(items,query)
+
+    def _kucoin_span_error(self,query):
+        span = int(query["endAt"])-int(query["startAt"])
+        if self.max_span is not None and span > self.max_span*1000:
+            return 200,{"code": "400100", "msg": "time range too large"},{}
+        return None
+
+    def _kucoin_page(self,items,query):
+        page_size = min(int(query.get("pageSize",50)),500)
+        current = int(query.get("currentPage",1))
+        total_page = max(-(-len(items)//page_size),1)
+        data = {
+            "currentPage": current,
+            "pageSize": page_size,
+            "totalNum": len(items),
+            "totalPage": total_page,
+            "items": items[(current-1)*page_size:current*page_size],
+            }
+        return 200,{"code": "200000", "data": data},{}
+
+    def _kucoin_candles(self,query):
+        granularity = KUCOIN_CANDLE_TYPES[query["type"]]
+        start,end = int(query["startAt"]),int(query["endAt"])
+        times = self._candle_times(start,end,granularity)
+        if len(times) > 1500:
+            times = times[-1500:]
+        opens = self.price(times)
+        closes = self.price(times+granularity)
+        rows = [
+            [
+                str(int(t)),
+                "%.4f"%o,
+                "%.4f"%c,
+                "%.4f"%(max(o,c)*1.01),
+                "%.4f"%(min(o,c)*0.99),
+                "1000",
+                "%.4f"%(1000*o),
+                ]
+            for t,o,c in zip(times[::-1],opens[::-1],closes[::-1])
+            ]
+        return 200,{"code": "200000", "data": rows},{}
+
+    def _kucoin_bullet(self):
+        data = {
+            "token": "mock-token",
+            "instanceServers": [{
+                "endpoint": self.ws_url.replace("/ws-feed","/kucoin-feed"),
+                "encrypt": False,
+                "protocol": "websocket",
+                "pingInterval": 18000,
+                "pingTimeout": 10000,
+                }],
+            }
+        return 200,{"code": "200000", "data": data},{}
+
+    def _candle_times(self,start,end,granularity):
+        first = start + (-start)%granularity
+        times = np.arange(first,end+1,granularity)
+        return times[times <= time.time()]
+
+    # -- websocket feeds ----------------------------------------------
+    def _websocket(self,request):
+        path = urlsplit(request.path).path
+        with self._lock:
+            self.requests["ws:%s"%path] += 1
+        request.send_response(101)
+        request.send_header("Upgrade","websocket")
+        request.send_header("Connection","Upgrade")
+        request.send_header(
+            "Sec-WebSocket-Accept",
+            accept_key(request.headers["Sec-WebSocket-Key"]),
+            )
+        request.end_headers()
+        request.wfile.flush()
+        request.close_connection = True
+        session = _wssession(request)
+        kucoin = path=="/kucoin-feed"
+        if kucoin:
+            session.send({"id": "welcome", "type": "welcome"})
+        listener = threading.Thread(
+            target=self._ws_listen,
+            args=(session,kucoin),
+            daemon=True,
+            )
+        listener.start()
+        rng = np.random.default_rng(self.seed)
+        sequence = 0
+        while not (self._closing.is_set() or session.closed):
+            self._closing.wait(self.tick_interval)
+            now = time.time()
+            for pair in list(session.pairs):
+                sequence += 1
+                price = "%.4f"%(self.price(now)*rng.uniform(0.999,1.001))
+                if kucoin:
+                    message = {
+                        "type": "message",
+                        "topic": "/market/ticker:%s"%pair,
+                        "subject": "trade.ticker",
+                        "data": {
+                            "sequence": str(sequence),
+                            "price": price,
+                            "size": "0.01",
+                            "time": int(now*1000),
+                            },
+                        }
+                else:
+                    message = {
+                        "type": "ticker",
+                        "sequence": sequence,
+                        "product_id": pair,
+                        "price": price,
+                        "time": pd.Timestamp(now,unit="s").strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+                        }
+                if not session.send(message):
+                    break
+                with self._lock:
+                    self.ticks += 1
+        session.close()
+
+    def _ws_listen(self,session,kucoin):
+        # subscriptions and pings from the client:
+        while not session.closed:
+            message = session.recv()
+            if message is None:
+                break
+            kind = message.get("type")
+            if kind=="subscribe" and kucoin:
+                session.pairs.update(message["topic"].split(":")[1].split(","))
+                if message.get("response"):
+                    session.send({"id": message["id"], "type": "ack"})
+            elif kind=="subscribe":
+                session.pairs.update(message["product_ids"])
+                session.send({
+                    "type": "subscriptions",
+                    "channels": [{
+                        "name": "ticker",
+                        "product_ids": sorted(session.pairs),
+                        }],
+                    })
+            elif kind=="ping":
+                session.send({"id": message["id"], "type": "pong"})
+        session.close()
+
+class _wssession:
+    def __init__(self,request):
+        self.request = request
+        self.pairs = set()
+        self.closed = False
+        self._lock = threading.Lock()
+
+    def send(self,message):
+        payload = json.dumps(message).encode()
+        try:
+            with self._lock:
+                self.request.wfile.write(encode_frame(TEXT,payload,mask=False))
+                self.request.wfile.flush()
+            return True
+        except OSError:
+            self.closed = True
+            return False
+
+    def recv(self):
+        # next client text message, None once closed:
+        while True:
+            try:
+                fin,opcode,payload = read_frame(self._read)
+            except (OSError, EOFError, ValueError):
+                self.closed = True
+                return None
+            if opcode==CLOSE:
+                self.closed = True
+                return None
+            if opcode==PING:
+                with self._lock:
+                    self.request.wfile.write(encode_frame(PONG,payload,mask=False))
+                continue
+            if opcode==TEXT:
+                return json.loads(payload)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            try:
+                with self._lock:
+                    self.request.wfile.write(encode_frame(CLOSE,b"",mask=False))
+            except OSError:
+                pass
+
+    def _read(self,n):
+        data = self.request.rfile.read(n)
+        if len(data) < n:
+            raise EOFError()
+        return data
+
+def _iso(timestamp):
+    return pd.Timestamp(int(timestamp),unit="s").strftime("%Y-%m-%dT%H:%M:%S.%fZ")
@@ -0,0 +1,71 @@
+"""Ledger parsing: per-item pd.Series path vs. vectorized records.
+
+Parses synthetic KuCoin ledger entries both ways:
+
+    python benchmarks/parsing.py [num_entries]
+"""
+import os
+import sys
+import time
+import argparse
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+# repository root:
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import kucoin._utilities as utils
+
+def synthetic_ledger(num_entries):
+    rng = np.random.default_rng(0)
+    created = np.sort(rng.integers(1.6e12,1.7e12,num_entries))
+    amounts = rng.uniform(0,10,num_entries)
+    return [
+        {
+            "id": "%024x"%ii,
+            "currency": "BTC",
+            "amount": "%.8f"%amounts[ii],
+            "fee": "0",
+            "balance": "0",
+            "accountType": "TRADE",
+            "bizType": "Exchange",
+            "direction": "in" if ii%3 else "out",
+            "createdAt": int(created[ii]),
+            "context": "{}",
+            }
+        for ii in range(num_entries)
+        ]
+
+def series_path(items):
+    # the original per-item construction:
+    frames = [pd.Series(item) for item in items]
+    results = pd.concat(frames,axis=1).transpose()
+    results.loc[:,"createdAt"] = results.createdAt.apply(
+        lambda x: datetime.fromtimestamp(x/1000)
+        )
+    results = results.set_index("createdAt")
+    for col in ["amount","fee","balance"]:
+        results.loc[:,col] = results[col].apply(float)
+    return results
+
+def records_path(items):
+    return utils.parse_records(items,["amount","fee","balance"])
+
+def timed(fn,items):
+    ti = time.perf_counter()
+    fn(items)
+    return time.perf_counter()-ti
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("num_entries",type=int,nargs="?",default=100000,
+        help="ledger entries to parse")
+    args = parser.parse_args()
+    num_entries = args.num_entries
+    items = synthetic_ledger(num_entries)
+    old = timed(series_path,items)
+    new = timed(records_path,items)
+    print("entries:            %d"%num_entries)
+    print("pd.Series per item: %.3f s"%old)
+    print("vectorized records: %.3f s"%new)
+    print("speedup:            %.1fx"%(old/new))
@@ -0,0 +1,120 @@
+"""Account post-processing on threads vs. in a process pool.
+
+Loads a portfolio of Coinbase and KuCoin accounts (500 by default)
+from the mock exchange twice: with every setup stage on threads, and
+with portfolio(processes=...) deriving deposits and balance sheets in
+worker processes. Then times that derivation step alone for all
+accounts, in this process and in the pool, and compares what an
+account costs to pickle whole with what the pool sends. Checks both
+portfolios end up with the same performance data:
+
+    python benchmarks/processes.py [accounts] [processes]
+"""
+import os
+import sys
+import time
+import argparse
+import pickle
+import tempfile
+import pandas as pd
+
+# repository root:
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import cbpro._api
+import kucoin._api
+import portfolio as portfolio_module
+from portfolio import portfolio
+from common._store import set_cache_dir
+from common._memo import price_memo
+from common._datasets import invalidate
+from common._pool import derive_many, _bare_state
+from mockexchange import mockexchange
+from refresh import write_keyfile, make_cbpro, make_kucoin
+
+def coins(count):
+    return ["C%03d"%ii for ii in range(count)]
+
+def load(name,mock,keyfile,count,processes):
+    price_memo.clear()
+    mock.reset_stats()
+    start = pd.Timestamp(mock.first,unit="s").date()
+    end = (pd.Timestamp(mock.last,unit="s") - pd.Timedelta(days=1)).date()
+    lcc = portfolio(name,processes=processes)
+    for coin in coins(count//2):
+        lcc.register_account(make_cbpro(coin,keyfile))
+    for coin in coins(count-count//2):
+        lcc.register_account(make_kucoin(coin,keyfile,start,end))
+    ti = time.perf_counter()
+    report = lcc.load_accounts()
+    seconds = time.perf_counter()-ti
+    print("%-9s load_accounts: %d loaded, %d requests, %.2f s"%(
+        name,
+        (report.status=="ok").sum(),
+        mock.stats()["requests"],
+        seconds,
+        ))
+    return lcc
+
+def derive_here(accounts):
+    for account in accounts:
+        invalidate(account,"deposits","balance_sheet")
+        account.deposits
+        account.balance_sheet
+
+def derive_pooled(accounts,processes):
+    for account in accounts:
+        invalidate(account,"deposits","balance_sheet")
+    results = derive_many(
+        accounts,
+        portfolio_module._shipped,
+        portfolio_module._derived,
+        processes,
+        )
+    for account,(seconds,frames,error) in zip(accounts,results):
+        assert error is None, error
+        for name,df in frames.items():
+            setattr(account,name,df)
+
+def timed(fn,*args):
+    ti = time.perf_counter()
+    fn(*args)
+    return time.perf_counter()-ti
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("accounts",type=int,nargs="?",default=500,
+        help="accounts in the portfolio")
+    parser.add_argument("processes",type=int,nargs="?",default=os.cpu_count(),
+        help="worker processes (default: one per CPU)")
+    args = parser.parse_args()
+    count = args.accounts
+    processes = args.processes
+    print("accounts: %d, processes: %d (cpus: %d)"%(count,processes,os.cpu_count()))
+    set_cache_dir(None)
+    keyfile = os.path.join(tempfile.mkdtemp(),"api.secret")
+    write_keyfile(keyfile)
+    for bucket in list(cbpro._api.buckets.values())+list(kucoin._api.buckets.values()):
+        bucket.rate = bucket.capacity = bucket._tokens = 1e6
+    with mockexchange(entries=2000,currencies=coins(count)) as mock:
+        cbpro._api.ENDPOINT = mock.url
+        kucoin._api.BASE_URL = mock.url
+        threaded = load("threads",mock,keyfile,count,None)
+        pooled = load("processes",mock,keyfile,count,processes)
+    for a,b in zip(threaded.all_accounts,pooled.all_accounts):
+        pd.testing.assert_frame_equal(a.performance_data,b.performance_data)
+    print("performance data match")
+
+    accounts = threaded.all_accounts
+    here = timed(derive_here,accounts)
+    pooled_seconds = timed(derive_pooled,accounts,processes)
+    print("deposits + balance sheets: in process %.2f s, %d processes %.2f s"%(
+        here,
+        processes,
+        pooled_seconds,
+        ))
+    whole = sum(len(pickle.dumps(account)) for account in accounts)
+    sent = sum(len(pickle.dumps(_bare_state(account))) for account in accounts)
+    print("pickled per account: whole %.0f kB, sent to the pool %.1f kB"%(
+        whole/len(accounts)/1024,
+        sent/len(accounts)/1024,
+        ))
@@ -0,0 +1,145 @@
+"""End-to-end portfolio refresh against the local mock exchange.
+
+Runs full account setups for Coinbase and KuCoin accounts and a whole
+portfolio refresh against benchmarks/mockexchange.py, cold (empty
+cache) and then warm (cache from the cold run):
+
+    python benchmarks/refresh.py --entries 5000 --latency 0.02
+
+Reports wall time, request count, 429 responses and peak memory for
+each scenario, then where the time went per query and setup stage.
+"""
+import os
+import sys
+import time
+import argparse
+import resource
+import tempfile
+import tracemalloc
+import pandas as pd
+
+# repository root:
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import cbpro._api
+import kucoin._api
+from cbpro.account import account as cbaccount
+from kucoin.account import account as kuaccount
+from portfolio import portfolio
+from common._store import set_cache_dir
+from common._memo import price_memo
+import common._instrument as instrument
+from mockexchange import mockexchange
+
+COINS = ["BTC","ETH","SOL","ADA","DOT","LINK","ATOM","ALGO","XTZ","UNI"]
+
+def write_keyfile(path):
+    # the mock exchange does not check signatures:
+    with open(path,"w") as of:
+        of.write("key\nc2VjcmV0\npassphrase\n")
+
+def make_cbpro(coin,keyfile):
+    return cbaccount(coin,"%s-account"%coin.lower(),keyfile)
+
+def make_kucoin(coin,keyfile,start,end):
+    account = kuaccount(coin,keyfile,verbose=False)
+    account.set_date_range(start,end)
+    return account
+
+def make_portfolio(args,keyfile):
+    lcc = portfolio("benchmark")
+    for coin in COINS[:args.cbpro_accounts]:
+        lcc.register_account(make_cbpro(coin,keyfile))
+    for coin in COINS[:args.kucoin_accounts]:
+        lcc.register_account(make_kucoin(coin,keyfile,args.start,args.end))
+    return lcc
+
+def run(name,mock,fn):
+    price_memo.clear()
+    mock.reset_stats()
+    tracemalloc.start()
+    ti = time.perf_counter()
+    fn()
+    seconds = time.perf_counter()-ti
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    stats = mock.stats()
+    return {
+        "scenario": name,
+        "seconds": seconds,
+        "requests": stats["requests"],
+        "rejected": stats["rejected"],
+        "peak_mb": peak/2**20,
+        }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--entries",type=int,default=2000,
+        help="ledger entries per account")
+    parser.add_argument("--start",default="2021-01-01")
+    parser.add_argument("--end",default="2021-07-01")
+    parser.add_argument("--latency",type=float,default=0.01,
+        help="seconds added to every response")
+    parser.add_argument("--rate-limit",type=int,default=None,
+        help="requests per second before the server answers 429")
+    parser.add_argument("--cbpro-accounts",type=int,default=3)
+    parser.add_argument("--kucoin-accounts",type=int,default=2)
+    parser.add_argument("--trace",default=None,
+        help="also write every query and stage event to this file")
+    args = parser.parse_args()
+
+    mock = mockexchange(
+        entries=args.entries,
+        start=args.start,
+        end=args.end,
+        latency=args.latency,
+        rate_limit=args.rate_limit,
+        )
+    rows = []
+    sinks = [instrument.histogram()]
+    if args.trace is not None:
+        sinks.append(instrument.jsonlsink(args.trace))
+    for sink in sinks:
+        instrument.add_sink(sink)
+    with tempfile.TemporaryDirectory() as tmp, mock:
+        cbpro._api.ENDPOINT = mock.url
+        kucoin._api.BASE_URL = mock.url
+        keyfile = os.path.join(tmp,"mock.secret")
+        write_keyfile(keyfile)
+        set_cache_dir(os.path.join(tmp,"cache"))
+
+        def refresh_portfolio():
+            lcc = make_portfolio(args,keyfile)
+            lcc.load_accounts()
+            lcc.aggregate_accounts()
+
+        scenarios = [
+            ("cbpro account",
+                lambda: make_cbpro("BTC",keyfile).standard_setup()),
+            ("kucoin account",
+                lambda: make_kucoin("BTC",keyfile,args.start,args.end
+                    ).standard_setup()),
+            ("portfolio",refresh_portfolio),
+            ]
+        for state in ["cold","warm"]:
+            for name,fn in scenarios:
+                row = run(name,mock,fn)
+                row["cache"] = state
+                rows.append(row)
+
+    report = pd.DataFrame(rows).set_index(["cache","scenario"])
+    print()
+    print(report.round(3).to_string())
+    print("max rss: %.1f MB"%(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024,
+        ))
+    print()
+    summary = sinks[0].summary()
+    print(summary[[
+        "count","seconds","p50","p95","wait","transfer","decode","bytes","retries",
+        ]].round(4).to_string())
+    for sink in sinks:
+        instrument.remove_sink(sink)
+        sink.close()
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,105 @@
+"""Request signing: per-request key setup vs. cached credentials.
+
+Signs the same requests with the previous per-request code (decoding
+the Coinbase secret and re-signing the KuCoin passphrase every time)
+and with the credentials built once by read_keyfile, checks both
+produce identical headers, and times each:
+
+    python benchmarks/signing.py [count]
+"""
+import os
+import sys
+import time
+import argparse
+import hmac
+import base64
+import hashlib
+
+# repository root:
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import cbpro._api
+import kucoin._api
+
+API_KEY = "0123456789abcdef0123456789abcdef"
+API_SECRET = base64.b64encode(b"s"*64).decode()
+API_PASSPHRASE = "passphrase"
+REQUEST_PATH = "/accounts/3f4d6a1b-6f1e-4c2b-9b8a-1c2d3e4f5a6b/ledger?limit=100&after=123456"
+
+def cbpro_headers(method,request_path,body,timestamp):
+    # previous cbpro apiwrapper._auth_headers:
+    hmac_key = base64.b64decode(API_SECRET)
+    message = timestamp + method + request_path + body
+    message = message.encode('ascii')
+    signature = hmac.new(
+        hmac_key,
+        message,
+        hashlib.sha256,
+        )
+    signature_b64 = base64.b64encode(
+        signature.digest()
+        ).decode('utf-8')
+    return {
+        "CB-ACCESS-KEY": API_KEY,
+        "CB-ACCESS-SIGN": signature_b64,
+        "CB-ACCESS-TIMESTAMP": timestamp,
+        "CB-ACCESS-PASSPHRASE": API_PASSPHRASE,
+        }
+
+def kucoin_headers(method,request_path,body,timestamp):
+    # previous kucoin apiwrapper._auth_headers:
+    str_to_sign = timestamp + method + request_path + body
+    signature = base64.b64encode(
+        hmac.new(
+            API_SECRET.encode('utf-8'),
+            str_to_sign.encode('utf-8'),
+            hashlib.sha256,
+            ).digest()
+        ).decode('utf-8')
+    passphrase = base64.b64encode(
+        hmac.new(
+            API_SECRET.encode('utf-8'),
+            API_PASSPHRASE.encode('utf-8'),
+            hashlib.sha256,
+            ).digest()
+        ).decode('utf-8')
+    return {
+        "KC-API-SIGN": signature,
+        "KC-API-TIMESTAMP": timestamp,
+        "KC-API-KEY": API_KEY,
+        "KC-API-PASSPHRASE": passphrase,
+        "KC-API-KEY-VERSION": "2",
+        }
+
+def timed(sign,count,timestamps):
+    ti = time.perf_counter()
+    for ii in range(count):
+        sign("GET",REQUEST_PATH,"",timestamps[ii%len(timestamps)])
+    return time.perf_counter()-ti
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("count",type=int,nargs="?",default=100000,
+        help="requests to sign")
+    args = parser.parse_args()
+    count = args.count
+    timestamps = [str(1700000000000+ii) for ii in range(1000)]
+    for name,old,module in [
+        ("cbpro",cbpro_headers,cbpro._api),
+        ("kucoin",kucoin_headers,kucoin._api),
+        ]:
+        cached = module.credentials(API_KEY,API_SECRET,API_PASSPHRASE)
+        new = lambda method,path,body,ts: cached.headers(method,path,body,timestamp=ts)
+        for ts in timestamps[:10]:
+            assert old("GET",REQUEST_PATH,"",ts)==new("GET",REQUEST_PATH,"",ts)
+            assert old("POST","/orders",'{"size":"1"}',ts)==new("POST","/orders",'{"size":"1"}',ts)
+        before = timed(old,count,timestamps)
+        after = timed(new,count,timestamps)
+        print("%-7s %d signatures: per-request keys %.3f s (%.2f us), cached %.3f s (%.2f us), %.1fx"%(
+            name,
+            count,
+            before,
+            1e6*before/count,
+            after,
+            1e6*after/count,
+            before/after,
+            ))
@@ -0,0 +1,84 @@
+"""Candle slice planning: full date_range slicing vs. arithmetic plan.
+
+Checks that plan_slices tiles minute ranges spanning years with
+requests the exchanges accept (no gaps, no overlap, none too large),
+times it against slicing a materialized pd.date_range, and downloads
+ranges spanning many slices from the mock exchange for both
+exchanges. The checks are shared with tests/test_slices.py:
+
+    python benchmarks/slices.py [years]
+"""
+import os
+import sys
+import time
+import argparse
+import pandas as pd
+
+# repository root:
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import cbpro._api
+import kucoin._api
+from common._candles import plan_slices
+from common._store import set_cache_dir
+from mockexchange import mockexchange
+from tests.test_slices import EXCHANGES, check_plan, check_candles
+
+def date_range_slices(start,end,granularity,max_candles):
+    # materialize every candle open time, then cut it into slices:
+    index = pd.date_range(start,end,freq="%ds"%granularity)
+    return [
+        (index[ii],index[min(ii+max_candles,len(index))-1])
+        for ii in range(0,len(index),max_candles)
+        ]
+
+def timed(fn,*args):
+    ti = time.perf_counter()
+    results = fn(*args)
+    return results,time.perf_counter()-ti
+
+def check_exchanges():
+    set_cache_dir(None)
+    for bucket in list(cbpro._api.buckets.values())+list(kucoin._api.buckets.values()):
+        bucket.rate = bucket.capacity = bucket._tokens = 1e6
+    with mockexchange() as mock:
+        cbpro._api.ENDPOINT = mock.url
+        kucoin._api.BASE_URL = mock.url
+        for exchange in EXCHANGES:
+            mock.reset_stats()
+            df,seconds = timed(check_candles,*exchange)
+            print("%-17s %d candles, %d requests, %.2f s"%(
+                exchange[0]+":",
+                len(df),
+                mock.stats()["requests"],
+                seconds,
+                ))
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("years",type=int,nargs="?",default=5,
+        help="span of the planned ranges")
+    args = parser.parse_args()
+    years = args.years
+    start = pd.Timestamp("2015-01-01")
+    end = start + pd.DateOffset(years=years) - pd.Timedelta(minutes=1)
+    num_candles = int((end-start).total_seconds()//60)+1
+    print("minute candles:   %d over %d years"%(num_candles,years))
+    for max_candles in [300,1499,1500]:
+        slices,new = timed(plan_slices,start,end,60,max_candles)
+        check_plan(slices,start,end,60,max_candles)
+        old_slices,old = timed(date_range_slices,start,end,60,max_candles)
+        assert old_slices==slices
+        print("%4d per request: %d slices, date_range %.3f s, planned %.3f s"%(
+            max_candles,
+            len(slices),
+            old,
+            new,
+            ))
+
+    # edge cases the old slicing got wrong (exact multiples and a
+    # single candle):
+    for count in [1,299,300,301,600,1500]:
+        end = start + pd.Timedelta(minutes=count-1)
+        check_plan(plan_slices(start,end,60,300),start,end,60,300)
+    print("edge cases:       ok")
+    check_exchanges()
@@ -0,0 +1,118 @@
+"""Peak memory of loading a ledger: whole vs. streamed per day.
+
+Serves one large Coinbase and one large KuCoin ledger from the mock
+exchange, then runs get_ledger and extract_balance_sheet on both
+accounts, once holding the whole ledger (the default) and once with
+stream_frequency="D", each in a fresh process so the server's own
+allocations are not counted. Checks both modes give the same balance
+sheets:
+
+    python benchmarks/streaming.py [entries]
+"""
+import os
+import sys
+import argparse
+import pickle
+import tempfile
+import resource
+import subprocess
+import tracemalloc
+import pandas as pd
+
+# repository root:
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import cbpro._api
+import kucoin._api
+from common._store import set_cache_dir
+from mockexchange import mockexchange
+from refresh import write_keyfile, make_cbpro, make_kucoin
+
+START = "2021-01-01"
+END = "2022-01-01"
+
+def run(mode,url,output):
+    cbpro._api.ENDPOINT = url
+    kucoin._api.BASE_URL = url
+    for bucket in list(cbpro._api.buckets.values())+list(kucoin._api.buckets.values()):
+        bucket.rate = bucket.capacity = bucket._tokens = 1e6
+    set_cache_dir(None)
+    keyfile = os.path.join(tempfile.mkdtemp(),"api.secret")
+    write_keyfile(keyfile)
+    end = (pd.Timestamp(END) - pd.Timedelta(days=1)).date()
+    accounts = [
+        make_cbpro("BTC",keyfile),
+        make_kucoin("BTC",keyfile,START,end),
+        ]
+    results = {}
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    tracemalloc.start()
+    for account in accounts:
+        if mode=="stream":
+            account.stream_frequency = "D"
+        account.get_ledger(sync=False)
+        account.extract_balance_sheet()
+        results[type(account).__module__] = (
+            len(account.ledger),
+            account.balance_sheet,
+            )
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    with open(output,"wb") as of:
+        pickle.dump(results,of)
+    print("%s %d %d %d"%(mode,peak,baseline,rss))
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("entries",type=int,nargs="?",default=200000,
+        help="ledger entries per account")
+    # run one mode against a running mock exchange in this process
+    # (how each mode is started):
+    parser.add_argument("--mode",choices=["whole","stream"],
+        help=argparse.SUPPRESS)
+    parser.add_argument("--url",help=argparse.SUPPRESS)
+    parser.add_argument("--output",help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.mode is not None:
+        run(args.mode,args.url,args.output)
+        sys.exit()
+    entries = args.entries
+    print("ledger entries per account: %d"%entries)
+    sheets = {}
+    with mockexchange(entries=entries,start=START,end=END) as mock:
+        for mode in ["whole","stream"]:
+            output = os.path.join(tempfile.mkdtemp(),"results.pickle")
+            mock.reset_stats()
+            lines = subprocess.run(
+                [
+                    sys.executable,__file__,
+                    "--mode",mode,
+                    "--url",mock.url,
+                    "--output",output,
+                    ],
+                capture_output=True,
+                text=True,
+                check=True,
+                ).stdout.split("\n")
+            mode,peak,baseline,rss = lines[-2].split()
+            with open(output,"rb") as f:
+                sheets[mode] = pickle.load(f)
+            print("%-6s ledger: peak %.0f MB, max RSS %.0f MB (%.0f MB above setup), %d requests, rows kept %s"%(
+                mode,
+                int(peak)/2**20,
+                int(rss)/1024,
+                (int(rss)-int(baseline))/1024,
+                mock.stats()["requests"],
+                ", ".join(
+                    "%s %d"%(name,rows)
+                    for name,(rows,df) in sheets[mode].items()
+                    ),
+                ))
+    for name,(rows,df) in sheets["whole"].items():
+        pd.testing.assert_frame_equal(
+            df,
+            sheets["stream"][name][1],
+            rtol=1e-9,
+            check_freq=False,
+            )
+    print("balance sheets match")
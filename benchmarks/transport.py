@@ -0,0 +1,58 @@
+"""Requests per second of the pooled transport vs. the curl fallback.
+
+Runs against a local stand-in server so no exchange is contacted:
+
+    python benchmarks/transport.py [num_requests]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# repository root:
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import cbpro._api
+from cbpro._api import apiwrapper
+
+class standin(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    payload = json.dumps([{"id": ii, "balance": "1.0"} for ii in range(100)]).encode()
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type","application/json")
+        self.send_header("Content-Length",str(len(self.payload)))
+        self.end_headers()
+        self.wfile.write(self.payload)
+
+    def log_message(self,*args):
+        pass
+
+def run(api,num_requests):
+    ti = time.perf_counter()
+    for ii in range(num_requests):
+        api.query("/accounts/1/ledger")
+    return num_requests/(time.perf_counter()-ti)
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("num_requests",type=int,nargs="?",default=500,
+        help="requests per transport")
+    args = parser.parse_args()
+    num_requests = args.num_requests
+    server = ThreadingHTTPServer(("127.0.0.1",0),standin)
+    threading.Thread(target=server.serve_forever,daemon=True).start()
+    endpoint = "http://127.0.0.1:%d"%server.server_address[1]
+
+    # measure the transport, not Coinbase's request budget:
+    for bucket in cbpro._api.buckets.values():
+        bucket.rate = bucket.capacity = bucket._tokens = 1e6
+    for name in ["http","curl"]:
+        api = apiwrapper(endpoint=endpoint,transport=name)
+        n = num_requests if name=="http" else max(num_requests//10,10)
+        print("%-5s %8.1f requests/second"%(name,run(api,n)))
+    server.shutdown()
@@ -1,30 +1,78 @@
 import numpy as np
 import pandas as pd
-from subprocess import Popen, PIPE, run
 import json
 from datetime import datetime
 
+# HTTP transport and rate limiting:
+import common._transport as transport
+from common._stream import prefetched
+from common._ratelimit import tokenbucket
+import common._instrument as instrument
+
 # API authentification:
 import time
-import hmac
-import hashlib
 import base64
+from common._signing import hmacsigner
+
+# Coinbase request budgets as (requests per second, burst). One
+# bucket per endpoint class is shared by every apiwrapper in the
+# process:
+RATE_LIMITS = {
+    "public": (10,15),
+    "private": (15,30),
+    }
+PUBLIC_PREFIXES = [
+    "/products",
+    "/currencies",
+    "/time",
+    ]
+buckets = {
+    name: tokenbucket(name,rate,burst)
+    for name,(rate,burst) in RATE_LIMITS.items()
+    }
+
+def rate_limit_bucket(request_path):
+    for prefix in PUBLIC_PREFIXES:
+        if request_path.startswith(prefix):
+            return buckets["public"]
+    return buckets["private"]
+
+def rate_limit_stats():
+    """Requests, waits, 429s and seconds spent waiting per bucket."""
+    return pd.DataFrame({
+        name: bucket.stats() for name,bucket in buckets.items()
+        }).transpose()
+
+# default REST endpoint; point it elsewhere (e.g. a local stand-in
+# server) to redirect every wrapper created afterwards:
+ENDPOINT = "https://api.exchange.coinbase.com"
+
+# websocket market data feed, redirected the same way:
+WEBSOCKET_URL = "wss://ws-feed.exchange.coinbase.com"
 
 # API documentation:
 # https://docs.cloud.coinbase.com/exchange/reference
 class apiwrapper:
     def __init__(
         self,
-        endpoint="https://api.exchange.coinbase.com",
+        endpoint=None,
+        transport=None,
+        max_retries=5,
         ):
-        self.endpoint=endpoint
+        self.endpoint=ENDPOINT if endpoint is None else endpoint
+        self.transport=transport
+        self.max_retries=max_retries
         self.api_key_file = None
+        self.credentials = None
     
     def read_keyfile(
         self,
         api_key_file,
         ):
-        self._read_api_key(api_key_file)
+        # public-only wrappers (and accounts restored with load)
+        # have no key file:
+        if api_key_file is not None:
+            self._read_api_key(api_key_file)
 
     def query(
         self,
@@ -33,65 +81,159 @@ class apiwrapper:
         method="GET",
         debug=False,
         ):
+        return self._request(request_path,body,method,debug).json()
+
+    def iter_pages(
+        self,
+        request_path,
+        before=None,
+        limit=100,
+        prefetch=True,
+        ):
+        """Yield each page of a paginated endpoint as it arrives.
+
+        Without `before`, pages are followed from newest to oldest
+        through the CB-AFTER cursor. With `before`, only entries newer
+        than that cursor are returned, following CB-BEFORE. With
+        `prefetch` the next page downloads while the caller works on
+        the current one.
+        """
+        pages = self._walk_pages(request_path,before,limit)
+        if prefetch:
+            pages = prefetched(pages)
+        return pages
+
+    def _walk_pages(self,request_path,before,limit):
+        if before is None:
+            direction,header,cursor = "after","CB-AFTER",None
+        else:
+            direction,header,cursor = "before","CB-BEFORE",before
+        separator = "&" if "?" in request_path else "?"
+        while True:
+            options = ["limit=%d"%limit]
+            if cursor is not None:
+                options.append("%s=%s"%(direction,cursor))
+            resp = self._request("%s%s%s"%(
+                request_path,
+                separator,
+                "&".join(options),
+                ))
+            page = resp.json()
+            if len(page)==0:
+                return
+            yield page
+            cursor = resp.headers.get(header)
+            if cursor is None or len(page) < limit:
+                return
+
+    def _request(
+        self,
+        request_path,
+        body="",
+        method="GET",
+        debug=False,
+        ):
         
         # create query:
         url = "%s%s"%(self.endpoint,request_path)
-        unauth_cmd = [
-            "curl",
-            url,
-            "--header",
-            "Accept: application/json",
-            "--header",
-            "Content-Type: application/json",
-            ]
-        auth_cmd = self._auth_commands(method,request_path,body)
-        cmd = unauth_cmd + auth_cmd    
-        
-        # print bash curl argument if debug is True:
-        if debug:
-            print(" ".join(cmd))
+        headers = {
+            "Accept": "application/json",
+            "Content-Type": "application/json",
+            }
         
-        # submit query and return answer in JSON:  
-        p = Popen(cmd,stdout=PIPE,stderr=PIPE)
-        stdout,stderr = p.communicate()
-        return json.loads(stdout)
+        # submit query through the endpoint's rate limit bucket,
+        # backing off and resubmitting while Coinbase answers 429:
+        bucket = rate_limit_bucket(request_path)
+        ti = time.perf_counter()
+        wait = 0.0
+        for attempt in range(self.max_retries+1):
+            wait += bucket.acquire()
+            headers.update(self._auth_headers(method,request_path,body))
+            
+            # print equivalent bash curl argument if debug is True:
+            if debug:
+                print(" ".join(transport.curl_command(method,url,headers,body)))
+            
+            resp = transport.request(
+                method,
+                url,
+                headers,
+                body,
+                transport=self.transport,
+                )
+            if resp.status!=429:
+                break
+            bucket.backoff()
+        if instrument.active:
+            self._record_query(method,request_path,body,resp,ti,wait,attempt)
+        return resp
+
+    def _record_query(self,method,request_path,body,resp,ti,wait,retries):
+        # decode here so the JSON time is measured; the parsed
+        # payload is kept on the response for the caller:
+        tt = time.perf_counter()
+        try:
+            resp.json()
+        except ValueError:
+            pass
+        tf = time.perf_counter()
+        instrument.query_event(
+            "cbpro",
+            method,
+            request_path,
+            resp.status,
+            tf-ti,
+            wait,
+            tt-ti-wait,
+            tf-tt,
+            len(resp.body),
+            len(body),
+            retries,
+            )
         
     def _read_api_key(
         self,
         api_key_file,
         ):
         self.api_key_file=api_key_file  
-        with open(self.api_key_file,"r") as of:
-            self.API_KEY = of.readline().rstrip()
-            self.API_SECRET = of.readline().rstrip()
-            self.API_PASSPHRASE = of.readline().rstrip()
-
-    def _auth_commands(self,method,request_path,body):
-        if self.api_key_file!=None:
-            hmac_key = base64.b64decode(self.API_SECRET)
+        self.credentials = credentials.from_keyfile(api_key_file)
+        self.API_KEY = self.credentials.api_key
+        self.API_SECRET = self.credentials.api_secret
+        self.API_PASSPHRASE = self.credentials.api_passphrase
+
+    def _auth_headers(self,method,request_path,body):
+        if self.credentials is None:
+            return {}
+        return self.credentials.headers(method,request_path,body)
+
+class credentials:
+    def __init__(
+        self,
+        api_key,
+        api_secret,
+        api_passphrase,
+        ):
+        """Coinbase API key, decoded and keyed once for signing."""
+        self.api_key = api_key
+        self.api_secret = api_secret
+        self.api_passphrase = api_passphrase
+        self._signer = hmacsigner(base64.b64decode(api_secret))
+        self.static_headers = {
+            "CB-ACCESS-KEY": api_key,
+            "CB-ACCESS-PASSPHRASE": api_passphrase,
+            }
+
+    @classmethod
+    def from_keyfile(cls,api_key_file):
+        # key, secret and passphrase on the first three lines:
+        with open(api_key_file,"r") as of:
+            return cls(*[of.readline().rstrip() for ii in range(3)])
+
+    def headers(self,method,request_path,body="",timestamp=None):
+        if timestamp is None:
             timestamp = str(time.time())
-            message = timestamp + method + request_path + body
-            message = message.encode('ascii')
-            signature = hmac.new(
-                hmac_key,
-                message,
-                hashlib.sha256,
-                )
-            signature_b64 = base64.b64encode(
-                signature.digest()
-                ).decode('utf-8')
-            
-            # commands:
-            auth_cmd = [
-                "--header",
-                "CB-ACCESS-KEY: %s"%self.API_KEY,
-                "--header",
-                "CB-ACCESS-SIGN: %s"%signature_b64,
-                "--header",
-                "CB-ACCESS-TIMESTAMP: %s"%timestamp,
-                "--header",
-                "CB-ACCESS-PASSPHRASE: %s"%self.API_PASSPHRASE,
-                ]
-        else:
-            auth_cmd = []
-        return auth_cmd
+        message = (timestamp + method + request_path + body).encode("ascii")
+        headers = dict(self.static_headers)
+        headers["CB-ACCESS-SIGN"] = self._signer.sign(message)
+        headers["CB-ACCESS-TIMESTAMP"] = timestamp
+        return headers
@@ -7,41 +7,95 @@ from datetime import datetime
 from cbpro.markets import price_history
 from cbpro._api import apiwrapper
 import cbpro._utilities as utils
+from common._sync import default_store, resume_from, carry_head, first_change
+from common._store import save_frames, load_frames
+from common._stream import periodaccumulator
+from common._datasets import dataset, invalidate, computed, readonly
+from common._ticker import revalue
+import common._instrument as instrument
 
 # Pandas Index Slices:
 idx = pd.IndexSlice
 
+# datasets kept by each account, derived lazily on first access (see
+# common._datasets). Their return_* accessors hand out read-only
+# frames sharing the stored data, so writing into one raises; pass
+# copy=True for a private, mutable copy:
+DATASETS = [
+    "ledger",
+    "usd_fills",
+    "deposits",
+    "balance_sheet",
+    "performance_data",
+    ]
+
+def list_accounts(api_key_file):
+    """Every account of the key's profile, indexed by currency.
+
+    One request lists them all; Coinbase returns an account for each
+    currency it supports, most of them empty.
+    """
+    cbapi = apiwrapper()
+    cbapi.read_keyfile(api_key_file)
+    df = pd.DataFrame.from_records(
+        cbapi.query("/accounts"),
+        columns=["id","currency","balance","available","hold"],
+        )
+    for col in ["balance","available","hold"]:
+        df[col] = df[col].to_numpy().astype(np.float64)
+    return df.set_index("currency")
+
 # accounts class:
 class account(
     apiwrapper,
     ):
+    # the ledger also sets the date range the others cover:
+    ledger = dataset("get_ledger")
+    usd_fills = dataset("get_usd_fills")
+    deposits = dataset("extract_deposits",["ledger","usd_fills"])
+    balance_sheet = dataset("extract_balance_sheet",["ledger"])
+    performance_data = dataset(
+        "extract_performance",
+        ["deposits","balance_sheet"],
+        )
+
+    # columns the deposits and balance sheet read, all that is sent
+    # to a worker process deriving them:
+    DERIVED_FROM = {
+        "ledger": ["balance"],
+        "usd_fills": ["side","usd_volume"],
+        }
+
     def __init__(
         self,
         name,
         account_id,
         api_key_file=None,
+        stream_frequency=None,
         ):
         apiwrapper.__init__(self)
         self.read_keyfile(api_key_file)
         self.name = name
         self.account_id = account_id
-        self.ledger=pd.DataFrame()
-        self.usd_fills=pd.DataFrame()
-        self.deposits=pd.DataFrame()
-        self.balance_sheet=pd.DataFrame()
-        self.performance_data=pd.DataFrame()
+
+        # with a fixed frequency (e.g. "D") the ledger is streamed
+        # and kept as one row per period: the last entry's id and
+        # balance and the summed amount. Derive datasets at that
+        # frequency or coarser:
+        self.stream_frequency = stream_frequency
+        self.usd_pair = "%s-USD"%name
+        self._store=None
+        self._ledger_tail=None
         self._url_setup()
 
     def standard_setup(self):
+        # derive everything afresh; the final dataset pulls in the
+        # stages it depends on:
+        invalidate(self)
         if self.name=="USD":
-            self.get_ledger()
-            self.extract_balance_sheet()
+            self.return_balance_sheet()
         else:
-            self.get_ledger()
-            self.get_usd_fills()
-            self.extract_deposits()
-            self.extract_balance_sheet()
-            self.extract_performance()
+            self.return_performance_data()
 
     def save_as_spreadsheet(self,loc):
         fi = "%s/%s-cbpro-data.xlsx"%(loc,self.name)
@@ -57,36 +111,104 @@ class account(
             balance_sheet.to_excel(writer,sheet_name="balance_sheet")
             perf.to_excel(writer,sheet_name="portfolio_performance")
 
-    def get_ledger(self):
+    def save(self,loc):
+        """Store every dataset in the columnar frame store."""
+        frames = {}
+        for name in DATASETS:
+            if not computed(self,name):
+                continue
+            df = getattr(self,name)
+            if type(df) is pd.DataFrame:
+                frames[name] = df
+        attrs = {
+            "name": self.name,
+            "account_id": self.account_id,
+            "start_date": getattr(self,"start_date",None),
+            "end_date": getattr(self,"end_date",None),
+            }
+        path = "%s/%s-cbpro-data"%(loc,self.name)
+        save_frames(path,frames,attrs)
+
+    def load(self,loc,mmap=True):
+        """Restore datasets written by save, memory-mapped by default."""
+        path = "%s/%s-cbpro-data"%(loc,self.name)
+        frames,attrs = load_frames(path,mmap=mmap)
+        if frames is None:
+            raise FileNotFoundError("no saved account data in %s"%path)
+        for name,df in frames.items():
+            setattr(self,name,df)
+        for name in ["start_date","end_date"]:
+            if attrs[name] is not None:
+                setattr(self,name,pd.Timestamp(attrs[name]).date())
+
+    @instrument.stage
+    def get_ledger(self,sync=True):
+        # with sync enabled the ledger persisted by the last run is
+        # reused and only entries newer than its highest id are
+        # requested. Pages are parsed as they arrive:
+        self._store = default_store() if sync else None
+        stored = None
+        if self._store is not None:
+            stored,attrs = self._store.load("cbpro",self._sync_key())
         try:
-            query_output = self.query(self.LEDGER_URL)
-            self._setup_ledger(query_output)
+            if stored is None:
+                pages = self.iter_pages(
+                    self.LEDGER_URL,
+                    limit=self.PAGE_LIMIT,
+                    )
+                if self.stream_frequency is not None:
+                    ledger = self._stream_ledger(pages)
+                else:
+                    ledger = pd.concat([self._parse_ledger(p) for p in pages])
+                self._ledger_tail = None
+            else:
+                pages = self.iter_pages(
+                    self.LEDGER_URL,
+                    before=attrs["last_id"],
+                    limit=self.PAGE_LIMIT,
+                    )
+                if self.stream_frequency is not None:
+                    compact = self._stream_ledger(pages)
+                    frames = [compact] if len(compact) > 0 else []
+                else:
+                    frames = [self._parse_ledger(p) for p in pages]
+                ledger = self._append_ledger(stored,frames)
+            self._setup_ledger(ledger)
+            self._save_synced(
+                "ledger",
+                ledger,
+                {"last_id": int(ledger.id.max())},
+                )
             print("%s account loaded successfully..."%self.name)
         except:
             self.ledger = None
             print("%s account empty..."%self.name)
 
-    def return_ledger(self):
+    def return_ledger(self,copy=False):
         if type(self.ledger) is pd.DataFrame:
-            return self.ledger.copy()
+            return self.ledger.copy() if copy else readonly(self.ledger)
         else:
             return None
 
+    @instrument.stage
     def get_usd_fills(self):
-        query_output = self.query(self.USD_FILLS_URL)
-        self._setup_fills(query_output)
+        pages = self.iter_pages(
+            self.USD_FILLS_URL,
+            limit=self.PAGE_LIMIT,
+            )
+        self.usd_fills = pd.concat([self._parse_fills(p) for p in pages])
     
-    def return_usd_fills(self):
+    def return_usd_fills(self,copy=False):
         if type(self.usd_fills) is pd.DataFrame:
-            return self.usd_fills.copy()
+            return self.usd_fills.copy() if copy else readonly(self.usd_fills)
         else:
             return None
 
+    @instrument.stage
     def extract_deposits(self):
         usd_fills = self.return_usd_fills()
-        sell_idx = usd_fills[usd_fills.side=="sell"].index
-        usd_fills.loc[sell_idx,"usd_volume"] *= -1.0
-        usd_fills = usd_fills.resample("D").sum()
+        sign = np.where(usd_fills.side=="sell",-1.0,1.0)
+        usd_volume = (usd_fills.usd_volume*sign).resample("D").sum()
         cols = [
             "usd",
             "coin",
@@ -96,16 +218,17 @@ class account(
             start=self.start_date,
             end=self.end_date,
             )
-        tdates = usd_fills.index
-        deposits.loc[tdates,"usd"] = usd_fills.usd_volume
+        tdates = usd_volume.index
+        deposits.loc[tdates,"usd"] = usd_volume
         self.deposits = deposits
 
-    def return_deposits(self):
+    def return_deposits(self,copy=False):
         if type(self.deposits) is pd.DataFrame:
-            return self.deposits.copy()
+            return self.deposits.copy() if copy else readonly(self.deposits)
         else:
             return None
 
+    @instrument.stage
     def extract_balance_sheet(self,frequency="D"):
         col = "num_%s"%self.name
         df = utils.new_history_df(
@@ -114,85 +237,168 @@ class account(
             end=self.end_date,
             frequency=frequency,
             )
-        ledger = self.return_ledger().resample(frequency).last()
-        df.loc[ledger.index,col] = ledger.balance.copy()
+        ledger = self.return_ledger()
+
+        # reuse the stored balance sheet up to the appended tail:
+        old = self._load_synced("balance_sheet")
+        since = resume_from(old,df.index,self._ledger_tail)
+        if since is not None:
+            carry_head(df,old,since,[col])
+            ledger = ledger[ledger.index >= since]
+
+        # oldest first, so entries sharing a timestamp end on the
+        # latest one:
+        balance = ledger.balance.iloc[::-1].resample(frequency).last()
+        df.loc[balance.index,col] = balance
         df = df.ffill()
         self.balance_sheet = df
+        self._save_synced("balance_sheet",df)
 
-    def return_balance_sheet(self):
+    def return_balance_sheet(self,copy=False):
         if type(self.balance_sheet) is pd.DataFrame:
-            return self.balance_sheet.copy()
+            return self.balance_sheet.copy() if copy else readonly(self.balance_sheet)
         else:
             return None    
 
+    @instrument.stage
     def extract_performance(
         self,
         granularity=86400, #daily
         ):
-        ph = price_history(
-            pair="%s-USD"%self.name,
-            start=self.start_date,
-            end=self.end_date,
-            granularity=granularity,
-            )
         cols = [
             "usd_deposits",
             "number_of_coins",
+            "coin_price",
             ]
         df = utils.new_history_df(
             cols,
             start=self.start_date,
             end=self.end_date,
             )
-        deposits = self.return_deposits()
-        ledger = self.return_ledger().resample("D").last()
-        df.loc[deposits.index,"usd_deposits"] = deposits.usd.cumsum()
-        df.loc[ledger.index,"number_of_coins"] = ledger.balance.copy()
-        df["coin_price"] = ph.open.copy()
+        deposits = self.return_deposits().usd.cumsum()
+        balance_sheet = self.return_balance_sheet()
+
+        # reuse the stored performance data up to the appended
+        # ledger tail or the first day the deposits changed:
+        old = self._load_synced("performance_data")
+        since = resume_from(old,df.index,self._ledger_tail)
+        if since is not None:
+            since = min(since,first_change(old.usd_deposits,deposits.ffill()))
+            carry_head(df,old,since,cols)
+        else:
+            since = df.index[0]
+        ph = price_history(
+            pair="%s-USD"%self.name,
+            start=since,
+            end=self.end_date,
+            granularity=granularity,
+            )
+        deposits = deposits.loc[since:]
+        num_coins = balance_sheet["num_%s"%self.name].loc[since:]
+        df.loc[deposits.index,"usd_deposits"] = deposits
+        df.loc[num_coins.index,"number_of_coins"] = num_coins
+        tail = df.index >= since
+        df.loc[tail,"coin_price"] = ph.open.reindex(df.index[tail]).values
         df = df.ffill()
         df["coin_usd_value"] = df.coin_price*df.number_of_coins
         df["performance"] = df.coin_usd_value/df.usd_deposits
         self.performance_data = df
+        self._save_synced("performance_data",df)
     
-    def return_performance_data(self):
+    def set_live_price(self,price):
+        # value the latest row at a streamed price, in place. Nothing
+        # is derived or downloaded when there is no data yet:
+        if computed(self,"performance_data"):
+            revalue(self.performance_data,price)
+
+    def return_performance_data(self,copy=False):
         if type(self.performance_data) is pd.DataFrame:
-            return self.performance_data.copy()
+            return self.performance_data.copy() if copy else readonly(self.performance_data)
         else:
             return None
 
-    def _setup_ledger(self,query_output):
-        df = pd.DataFrame(query_output)
-        df.loc[:,"id"] = df.id.apply(int)
+    def _parse_ledger(self,query_output):
+        df = pd.DataFrame.from_records(query_output)
+        df["id"] = df.id.to_numpy().astype(np.int64)
         self._unnest_dict(df)
         self._correct_datetime(df)
         for col in ["amount","balance"]:
-            df.loc[:,col] = df[col].apply(float)
-        self.ledger=df.set_index("created_at")
-        self.start_date = df.created_at.iloc[-1].date()
+            df[col] = df[col].to_numpy().astype(np.float64)
+        return df.set_index("created_at")
+
+    def _stream_ledger(self,pages):
+        # reduce each page to per-period rows as it arrives, so the
+        # full ledger is never held; newest first like the API:
+        periods = periodaccumulator(
+            self.stream_frequency,
+            last=["id","balance"],
+            sums=["amount"],
+            order="id",
+            )
+        for page in pages:
+            periods.add(self._parse_ledger(page)[["id","amount","balance"]])
+        return periods.result().rename_axis("created_at").iloc[::-1]
+
+    def _append_ledger(self,stored,frames):
+        # new entries go on top, matching the API's newest-first
+        # order (later pages of a `before` walk are newer), and the
+        # tail start marks what has to be derived again:
+        if len(frames)==0:
+            self._ledger_tail = pd.Timestamp(datetime.now())
+            return stored
+        new = pd.concat(frames[::-1])
+        new = new[~new.id.isin(stored.id)]
+        self._ledger_tail = new.index.min()
+        return pd.concat([new,stored])
+
+    def _setup_ledger(self,ledger):
+        self.ledger=ledger
+        self.start_date = ledger.index[-1].date()
         self.end_date = datetime.now().date()
+
+    def _sync_key(self):
+        # streamed ledgers are stored apart from full ones:
+        if self.stream_frequency is not None:
+            return "%s-%s"%(self.account_id,self.stream_frequency)
+        return self.account_id
+
+    def _load_synced(self,name):
+        if self._store is None or self._ledger_tail is None:
+            return None
+        df,attrs = self._store.load("cbpro",self._sync_key(),name)
+        return df
+
+    def _save_synced(self,name,df,attrs=None):
+        if self._store is not None:
+            self._store.save("cbpro",self._sync_key(),name,df,attrs)
     
-    def _setup_fills(self,query_output):
-        df = pd.DataFrame(query_output)
+    def _parse_fills(self,query_output):
+        df = pd.DataFrame.from_records(query_output)
         self._correct_datetime(df)
         for col in ["price","size","fee","usd_volume"]:
-            df.loc[:,col] = df[col].apply(float)
-        self.usd_fills = df.set_index("created_at")
+            df[col] = df[col].to_numpy().astype(np.float64)
+        return df.set_index("created_at")
 
     def _unnest_dict(self,df):
+        details = pd.DataFrame.from_records(
+            [x if isinstance(x,dict) else {} for x in df.details],
+            index=df.index,
+            )
         for col in ["order_id","product_id","trade_id"]:
-            try:
-                data = df.details.apply(lambda x: x[col])
-                df[col] = data
-            except:
-                pass
+            if col in details:
+                df[col] = details[col]
 
     def _correct_datetime(self,df):
-        df.loc[:,"created_at"] = pd.to_datetime(df.created_at)
-        df.loc[:,"created_at"] = df.created_at.apply(
-            lambda x: x.replace(tzinfo=None),
-            )
+        # ISO strings to naive UTC datetimes in one call:
+        df["created_at"] = pd.to_datetime(
+            df.created_at,
+            utc=True,
+            format="ISO8601",
+            ).dt.tz_localize(None)
 
-    def _url_setup(self,fills_number=100):
+    def _url_setup(self,page_limit=1000):
+        # Coinbase pages hold at most 1000 entries:
+        self.PAGE_LIMIT = page_limit
         self.LEDGER_URL = "/accounts/%s/ledger"%(self.account_id)
         self.USD_FILLS_URL = "/fills?product_id=%s-USD"%(self.name)
 
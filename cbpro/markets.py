@@ -3,13 +3,125 @@ import pandas as pd
 import datetime
 
 # internal functions:
+import cbpro._api
 from cbpro._api import apiwrapper
 import cbpro._utilities as utils
+from common._candles import (
+    default_cache,
+    align,
+    last_closed,
+    fetch_range,
+    history_many,
+    )
+from common._memo import price_memo
+from common._ticker import pricefeed
+import common._websocket as websocket
 
 # Pandas index slice:
 idx = pd.IndexSlice
 
+# most candles Coinbase returns per request:
+MAX_CANDLES = 300
+
 def price_history(
+    pair,
+    start,
+    end,
+    granularity,
+    debug=False,
+    cache=True,
+    ):
+    # Identical requests within the process are served from memory
+    # and concurrent ones share one download. Behind that, candles
+    # come from the on-disk candle cache when it is enabled, so only
+    # missing ranges and the still-open final candle are downloaded:
+    if not cache:
+        return _fetch_history(pair,start,end,granularity,debug)
+    start = align(start,granularity)
+    end = align(end,granularity)
+    results = price_memo.get(
+        ("cbpro",pair,granularity,start,end),
+        lambda: _cached_history(pair,start,end,granularity,debug),
+        volatile=end > last_closed(granularity),
+        )
+    return results.copy()
+
+def price_history_many(
+    pairs,
+    start,
+    end,
+    granularity,
+    field="open",
+    debug=False,
+    cache=True,
+    ):
+    # one wide frame (time x pair) of `field` for all pairs. Every
+    # pair's slices are downloaded through a single concurrent,
+    # rate limited pipeline:
+    cbapi = apiwrapper()
+    return history_many(
+        "cbpro",
+        pairs,
+        start,
+        end,
+        granularity,
+        MAX_CANDLES,
+        lambda pair,di,de: _fetch_slice(cbapi,pair,di,de,granularity,debug),
+        field=field,
+        cache=default_cache() if cache else None,
+        )
+
+def live_prices(pairs,url=None):
+    # latest trade price of each pair, streamed from the websocket
+    # ticker channel into memory on a background thread:
+    return pricefeed(tickerprotocol(url),pairs).start()
+
+class tickerprotocol:
+    # the server's websocket pings keep the connection alive, so
+    # no application level pings are sent:
+    ping_interval = None
+
+    def __init__(self,url=None):
+        self.url = url
+
+    def connect(self):
+        url = cbpro._api.WEBSOCKET_URL if self.url is None else self.url
+        return websocket.connect(url)
+
+    def subscribe(self,ws,pairs):
+        ws.send_json({
+            "type": "subscribe",
+            "product_ids": list(pairs),
+            "channels": ["ticker"],
+            })
+
+    def ping(self,ws):
+        pass
+
+    def parse(self,message):
+        # [(pair, price, time)] from one feed message:
+        kind = message.get("type")
+        if kind=="error":
+            raise ValueError("%s: %s"%(message.get("message"),message.get("reason")))
+        if kind!="ticker":
+            return []
+        when = pd.Timestamp(message["time"]).tz_convert(None)
+        return [(message["product_id"],float(message["price"]),when)]
+
+def _cached_history(pair,start,end,granularity,debug):
+    candles = default_cache()
+    if candles is None:
+        return _fetch_history(pair,start,end,granularity,debug)
+    return candles.get(
+        "cbpro",
+        pair,
+        granularity,
+        start,
+        end,
+        lambda di,de: _fetch_history(pair,di,de,granularity,debug),
+        )
+
+def _fetch_history(
     pair,
     start,
     end,
@@ -28,72 +140,57 @@ def price_history(
     # 21600     (six hours)
     # 86400     (one day)
     # 
-    # create empty dataframe for the prices:
-    mdf_index = pd.date_range(
-        start=start,
-        end=end,
-        freq="%dS"%granularity,
+    # fetch 300-candle slices concurrently:
+    cbapi = apiwrapper()
+    return fetch_range(
+        start,
+        end,
+        granularity,
+        MAX_CANDLES,
+        lambda di,de: _fetch_slice(cbapi,pair,di,de,granularity,debug),
+        )
+
+def _fetch_slice(cbapi,pair,start,end,granularity,debug=False):
+    endpoint_template = "/products/{product_id}/candles?{options}"
+    iso_start = start.strftime("%Y-%m-%dT%H:%M:%SZ")
+    iso_end = end.strftime("%Y-%m-%dT%H:%M:%SZ")
+    query_options = "start=%s&end=%s&granularity=%d"%(
+        iso_start,
+        iso_end,
+        granularity,    
+        )
+    endpoint = endpoint_template.format(
+        product_id=pair,
+        options=query_options,
         )
     
-    # discretize the datetime index into groups of 300
-    # if necessary:
-    index_slices = []
-    if len(mdf_index) >= 300:
-        start = 0
-        end = 299
-        num_slices,remainder = divmod(len(mdf_index),300)
-        for ii in range(num_slices):
-            index_slices.append([
-                mdf_index[start],
-                mdf_index[end],
-                ])
-            start += 300
-            end += 300
-        index_slices.append([
-            mdf_index[-remainder],
-            mdf_index[-1]
-            ])
-    else:
-        index_slices.append([
-            mdf_index[0],
-            mdf_index[-1],
-            ])
+    # query API:
+    api_output = cbapi.query(endpoint,debug=debug)
+
+    # candles come as a list; anything else is an error reply,
+    # which must not be mistaken for a range without candles:
+    if not isinstance(api_output,list):
+        raise RuntimeError("Coinbase rejected %s: %s"%(
+            endpoint,
+            api_output.get("message") if isinstance(api_output,dict) else api_output,
+            ))
     
-    # iterate over each (start, end) pair:
-    cbapi = apiwrapper()
-    endpoint_template = "/products/{product_id}/candles?{options}"
-    frames = []
-    for start, end in index_slices:
-        iso_start = start.strftime("%Y-%m-%dT%H:%M:%SZ")
-        iso_end = end.strftime("%Y-%m-%dT%H:%M:%SZ")
-        query_options = "start=%s&end=%s&granularity=%d"%(
-            iso_start,
-            iso_end,
-            granularity,    
-            )
-        endpoint = endpoint_template.format(
-            product_id=pair,
-            options=query_options,
-            )
-        
-        # query API:
-        api_output = cbapi.query(endpoint,debug=debug)
-        
-        # store in multiindex dataframe:
-        df = pd.DataFrame(api_output)
-        frames.append(df)
+    # store in dataframe:
+    results = pd.DataFrame(
+        api_output,
+        columns=[
+            "date",
+            "low",
+            "high",
+            "open",
+            "close",
+            "volume",
+            ],
+        dtype=float,
+        )
     
-    # create and return multiindex dataframe:
-    results = pd.concat(frames)
-    results.loc[:,0] = pd.to_datetime(results[0], unit="s")
-    results.columns = [
-        "date",
-        "low",
-        "high",
-        "open",
-        "close",
-        "volume",
-        ]
+    # create and return dataframe:
+    results["date"] = pd.to_datetime(results.date, unit="s")
     return results.set_index("date")
 
 
@@ -0,0 +1,282 @@
+"""Persistent on-disk candle cache shared by both exchanges.
+
+Candles are stored per (exchange, pair, granularity) with the
+columnar frame store. Closed candles never change, so the cache
+records the span it has covered and only the missing ranges plus
+the still-open final candle are fetched again.
+
+plan_slices and fetch_range cut a candle range into requests the
+exchange accepts and download them concurrently; history_many does
+the same for many pairs at once.
+"""
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+
+from common._store import save_frame, load_frame, read_attrs, cache_dir
+
+_default_cache = None
+
+def default_cache():
+    """Cache under the configured cache directory, None if disabled."""
+    global _default_cache
+    root = cache_dir()
+    if root is None:
+        return None
+    if _default_cache is None or _default_cache.root!=root:
+        _default_cache = candlecache(root)
+    return _default_cache
+
+def align(timestamp,granularity):
+    """Floor a timestamp to a candle boundary."""
+    seconds = int(pd.Timestamp(timestamp).timestamp())
+    return pd.Timestamp(seconds - seconds%granularity,unit="s")
+
+def last_closed(granularity,now=None):
+    """Open time of the most recent candle that has closed."""
+    if now is None:
+        now = time.time()
+    now = int(now)
+    return pd.Timestamp(now - now%granularity - granularity,unit="s")
+
+def plan_slices(start,end,granularity,max_candles):
+    """Inclusive (start, end) open times of at most `max_candles` each.
+
+    The slices tile [start, end] without gaps or overlap and are
+    computed arithmetically, so a multi-year minute range costs one
+    pair of timestamps per request rather than a full date index.
+    """
+    first = int(align(start,granularity).timestamp())
+    last = int(align(end,granularity).timestamp())
+    step = granularity*max_candles
+    return [
+        (
+            pd.Timestamp(ti,unit="s"),
+            pd.Timestamp(min(ti+step-granularity,last),unit="s"),
+            )
+        for ti in range(first,last+1,step)
+        ]
+
+def fetch_range(
+    start,
+    end,
+    granularity,
+    max_candles,
+    fetch_slice,
+    max_workers=8,
+    ):
+    """Candles in [start, end] from concurrent `fetch_slice(di, de)` calls.
+
+    Slices are merged in time order; candles returned by two slices
+    are kept once and anything outside [start, end] is dropped. The
+    exchange's rate limit bucket paces the concurrent requests.
+    """
+    slices = plan_slices(start,end,granularity,max_candles)
+    if len(slices) <= 1:
+        frames = [fetch_slice(di,de) for di,de in slices]
+    else:
+        with ThreadPoolExecutor(min(max_workers,len(slices))) as pool:
+            frames = list(pool.map(lambda s: fetch_slice(*s),slices))
+    return _merge(frames,start,end,granularity)
+
+def history_many(
+    exchange,
+    pairs,
+    start,
+    end,
+    granularity,
+    max_candles,
+    fetch_slice,
+    field="open",
+    cache=None,
+    max_workers=16,
+    ):
+    """Wide (time x pair) frame of `field` for every pair.
+
+    The slices of every pair's missing ranges go through one thread
+    pool, so a portfolio's candles download together under the
+    exchange's shared rate limit bucket instead of pair by pair.
+    `fetch_slice(pair, di, de)` downloads one slice. With `cache`
+    (a candlecache) only ranges it does not cover are requested and
+    the downloads are merged into it. Candles missing for a pair are
+    left NaN.
+    """
+    start = align(start,granularity)
+    end = align(end,granularity)
+    pairs = list(pairs)
+    tasks = []
+    ranges = {}
+    for pair in pairs:
+        if cache is None:
+            ranges[pair] = [(start,end)]
+        else:
+            ranges[pair] = cache.missing(exchange,pair,granularity,start,end)
+        for di,de in ranges[pair]:
+            tasks += [
+                (pair,si,se)
+                for si,se in plan_slices(di,de,granularity,max_candles)
+                ]
+    with ThreadPoolExecutor(max(min(max_workers,len(tasks)),1)) as pool:
+        frames = list(pool.map(lambda task: fetch_slice(*task),tasks))
+    fetched = {pair: [] for pair in pairs}
+    for (pair,si,se),df in zip(tasks,frames):
+        fetched[pair].append(df)
+
+    # scatter each pair's candles into its column by open time:
+    index = pd.date_range(start,end,freq="%ds"%granularity,name="time")
+    values = np.full((len(index),len(pairs)),np.nan)
+    for jj,pair in enumerate(pairs):
+        if cache is None:
+            df = _merge(fetched[pair],start,end,granularity)
+        else:
+            with cache._lock(exchange,pair,granularity):
+                if len(fetched[pair]) > 0:
+                    cache.update(exchange,pair,granularity,fetched[pair],ranges[pair])
+                df = cache.read(exchange,pair,granularity,start,end)
+        if df is None or len(df)==0:
+            continue
+        offsets = (df.index-start)//pd.Timedelta(seconds=granularity)
+        values[offsets.to_numpy(),jj] = df[field].to_numpy()
+    return pd.DataFrame(values,index=index,columns=pairs)
+
+def _merge(frames,start,end,granularity):
+    # time-ordered candles in [start, end], each kept once:
+    merged = pd.concat(frames)
+    merged = merged[~merged.index.duplicated(keep="last")].sort_index()
+    return merged.loc[align(start,granularity):align(end,granularity)]
+
+class candlecache:
+    def __init__(self,root):
+        self.root = root
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+    def get(
+        self,
+        exchange,
+        pair,
+        granularity,
+        start,
+        end,
+        fetch,
+        ):
+        """Candles in [start, end], fetching only what is missing.
+
+        `fetch(start, end)` downloads candles for an inclusive
+        range of candle open times and returns them as a frame.
+        """
+        start = align(start,granularity)
+        end = align(end,granularity)
+        with self._lock(exchange,pair,granularity):
+            ranges = self.missing(exchange,pair,granularity,start,end)
+            if ranges:
+                frames = [fetch(di,de) for di,de in ranges]
+                self.update(exchange,pair,granularity,frames,ranges)
+            return self.read(exchange,pair,granularity,start,end)
+
+    def missing(
+        self,
+        exchange,
+        pair,
+        granularity,
+        start,
+        end,
+        ):
+        """Ranges of [start, end] not yet covered by closed candles."""
+        coverage = self.coverage(exchange,pair,granularity)
+        if coverage is None:
+            return [(start,end)]
+        cs,ce = coverage
+        step = pd.Timedelta(seconds=granularity)
+
+        # keep the covered span contiguous, so a request that starts
+        # after (or ends before) it also fills the gap in between:
+        ranges = []
+        if start < cs:
+            ranges.append((start,cs-step))
+        if end > ce:
+            ranges.append((ce+step,end))
+        return ranges
+
+    def update(
+        self,
+        exchange,
+        pair,
+        granularity,
+        frames,
+        ranges,
+        ):
+        """Merge freshly fetched candles and extend the coverage.
+
+        `frames` are the downloads of `ranges`; a failed download
+        raises before this, so every range here was answered and
+        is covered even if it held no candles.
+        """
+        path = self._path(exchange,pair,granularity)
+        old = load_frame(path,mmap=False)
+        fetched = [df for df in frames if len(df) > 0]
+        if old is not None:
+            fetched = [old] + fetched
+
+        # with no candles at all, keep an empty frame of the right
+        # columns so reads return that rather than nothing:
+        if not fetched:
+            fetched = frames[:1]
+        if not fetched:
+            return
+        frames = fetched
+        merged = pd.concat(frames)
+        merged = merged[~merged.index.duplicated(keep="last")].sort_index()
+
+        # coverage only extends as far as the last closed candle,
+        # so the open one is refetched next time:
+        closed = last_closed(granularity)
+        coverage = self.coverage(exchange,pair,granularity)
+        starts = [di for di,de in ranges]
+        ends = [min(de,closed) for di,de in ranges]
+        if coverage is not None:
+            starts.append(coverage[0])
+            ends.append(coverage[1])
+        attrs = {
+            "start": min(starts).isoformat(),
+            "end": max(ends).isoformat(),
+            }
+        os.makedirs(os.path.dirname(path),exist_ok=True)
+        save_frame(path,merged,attrs=attrs)
+
+    def read(
+        self,
+        exchange,
+        pair,
+        granularity,
+        start=None,
+        end=None,
+        ):
+        df = load_frame(self._path(exchange,pair,granularity))
+        if df is None:
+            return None
+        return df.loc[start:end]
+
+    def coverage(self,exchange,pair,granularity):
+        attrs = read_attrs(self._path(exchange,pair,granularity))
+        if attrs is None:
+            return None
+        return pd.Timestamp(attrs["start"]),pd.Timestamp(attrs["end"])
+
+    def _path(self,exchange,pair,granularity):
+        return os.path.join(
+            self.root,
+            "candles",
+            exchange,
+            "%s-%d"%(pair,granularity),
+            )
+
+    def _lock(self,exchange,pair,granularity):
+        key = (exchange,pair,granularity)
+        with self._locks_lock:
+            if key not in self._locks:
+                self._locks[key] = threading.Lock()
+            return self._locks[key]
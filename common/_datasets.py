@@ -0,0 +1,119 @@
+"""Lazily derived account datasets.
+
+Each dataset is declared on the account class with the setup stage
+that computes it and the datasets it is derived from:
+
+    ledger = dataset("get_ledger")
+    balance_sheet = dataset("extract_balance_sheet",["ledger"])
+
+The first read runs the stage, after resolving its inputs, and the
+result is kept on the instance. Assigning a dataset (from a stage,
+load or by hand) drops everything derived from it, so it is derived
+again on next access; nothing else is recomputed. Reading the
+balance sheet therefore never downloads fills or candles.
+"""
+import pandas as pd
+
+class dataset:
+    def __init__(self,stage,inputs=()):
+        self.stage = stage
+        self.inputs = list(inputs)
+
+    def __set_name__(self,owner,name):
+        self.name = name
+
+    def __get__(self,obj,owner=None):
+        if obj is None:
+            return self
+        if self.name not in obj.__dict__:
+            for name in self.inputs:
+                getattr(obj,name)
+
+            # stages may read their own dataset while running, so
+            # start from the empty frame accounts used to begin with:
+            obj.__dict__[self.name] = pd.DataFrame()
+            try:
+                getattr(obj,self.stage)()
+            except BaseException:
+                obj.__dict__.pop(self.name,None)
+                raise
+        return obj.__dict__[self.name]
+
+    def __set__(self,obj,value):
+        if obj.__dict__.get(self.name) is value:
+            return
+        obj.__dict__[self.name] = value
+        for name in dependents(type(obj),[self.name]):
+            obj.__dict__.pop(name,None)
+
+def declared(cls):
+    """Names of the datasets declared on `cls`."""
+    return [
+        name for name in dir(cls)
+        if isinstance(getattr(cls,name,None),dataset)
+        ]
+
+def dependents(cls,names):
+    """Datasets derived, directly or not, from any of `names`."""
+    graph = {name: getattr(cls,name).inputs for name in declared(cls)}
+    found = []
+    pending = list(names)
+    while pending:
+        name = pending.pop()
+        for other,inputs in graph.items():
+            if name in inputs and other not in found:
+                found.append(other)
+                pending.append(other)
+    return found
+
+def sources(cls,names):
+    """Datasets without inputs (the downloaded ones) that any of
+    `names` is derived from, `names` included."""
+    found = []
+    pending = list(names)
+    while pending:
+        name = pending.pop()
+        inputs = getattr(cls,name).inputs
+        if not inputs and name not in found:
+            found.append(name)
+        pending += inputs
+    return found
+
+def invalidate(obj,*names):
+    """Drop `names` and everything derived from them, or every
+    dataset when no names are given."""
+    if not names:
+        names = declared(type(obj))
+    for name in list(names) + dependents(type(obj),names):
+        obj.__dict__.pop(name,None)
+
+def readonly(df):
+    """Frame sharing the data of `df` through read-only arrays.
+
+    Writing into it raises rather than changing `df`; replacing
+    whole columns only changes the returned frame. Its columns are
+    separate arrays, which pandas copies into one block on some whole
+    frame operations (e.g. resample), so select columns before those.
+    """
+    # a read-only view per column. Passing the dtype keeps pandas
+    # from scanning object columns for dates; extension arrays (e.g.
+    # tz-aware times) are left shared:
+    columns = {}
+    for ii in range(df.shape[1]):
+        values = df.iloc[:,ii].array
+        if isinstance(values,pd.arrays.NumpyExtensionArray):
+            values = values.to_numpy().view()
+            values.flags.writeable = False
+        columns[ii] = pd.Series(
+            values,
+            index=df.index,
+            dtype=values.dtype,
+            copy=False,
+            )
+    results = pd.DataFrame(columns,copy=False)
+    results.columns = df.columns
+    return results
+
+def computed(obj,name):
+    """True if `name` is held by `obj`, without computing it."""
+    return name in vars(obj)
@@ -0,0 +1,271 @@
+"""Opt-in instrumentation of API queries and account setup stages.
+
+Both apiwrappers report one event per query (rate limit wait,
+transfer, JSON decode, bytes and retries) and the account setup
+stages report one event per call. Events go to every installed sink:
+
+    from common._instrument import histogram, recording
+    with recording(histogram()) as hist:
+        account.standard_setup()
+    print(hist.summary())
+
+Nothing is recorded while no sink is installed; the hooks then cost
+a single flag check.
+"""
+import json
+import math
+import time
+import logging
+import threading
+import contextlib
+from functools import wraps
+import pandas as pd
+
+# True while at least one sink is installed. Checked by the hot
+# paths before building an event:
+active = False
+_sinks = []
+_lock = threading.Lock()
+
+def add_sink(sink):
+    global active
+    with _lock:
+        _sinks.append(sink)
+        active = True
+    return sink
+
+def remove_sink(sink):
+    global active
+    with _lock:
+        if sink in _sinks:
+            _sinks.remove(sink)
+        active = len(_sinks) > 0
+
+def clear_sinks():
+    global active
+    with _lock:
+        _sinks.clear()
+        active = False
+
+@contextlib.contextmanager
+def recording(*sinks):
+    """Install `sinks` for the duration of a with block."""
+    for sink in sinks:
+        add_sink(sink)
+    try:
+        yield sinks[0] if len(sinks)==1 else sinks
+    finally:
+        for sink in sinks:
+            remove_sink(sink)
+            sink.close()
+
+def emit(event):
+    for sink in list(_sinks):
+        sink.record(event)
+
+def query_event(
+    exchange,
+    method,
+    request_path,
+    status,
+    seconds,
+    wait,
+    transfer,
+    decode,
+    received,
+    sent,
+    retries,
+    ):
+    """Report one apiwrapper query. Times are in seconds."""
+    emit({
+        "kind": "query",
+        "exchange": exchange,
+        "name": "%s %s"%(method,request_path.partition("?")[0]),
+        "time": time.time()-seconds,
+        "seconds": seconds,
+        "wait": wait,
+        "transfer": transfer,
+        "decode": decode,
+        "bytes": received,
+        "sent": sent,
+        "retries": retries,
+        "status": status,
+        })
+
+def stage(fn):
+    """Time an account method as one setup stage."""
+    exchange = fn.__module__.split(".")[0]
+
+    @wraps(fn)
+    def wrapper(self,*args,**kwargs):
+        if not active:
+            return fn(self,*args,**kwargs)
+        ti = time.perf_counter()
+        error = None
+        try:
+            return fn(self,*args,**kwargs)
+        except BaseException as exc:
+            error = type(exc).__name__
+            raise
+        finally:
+            seconds = time.perf_counter()-ti
+            emit({
+                "kind": "stage",
+                "exchange": exchange,
+                "name": fn.__name__,
+                "account": getattr(self,"name",None),
+                "time": time.time()-seconds,
+                "seconds": seconds,
+                "error": error,
+                })
+    return wrapper
+
+# -- sinks ------------------------------------------------------------
+class histogram:
+    """In-memory log2 histograms of call time per (kind, name).
+
+    Memory stays constant however many events are recorded; the
+    percentiles in summary are upper bucket edges.
+    """
+    def __init__(self,group_by_exchange=True):
+        self.group_by_exchange = group_by_exchange
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def record(self,event):
+        key = (event["kind"],event["name"])
+        if self.group_by_exchange:
+            key = (event["exchange"],)+key
+        bucket = _log2_bucket(event["seconds"])
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = {
+                    "count": 0,
+                    "seconds": 0.0,
+                    "max": 0.0,
+                    "wait": 0.0,
+                    "transfer": 0.0,
+                    "decode": 0.0,
+                    "bytes": 0,
+                    "retries": 0,
+                    "errors": 0,
+                    "buckets": {},
+                    }
+                self._stats[key] = stats
+            stats["count"] += 1
+            stats["seconds"] += event["seconds"]
+            stats["max"] = max(stats["max"],event["seconds"])
+            for field in ["wait","transfer","decode","bytes","retries"]:
+                stats[field] += event.get(field,0)
+            if event.get("error") is not None:
+                stats["errors"] += 1
+            stats["buckets"][bucket] = stats["buckets"].get(bucket,0)+1
+
+    def summary(self):
+        """Counts, totals and p50/p95 per recorded call."""
+        rows = []
+        with self._lock:
+            for key,stats in self._stats.items():
+                row = {
+                    field: value
+                    for field,value in stats.items()
+                    if field!="buckets"
+                    }
+                row["mean"] = stats["seconds"]/stats["count"]
+                row["p50"] = _percentile(stats["buckets"],stats["count"],0.50)
+                row["p95"] = _percentile(stats["buckets"],stats["count"],0.95)
+                rows.append((key,row))
+        names = ["kind","name"]
+        if self.group_by_exchange:
+            names = ["exchange"]+names
+        if len(rows)==0:
+            return pd.DataFrame()
+        return pd.DataFrame(
+            [row for key,row in rows],
+            index=pd.MultiIndex.from_tuples([key for key,row in rows],names=names),
+            ).sort_index()
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+    def close(self):
+        pass
+
+class logsink:
+    """Log one line per event."""
+    def __init__(self,logger=None,level=logging.INFO):
+        if logger is None:
+            logger = logging.getLogger("crypto_api.instrument")
+        self.logger = logger
+        self.level = level
+
+    def record(self,event):
+        if not self.logger.isEnabledFor(self.level):
+            return
+        if event["kind"]=="query":
+            self.logger.log(
+                self.level,
+                "%s %s %d %.1fms (wait %.1fms, transfer %.1fms, decode %.1fms) %dB %d retries",
+                event["exchange"],
+                event["name"],
+                event["status"],
+                event["seconds"]*1e3,
+                event["wait"]*1e3,
+                event["transfer"]*1e3,
+                event["decode"]*1e3,
+                event["bytes"],
+                event["retries"],
+                )
+        else:
+            self.logger.log(
+                self.level,
+                "%s %s.%s %.1fms%s",
+                event["exchange"],
+                event["account"],
+                event["name"],
+                event["seconds"]*1e3,
+                "" if event["error"] is None else " failed: %s"%event["error"],
+                )
+
+    def close(self):
+        pass
+
+class jsonlsink:
+    """Append every event as one JSON line to a trace file."""
+    def __init__(self,path):
+        self.path = path
+        self._file = open(path,"a")
+        self._lock = threading.Lock()
+
+    def record(self,event):
+        line = json.dumps(event)+"\n"
+        with self._lock:
+            self._file.write(line)
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+def read_trace(path):
+    """Load a jsonlsink trace file into a dataframe."""
+    with open(path,"r") as of:
+        events = [json.loads(line) for line in of if line.strip()]
+    df = pd.DataFrame(events)
+    if "time" in df:
+        df["time"] = pd.to_datetime(df.time,unit="s")
+    return df
+
+def _log2_bucket(seconds):
+    # bucket ii holds calls up to 2**ii microseconds:
+    return max(math.ceil(math.log2(max(seconds*1e6,1.0))),0)
+
+def _percentile(buckets,count,q):
+    seen = 0
+    for bucket in sorted(buckets):
+        seen += buckets[bucket]
+        if seen >= q*count:
+            return 2.0**bucket/1e6
+    return float("nan")
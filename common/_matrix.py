@@ -0,0 +1,417 @@
+"""Dense time x asset matrices for portfolio aggregation.
+
+Deposits, coin balances and prices of every account are held as
+2-D NumPy arrays on one shared time index, so per-asset values and
+the totals of any subset of assets are plain array operations.
+
+Running totals are kept up to date as assets are added, removed or
+refreshed and as rows are appended. The arrays are over-allocated in
+both directions, so those updates touch the changed rows of one
+column (or the new rows) rather than the whole matrix. Updates hold
+the matrix's lock, so price feeds on other threads can revalue it.
+"""
+import threading
+from functools import reduce
+import numpy as np
+import pandas as pd
+
+from common._datasets import computed
+
+FIELDS = ["deposits","coins","prices","values"]
+
+class assetmatrix:
+    def __init__(self,index=None):
+        """Empty matrix over `index`; assets are added with add.
+
+        Each asset is identified by a hashable key (e.g. the account
+        object) and labelled with a name, which need not be unique.
+        NaN marks rows an asset has no data for; they count as zero
+        in totals.
+        """
+        self.index = pd.DatetimeIndex([]) if index is None else index
+        self.keys = []
+        self.names = []
+        self._column = {}
+        # updates come from feed threads as well as the caller's;
+        # refresh adds through add, hence reentrant:
+        self._lock = threading.RLock()
+        self._live = np.zeros(0,dtype=bool)
+        self._allocate(len(self.index),0)
+
+    @classmethod
+    def from_accounts(cls,accounts):
+        """Matrix of every account with performance data, built at once.
+
+        Accounts whose performance data has not been derived are left
+        out rather than set up here.
+        """
+        accounts = [
+            account for account in accounts
+            if computed(account,"performance_data")
+            and account.performance_data is not None
+            and len(account.performance_data) > 0
+            ]
+        frames = [account.performance_data for account in accounts]
+        if len(frames)==0:
+            return cls()
+        index = reduce(
+            lambda left,right: left if left.equals(right) else left.union(right),
+            [df.index for df in frames],
+            )
+        matrix = cls(index)
+        matrix._reserve(len(index),len(frames))
+        for account,df in zip(accounts,frames):
+            rows = slice(None) if df.index.equals(index) else index.get_indexer(df.index)
+            jj = matrix._new_column(account,account.name)
+            matrix._write(jj,rows,df)
+        matrix.recompute_totals()
+        return matrix
+
+    # -- views ---------------------------------------------------------
+    @property
+    def deposits(self):
+        return self._buffers["deposits"][:len(self.index),:len(self.keys)]
+
+    @property
+    def coins(self):
+        return self._buffers["coins"][:len(self.index),:len(self.keys)]
+
+    @property
+    def prices(self):
+        return self._buffers["prices"][:len(self.index),:len(self.keys)]
+
+    @property
+    def values(self):
+        return self._buffers["values"][:len(self.index),:len(self.keys)]
+
+    @property
+    def total_values(self):
+        return self._totals["values"][:len(self.index)]
+
+    @property
+    def total_deposits(self):
+        return self._totals["deposits"][:len(self.index)]
+
+    def __contains__(self,key):
+        return key in self._column
+
+    # locks do not pickle; make a new one on the other side:
+    def __getstate__(self):
+        state = dict(vars(self))
+        del state["_lock"]
+        return state
+
+    def __setstate__(self,state):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+
+    # -- queries -------------------------------------------------------
+    def columns(self,names=None):
+        """Column selector for the assets in `names` (all if None)."""
+        live = self._live[:len(self.keys)]
+        if names is None:
+            return slice(None) if live.all() else np.flatnonzero(live)
+        selected = np.isin(np.asarray(self.names,dtype=object),list(names))
+        return np.flatnonzero(selected & live)
+
+    def asset_values(self,names=None,total=True):
+        """USD value per asset, plus a total column."""
+        return self._frame(self.values,self.total_values,names,total)
+
+    def asset_deposits(self,names=None,total=True):
+        """Cumulative USD deposits per asset, plus a total column."""
+        return self._frame(self.deposits,self.total_deposits,names,total)
+
+    def performance(self,names=None):
+        """Total value, deposits and their ratio for a sub-portfolio."""
+        if names is None:
+            value = self.total_values.copy()
+            deposits = self.total_deposits.copy()
+        else:
+            cols = self.columns(names)
+            value = np.nansum(self.values[:,cols],axis=1)
+            deposits = np.nansum(self.deposits[:,cols],axis=1)
+        with np.errstate(divide="ignore",invalid="ignore"):
+            performance = value/deposits
+        return pd.DataFrame(
+            {
+                "coin_usd_value": value,
+                "deposits_usd": deposits,
+                "performance": performance,
+                },
+            index=self.index,
+            )
+
+    # -- incremental updates -------------------------------------------
+    def add(self,key,name,df):
+        """Add one asset from a performance frame."""
+        with self._lock:
+            if key in self._column:
+                raise ValueError("%s is already in the matrix"%name)
+            rows = self._rows_for(df.index)
+            jj = self._new_column(key,name)
+            self._write(jj,rows,df)
+            self._add_totals(jj,rows,1.0)
+
+    def remove(self,key):
+        """Take one asset out of the matrix and the totals."""
+        with self._lock:
+            jj = self._column.pop(key)
+            self._add_totals(jj,slice(None),-1.0)
+            self._clear(jj)
+            self._live[jj] = False
+            self.keys[jj] = None
+            if 2*len(self._column) < len(self.keys):
+                self._compact()
+            self._trim()
+
+    def refresh(self,key,name,df):
+        """Replace one asset's data, updating only the rows that changed."""
+        with self._lock:
+            if key not in self._column:
+                self.add(key,name,df)
+                return
+            jj = self._column[key]
+            self.names[jj] = name
+            positions = self._rows_for(df.index)
+            held = np.flatnonzero(self._held([jj]))
+            if not np.isin(held,positions).all():
+                # the asset lost rows; replace its whole column:
+                self._add_totals(jj,slice(None),-1.0)
+                self._clear(jj)
+                self._write(jj,positions,df)
+                self._add_totals(jj,positions,1.0)
+                self._trim()
+                return
+
+            # rows before the first difference are left alone:
+            new = np.column_stack([
+                df.usd_deposits.to_numpy(dtype=np.float64),
+                df.number_of_coins.to_numpy(dtype=np.float64),
+                df.coin_price.to_numpy(dtype=np.float64),
+                ])
+            old = np.column_stack([
+                self.deposits[positions,jj],
+                self.coins[positions,jj],
+                self.prices[positions,jj],
+                ])
+            same = (old==new) | (np.isnan(old) & np.isnan(new))
+            changed = np.flatnonzero(~same.all(axis=1))
+            if len(changed)==0:
+                return
+            positions = positions[changed[0]:]
+            self._add_totals(jj,positions,-1.0)
+            self._write(jj,positions,df.iloc[changed[0]:])
+            self._add_totals(jj,positions,1.0)
+
+    def append_prices(self,prices):
+        """Append rows after the last one from a (time x name) price frame.
+
+        Balances and deposits carry forward from the last row, and
+        assets without a price keep their last one. Only the new rows
+        are computed.
+        """
+        with self._lock:
+            prices = prices.sort_index()
+            if len(self.index) > 0 and prices.index[0] <= self.index[-1]:
+                raise ValueError("appended rows must come after %s"%self.index[-1])
+            first = len(self.index)
+            self._reserve(first+len(prices),len(self.keys))
+            self.index = self.index.append(prices.index)
+            rows = slice(first,len(self.index))
+            cols = len(self.keys)
+            buffers = self._buffers
+            if first > 0:
+                for field in ["deposits","coins","prices"]:
+                    buffers[field][rows,:cols] = buffers[field][first-1,:cols]
+            names = np.asarray(self.names,dtype=object)
+            for name in prices.columns:
+                new = prices[name].to_numpy(dtype=np.float64)[:,None]
+                jj = np.flatnonzero((names==name) & self._live[:cols])
+                block = buffers["prices"][rows][:,jj]
+                buffers["prices"][rows,jj] = np.where(np.isnan(new),block,new)
+            buffers["values"][rows,:cols] = (
+                buffers["coins"][rows,:cols]*buffers["prices"][rows,:cols]
+                )
+            live = self.columns()
+            self._totals["values"][rows] = np.nansum(self.values[rows][:,live],axis=1)
+            self._totals["deposits"][rows] = np.nansum(self.deposits[rows][:,live],axis=1)
+
+    def set_price(self,key,time,price):
+        """Revalue one asset at `price` in the row at `time`, moving
+        the total by the difference."""
+        with self._lock:
+            jj = self._column[key]
+            ii = self.index.get_loc(time)
+            buffers = self._buffers
+            old = buffers["values"][ii,jj]
+            buffers["prices"][ii,jj] = price
+            buffers["values"][ii,jj] = buffers["coins"][ii,jj]*price
+            self._totals["values"][ii] += (
+                np.nan_to_num(buffers["values"][ii,jj]) - np.nan_to_num(old)
+                )
+
+    def recompute_totals(self):
+        """Sum the totals again from scratch, e.g. to shed rounding drift."""
+        with self._lock:
+            live = self.columns()
+            self.total_values[:] = np.nansum(self.values[:,live],axis=1)
+            self.total_deposits[:] = np.nansum(self.deposits[:,live],axis=1)
+
+    # -- storage -------------------------------------------------------
+    def _allocate(self,row_cap,col_cap):
+        # column-major, so each asset is one contiguous block:
+        self._buffers = {
+            field: np.full((row_cap,col_cap),np.nan,order="F")
+            for field in FIELDS
+            }
+        self._totals = {
+            "values": np.zeros(row_cap),
+            "deposits": np.zeros(row_cap),
+            }
+        live = np.zeros(col_cap,dtype=bool)
+        live[:len(self._live)] = self._live[:col_cap]
+        self._live = live
+
+    def _reserve(self,num_rows,num_cols):
+        # grow by a quarter at a time, so appends cost amortized
+        # O(new data) without doubling a large matrix:
+        row_cap,col_cap = self._buffers["values"].shape
+        if num_rows <= row_cap and num_cols <= col_cap:
+            return
+        old_buffers,old_totals = self._buffers,self._totals
+        rows,cols = len(self.index),len(self.keys)
+        if num_rows > row_cap:
+            row_cap = max(num_rows,row_cap+max(row_cap//4,64))
+        if num_cols > col_cap:
+            col_cap = max(num_cols,col_cap+max(col_cap//4,4))
+        self._allocate(row_cap,col_cap)
+        for field in FIELDS:
+            self._buffers[field][:rows,:cols] = old_buffers[field][:rows,:cols]
+        for field in self._totals:
+            self._totals[field][:rows] = old_totals[field][:rows]
+
+    def _rows_for(self,index):
+        """Row positions of `index`, adding any rows it introduces."""
+        positions = self.index.get_indexer(index)
+        if (positions >= 0).all():
+            return positions
+        extra = index[positions < 0]
+        if len(self.index)==0 or extra.min() > self.index[-1]:
+            # new rows at the end only:
+            self._reserve(len(self.index)+len(extra),len(self.keys))
+            self.index = self.index.append(extra.sort_values())
+        else:
+            # rows before or between existing ones move every column:
+            self._reindex(self.index.union(index))
+        return self.index.get_indexer(index)
+
+    def _reindex(self,index):
+        old_buffers,old_totals = self._buffers,self._totals
+        positions = index.get_indexer(self.index)
+        rows,cols = len(self.index),len(self.keys)
+        self._allocate(len(index),old_buffers["values"].shape[1])
+        for field in FIELDS:
+            self._buffers[field][positions,:cols] = old_buffers[field][:rows,:cols]
+        for field in self._totals:
+            self._totals[field][positions] = old_totals[field][:rows]
+        self.index = index
+
+    def _trim(self):
+        # drop leading and trailing rows no asset holds any more.
+        # Checking the edge rows is O(assets); the scan and copy only
+        # happen when one of them emptied:
+        n = len(self.index)
+        if n==0:
+            return
+        live = self.columns()
+        if self._held(live,[0,n-1]).all():
+            return
+        held = np.flatnonzero(self._held(live))
+        if len(held)==0:
+            first,last = 0,0
+        else:
+            first,last = held[0],held[-1]+1
+        old_buffers,old_totals = self._buffers,self._totals
+        cols = len(self.keys)
+        self._allocate(last-first,old_buffers["values"].shape[1])
+        for field in FIELDS:
+            self._buffers[field][:,:cols] = old_buffers[field][first:last,:cols]
+        for field in self._totals:
+            self._totals[field][:] = old_totals[field][first:last]
+        self.index = self.index[first:last]
+
+    def _held(self,cols,rows=slice(None)):
+        # rows any of the assets has deposits, coins or a price on;
+        # rows before a first buy hold coins without deposits:
+        held = None
+        for values in [self.deposits,self.coins,self.prices]:
+            values = ~np.isnan(values[rows][:,cols]).all(axis=1)
+            held = values if held is None else held | values
+        return held
+
+    def _compact(self):
+        # drop the columns of removed assets:
+        live = np.flatnonzero(self._live[:len(self.keys)])
+        old_buffers = self._buffers
+        old_totals = self._totals
+        rows = len(self.index)
+        self.keys = [self.keys[jj] for jj in live]
+        self.names = [self.names[jj] for jj in live]
+        self._column = {key: jj for jj,key in enumerate(self.keys)}
+        self._live = np.ones(len(live),dtype=bool)
+        self._allocate(old_buffers["values"].shape[0],len(live))
+        for field in FIELDS:
+            self._buffers[field][:rows,:len(live)] = old_buffers[field][:rows,live]
+        self._totals = old_totals
+
+    def _new_column(self,key,name):
+        # reuse the slot of a removed asset if there is one:
+        free = np.flatnonzero(~self._live[:len(self.keys)])
+        if len(free) > 0:
+            jj = free[0]
+            self.keys[jj] = key
+            self.names[jj] = name
+        else:
+            jj = len(self.keys)
+            self._reserve(len(self.index),jj+1)
+            self.keys.append(key)
+            self.names.append(name)
+        self._column[key] = jj
+        self._live[jj] = True
+        return jj
+
+    def _clear(self,jj):
+        for field in FIELDS:
+            self._buffers[field][:,jj] = np.nan
+
+    def _write(self,jj,rows,df):
+        n = len(self.index)
+        buffers = {field: self._buffers[field][:n] for field in FIELDS}
+        buffers["deposits"][rows,jj] = df.usd_deposits.to_numpy()
+        buffers["coins"][rows,jj] = df.number_of_coins.to_numpy()
+        buffers["prices"][rows,jj] = df.coin_price.to_numpy()
+        buffers["values"][rows,jj] = (
+            buffers["coins"][rows,jj]*buffers["prices"][rows,jj]
+            )
+
+    def _add_totals(self,jj,rows,sign):
+        n = len(self.index)
+        values = self._buffers["values"][:n,jj][rows]
+        deposits = self._buffers["deposits"][:n,jj][rows]
+        self.total_values[rows] += sign*np.nan_to_num(values)
+        self.total_deposits[rows] += sign*np.nan_to_num(deposits)
+
+    def _frame(self,values,totals,names,total):
+        cols = self.columns(names)
+        df = pd.DataFrame(
+            values[:,cols],
+            index=self.index,
+            columns=list(np.asarray(self.names,dtype=object)[cols]),
+            )
+        if total:
+            if names is None:
+                df["total"] = totals.copy()
+            else:
+                df["total"] = np.nansum(values[:,cols],axis=1)
+        return df
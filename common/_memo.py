@@ -0,0 +1,101 @@
+"""In-memory memoization of fetched frames.
+
+Sits in front of the candle cache so identical price_history calls
+within a process are served from memory. Concurrent identical calls
+are coalesced onto a single fetch, and the least recently used
+frames are evicted once their total size exceeds a byte budget.
+"""
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+class framememo:
+    def __init__(
+        self,
+        max_bytes=256*2**20,
+        ttl=60.0,
+        ):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.nbytes = 0
+        self._frames = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+        # metrics:
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def get(self,key,compute,volatile=False):
+        """Frame for `key`, calling `compute()` at most once at a time.
+
+        Volatile entries (e.g. ranges ending in a still-open candle)
+        expire after `ttl` seconds.
+        """
+        with self._lock:
+            entry = self._frames.get(key)
+            if entry is not None:
+                df,nbytes,expires = entry
+                if expires is None or expires > time.monotonic():
+                    self._frames.move_to_end(key)
+                    self.hits += 1
+                    return df
+                self._drop(key)
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._inflight[key] = future
+                self.misses += 1
+            else:
+                self.coalesced += 1
+        if not owner:
+            return future.result()
+
+        try:
+            df = compute()
+        except BaseException as exc:
+            with self._lock:
+                del self._inflight[key]
+            future.set_exception(exc)
+            raise
+        with self._lock:
+            del self._inflight[key]
+            expires = time.monotonic()+self.ttl if volatile else None
+            self._insert(key,df,expires)
+        future.set_result(df)
+        return df
+
+    def clear(self):
+        with self._lock:
+            self._frames.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        return {
+            "frames": len(self._frames),
+            "bytes": self.nbytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            }
+
+    def _insert(self,key,df,expires):
+        nbytes = int(df.memory_usage(index=True,deep=False).sum())
+        if nbytes > self.max_bytes:
+            return
+        if key in self._frames:
+            self._drop(key)
+        self._frames[key] = (df,nbytes,expires)
+        self.nbytes += nbytes
+        while self.nbytes > self.max_bytes:
+            self._drop(next(iter(self._frames)))
+
+    def _drop(self,key):
+        df,nbytes,expires = self._frames.pop(key)
+        self.nbytes -= nbytes
+
+# shared by both exchanges' price_history:
+price_memo = framememo()
@@ -0,0 +1,158 @@
+"""Deriving account datasets in worker processes.
+
+The pandas work behind the derived datasets holds the GIL, so on
+threads accounts are post-processed one at a time. derive_many runs
+it in a process pool instead. The input frames of every account are
+copied once into a single shared memory block, and workers build
+their frames as views on it, so ledgers and fills are not pickled:
+only a small layout and the account's other attributes go over the
+pipe, and only the derived frames come back.
+"""
+import gc
+import time
+import numpy as np
+import pandas as pd
+from multiprocessing.shared_memory import SharedMemory
+from concurrent.futures import ProcessPoolExecutor, Future
+
+from common._datasets import declared
+
+# arrays in the block start at multiples of:
+ALIGN = 64
+
+def derive_many(accounts,inputs,targets,processes=None):
+    """(seconds, {name: frame}, error) per account.
+
+    `inputs(account)` gives the frames (by dataset name) shipped to
+    the account's worker, `targets(account)` names the datasets
+    derived there. Numeric, datetime and string columns can be
+    shipped. Failures are returned rather than raised.
+    """
+    layouts = []
+    arrays = []
+    size = 0
+    for account in accounts:
+        try:
+            layout,packed,size = _layout(inputs(account),size)
+        except Exception as exc:
+            layout,packed = _failed(exc),[]
+        layouts.append(layout)
+        arrays += packed
+    block = SharedMemory(create=True,size=max(size,1))
+    try:
+        for offset,values in arrays:
+            _view(block,offset,values.dtype,values.shape)[...] = values
+        arrays = None
+        with ProcessPoolExecutor(processes) as pool:
+            futures = []
+            for account,layout in zip(accounts,layouts):
+                if isinstance(layout,tuple):
+                    futures.append(Future())
+                    futures[-1].set_result(layout)
+                    continue
+                futures.append(pool.submit(
+                    _derive,
+                    type(account),
+                    _bare_state(account),
+                    block.name,
+                    layout,
+                    targets(account),
+                    ))
+            return [_result(future) for future in futures]
+    finally:
+        block.close()
+        block.unlink()
+
+def _layout(frames,size):
+    # where each index and column goes in the block, from offset
+    # `size` on, and the arrays to copy there:
+    layout = {}
+    packed = []
+    for name,df in frames.items():
+        entries = []
+        for values in [df.index]+[df.iloc[:,ii] for ii in range(df.shape[1])]:
+            values = _packable(values)
+            entries.append((size,values.dtype.str,len(values)))
+            packed.append((size,values))
+            size += -(-values.nbytes//ALIGN)*ALIGN
+        layout[name] = {
+            "index_name": df.index.name,
+            "columns": list(df.columns),
+            "arrays": entries,
+            }
+    return layout,packed,size
+
+def _packable(values):
+    if isinstance(values.dtype,np.dtype) and values.dtype.kind in "biufcmM":
+        return np.asarray(values)
+    if pd.api.types.infer_dtype(values,skipna=False)=="string":
+        return np.asarray(values,dtype=str)
+    raise TypeError("cannot share %s values of %s"%(values.dtype,values.name))
+
+def _unpack(block,layout):
+    frames = {}
+    for name,entry in layout.items():
+        arrays = []
+        for offset,dtype,length in entry["arrays"]:
+            values = _view(block,offset,np.dtype(dtype),(length,))
+            if values.dtype.kind=="U":
+                values = values.astype(object)
+            arrays.append(values)
+        df = pd.DataFrame(
+            dict(enumerate(arrays[1:])),
+            index=pd.Index(arrays[0],name=entry["index_name"]),
+            copy=False,
+            )
+        df.columns = entry["columns"]
+        frames[name] = df
+    return frames
+
+def _view(block,offset,dtype,shape):
+    return np.ndarray(shape,dtype=dtype,buffer=block.buf,offset=offset)
+
+def _bare_state(account):
+    # everything but the datasets, which travel in the block:
+    names = declared(type(account))
+    return {
+        key: value for key,value in vars(account).items()
+        if key not in names
+        }
+
+def _derive(cls,state,block_name,layout,targets):
+    ti = time.perf_counter()
+    block = SharedMemory(name=block_name)
+    try:
+        account = cls.__new__(cls)
+        account.__dict__.update(state)
+        for name,df in _unpack(block,layout).items():
+            setattr(account,name,df)
+        results = {name: getattr(account,name) for name in targets}
+        error = None
+    except Exception as exc:
+        results = {}
+        error = "%s: %s"%(type(exc).__name__,exc)
+    account = None
+    _release(block)
+    return time.perf_counter()-ti,results,error
+
+def _release(block):
+    # views on the block may be held in reference cycles; if one
+    # outlives a collection too, the block stays mapped until exit:
+    try:
+        block.close()
+        return
+    except BufferError:
+        gc.collect()
+    try:
+        block.close()
+    except BufferError:
+        pass
+
+def _failed(exc):
+    return 0.0,{},"%s: %s"%(type(exc).__name__,exc)
+
+def _result(future):
+    try:
+        return future.result()
+    except Exception as exc:
+        return _failed(exc)
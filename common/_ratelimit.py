@@ -0,0 +1,89 @@
+"""Thread-safe token buckets for exchange request budgets."""
+import threading
+import time
+
+class tokenbucket:
+    """Token bucket with burst capacity and 429-aware backoff.
+
+    Tokens refill continuously at `rate` per second up to
+    `capacity`. Callers reserve a token and sleep for however long
+    the reservation says, so waiting happens outside the lock and
+    concurrent callers are served in arrival order.
+    """
+    def __init__(
+        self,
+        name,
+        rate,
+        capacity,
+        backoff=1.0,
+        ):
+        self.name = name
+        self.rate = rate
+        self.capacity = capacity
+        self.backoff_seconds = backoff
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+        # metrics:
+        self.num_requests = 0
+        self.num_waits = 0
+        self.num_throttled = 0
+        self.wait_time = 0.0
+
+    def reserve(self):
+        """Take a token and return the seconds to wait before use."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.capacity,
+                self._tokens + (now-self._updated)*self.rate,
+                )
+            self._updated = now
+            self._tokens -= 1.0
+            wait = max(
+                -self._tokens/self.rate,
+                self._blocked_until-now,
+                0.0,
+                )
+            self.num_requests += 1
+            if wait > 0:
+                self.num_waits += 1
+                self.wait_time += wait
+            return wait
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def backoff(self,delay=None):
+        """Pause the bucket after the server reported a rate limit."""
+        if delay is None:
+            delay = self.backoff_seconds
+        with self._lock:
+            now = time.monotonic()
+            self._blocked_until = max(self._blocked_until,now+delay)
+            self._tokens = min(self._tokens,0.0)
+            self.num_throttled += 1
+
+    def stats(self):
+        return {
+            "requests": self.num_requests,
+            "waits": self.num_waits,
+            "throttled": self.num_throttled,
+            "wait_time": self.wait_time,
+            }
+
+def budget_bucket(name,limit,period,backoff=1.0):
+    """Bucket that never exceeds `limit` requests in any `period`.
+
+    A full burst plus one period of refill must fit in the budget,
+    so a third of it is given to burst capacity and the rest to the
+    sustained rate.
+    """
+    capacity = max(limit//3,1)
+    rate = (limit-capacity)/period
+    return tokenbucket(name,rate,capacity,backoff=backoff)
@@ -0,0 +1,31 @@
+"""Keyed HMAC state shared by the exchange credentials.
+
+Keying an HMAC (hashing the padded key into the inner and outer
+states) costs as much as signing a short message. The signer keys
+once and continues a copy of that state for every signature.
+"""
+import hmac
+import base64
+import hashlib
+
+class hmacsigner:
+    def __init__(self,key,digestmod="sha256"):
+        self.key = key
+        self.digestmod = digestmod
+        self._base = hmac.new(key,digestmod=getattr(hashlib,digestmod))
+
+    def digest(self,message):
+        state = self._base.copy()
+        state.update(message)
+        return state.digest()
+
+    def sign(self,message):
+        """Base64 signature of `message` (bytes)."""
+        return base64.b64encode(self.digest(message)).decode("ascii")
+
+    # hmac states do not pickle; key again on the other side:
+    def __getstate__(self):
+        return {"key": self.key, "digestmod": self.digestmod}
+
+    def __setstate__(self,state):
+        self.__init__(state["key"],state["digestmod"])
@@ -0,0 +1,141 @@
+"""Columnar on-disk storage for DataFrames.
+
+A frame is stored as a directory with one file per column and one
+for the index, plus a meta.json with names and encodings. Numeric
+and datetime columns are .npy files that reload memory-mapped,
+string columns are fixed-width .npy arrays and anything else
+(dicts, mixed objects) is one JSON list per column.
+"""
+import os
+import json
+import shutil
+import numpy as np
+import pandas as pd
+
+META_FILE = "meta.json"
+
+# root of the local data cache, overridden by $CRYPTO_API_CACHE or
+# set_cache_dir(). None disables caching:
+_cache_dir = os.environ.get(
+    "CRYPTO_API_CACHE",
+    os.path.join(os.path.expanduser("~"),".cache","crypto-api"),
+    )
+
+def set_cache_dir(path):
+    global _cache_dir
+    _cache_dir = path
+
+def cache_dir():
+    return _cache_dir
+
+def save_frame(path,df,attrs=None):
+    """Write `df` to directory `path`, replacing it atomically."""
+    tmp = "%s.tmp"%path
+    if os.path.isdir(tmp):
+        shutil.rmtree(tmp)
+    os.makedirs(tmp)
+    index = _save_array(tmp,"index",df.index)
+    columns = []
+    for ii,name in enumerate(df.columns):
+        column = _save_array(tmp,"c%d"%ii,df.iloc[:,ii])
+        column["name"] = name
+        columns.append(column)
+    meta = {
+        "index_name": df.index.name,
+        "index": index,
+        "columns": columns,
+        "attrs": attrs if attrs is not None else {},
+        }
+    with open(os.path.join(tmp,META_FILE),"w") as of:
+        json.dump(meta,of,default=str)
+
+    # swap the new directory in:
+    old = "%s.old"%path
+    if os.path.isdir(path):
+        os.replace(path,old)
+    os.replace(tmp,path)
+    if os.path.isdir(old):
+        shutil.rmtree(old)
+
+def load_frame(path,mmap=True):
+    """Read a frame written by save_frame; None if there isn't one."""
+    meta = read_meta(path)
+    if meta is None:
+        return None
+    index = _load_array(path,meta["index"],mmap)
+    data = {}
+    for col in meta["columns"]:
+        data[col["name"]] = _load_array(path,col,mmap)
+    df = pd.DataFrame(
+        data,
+        index=pd.Index(index,name=meta["index_name"]),
+        columns=[col["name"] for col in meta["columns"]],
+        copy=False,
+        )
+    return df
+
+def read_meta(path):
+    fi = os.path.join(path,META_FILE)
+    if not os.path.isfile(fi):
+        return None
+    with open(fi,"r") as of:
+        return json.load(of)
+
+def read_attrs(path):
+    meta = read_meta(path)
+    if meta is None:
+        return None
+    return meta["attrs"]
+
+def save_frames(path,frames,attrs=None):
+    """Write a dict of frames as sibling frame directories."""
+    os.makedirs(path,exist_ok=True)
+    for name,df in frames.items():
+        save_frame(os.path.join(path,name),df)
+    with open(os.path.join(path,META_FILE),"w") as of:
+        json.dump(
+            {
+                "frames": list(frames),
+                "attrs": attrs if attrs is not None else {},
+                },
+            of,
+            default=str,
+            )
+
+def load_frames(path,mmap=True):
+    """Frames and attributes written by save_frames."""
+    meta = read_meta(path)
+    if meta is None:
+        return None,None
+    frames = {
+        name: load_frame(os.path.join(path,name),mmap=mmap)
+        for name in meta["frames"]
+        }
+    return frames,meta["attrs"]
+
+def _save_array(path,stem,values):
+    if isinstance(values.dtype,np.dtype) and values.dtype.kind in "biufcmM":
+        fi = "%s.npy"%stem
+        np.save(os.path.join(path,fi),np.asarray(values))
+        return {"file": fi, "encoding": "npy"}
+    if pd.api.types.infer_dtype(values,skipna=False)=="string":
+        fi = "%s.npy"%stem
+        np.save(os.path.join(path,fi),np.asarray(values,dtype=str))
+        return {"file": fi, "encoding": "str"}
+    fi = "%s.json"%stem
+    with open(os.path.join(path,fi),"w") as of:
+        json.dump(values.tolist(),of,default=str)
+    return {"file": fi, "encoding": "json"}
+
+def _load_array(path,entry,mmap):
+    fi = os.path.join(path,entry["file"])
+    if entry["encoding"]=="json":
+        with open(fi,"r") as of:
+            values = json.load(of)
+        array = np.empty(len(values),dtype=object)
+        array[:] = values
+        return array
+    if entry["encoding"]=="str":
+        return np.load(fi).astype(object)
+    # copy-on-write mapping so callers may still modify frames:
+    return np.load(fi,mmap_mode="c" if mmap else None)
@@ -0,0 +1,106 @@
+"""Helpers for consuming paged API results as streams."""
+import queue
+import threading
+import pandas as pd
+
+_DONE = object()
+
+def prefetched(iterable,depth=1):
+    """Iterate `iterable` on a background thread, `depth` items ahead.
+
+    Lets the consumer work on one page while the next one is being
+    downloaded, without ever holding more than `depth` pages in the
+    queue.
+    """
+    items = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(entry):
+        while not stop.is_set():
+            try:
+                items.put(entry,timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def worker():
+        try:
+            for item in iterable:
+                if not put((item,None)):
+                    return
+        except BaseException as exc:
+            put((_DONE,exc))
+            return
+        put((_DONE,None))
+
+    thread = threading.Thread(target=worker,daemon=True)
+    thread.start()
+    try:
+        while True:
+            item,exc = items.get()
+            if item is _DONE:
+                if exc is not None:
+                    raise exc
+                return
+            yield item
+    finally:
+        stop.set()
+
+class periodaccumulator:
+    def __init__(
+        self,
+        frequency="D",
+        last=(),
+        sums=(),
+        order=None,
+        ):
+        """One row per `frequency` period from time-indexed chunks.
+
+        Each period keeps the `last` columns of its latest row (by
+        time, then by the `order` column) and the totals of the `sums`
+        columns, so a ledger can be reduced page by page in any order
+        while holding one page plus the output. `frequency` must be a
+        fixed span such as "D" or "6h".
+        """
+        offset = pd.tseries.frequencies.to_offset(frequency)
+        try:
+            offset.nanos
+        except ValueError:
+            raise ValueError("streaming needs a fixed frequency, not %s"%frequency)
+        self.frequency = frequency
+        self.last = list(last)
+        self.sums = list(sums)
+        self.order = order
+        self.rows = 0
+        self._periods = None
+
+    def add(self,chunk):
+        if len(chunk)==0:
+            return
+        self.rows += len(chunk)
+        part = self._reduce(
+            chunk.assign(time=chunk.index,period=chunk.index.floor(self.frequency)),
+            )
+        if self._periods is not None:
+            part = self._reduce(pd.concat([self._periods,part]),counted=True)
+        self._periods = part
+
+    def result(self):
+        """Periods in time order, indexed by the time of their last
+        row, with an `entries` count."""
+        columns = self.last + self.sums + ["entries"]
+        if self._periods is None:
+            return pd.DataFrame(columns=columns,index=pd.DatetimeIndex([],name="time"))
+        df = self._periods.set_index("time").sort_index()
+        return df[columns]
+
+    def _reduce(self,df,counted=False):
+        keys = ["time"] if self.order is None else ["time",self.order]
+        df = df.sort_values(keys,kind="stable")
+        grouped = df.groupby("period",sort=False)
+        part = grouped.tail(1).set_index("period")[["time"]+self.last]
+        totals = grouped[self.sums+(["entries"] if counted else [])].sum()
+        if not counted:
+            totals["entries"] = grouped.size()
+        return part.join(totals).reset_index()
@@ -0,0 +1,94 @@
+"""Persisted account ledgers for incremental sync.
+
+Each account keeps its ledger, plus the frames derived from it, in
+the local data cache. The ledger carries a high-water mark in its
+attributes so a refresh only asks the exchange for newer entries,
+and derived frames are only recomputed from the appended tail on.
+"""
+import os
+import shutil
+import hashlib
+
+from common._store import save_frame, load_frame, read_attrs, cache_dir
+
+_default_store = None
+
+def default_store():
+    """Store under the configured cache directory, None if disabled."""
+    global _default_store
+    root = cache_dir()
+    if root is None:
+        return None
+    if _default_store is None or _default_store.root!=root:
+        _default_store = ledgerstore(root)
+    return _default_store
+
+def account_key(*parts):
+    """Stable, non-reversible key for credentials-derived names."""
+    text = "-".join(str(part) for part in parts)
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+class ledgerstore:
+    def __init__(self,root):
+        self.root = root
+
+    def load(self,exchange,key,name="ledger"):
+        """Stored frame and its attributes, or (None, None)."""
+        path = self._path(exchange,key,name)
+        df = load_frame(path)
+        if df is None:
+            return None,None
+        return df,read_attrs(path)
+
+    def save(self,exchange,key,name,df,attrs=None):
+        path = self._path(exchange,key,name)
+        os.makedirs(os.path.dirname(path),exist_ok=True)
+        save_frame(path,df,attrs=attrs)
+
+    def clear(self,exchange,key):
+        path = os.path.join(self.root,"ledgers",exchange,key)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+
+    def _path(self,exchange,key,name):
+        return os.path.join(self.root,"ledgers",exchange,key,name)
+
+def resume_from(old,index,tail):
+    """First label of `index` from which `old` must be recomputed.
+
+    `old` is a previously derived frame and `tail` the time of the
+    earliest newly appended ledger entry. Returns None when `old`
+    can't be reused (nothing stored, or a different date index) and
+    everything has to be recomputed.
+    """
+    if tail is None or old is None or len(old)==0 or len(index)==0:
+        return None
+    if len(old) > len(index) or not old.index.equals(index[:len(old)]):
+        return None
+
+    # the period holding the tail, and never later than the old
+    # frame's final row, whose price was still moving:
+    pos = min(
+        max(index.searchsorted(tail,side="right")-1,0),
+        len(old)-1,
+        )
+    return index[pos]
+
+def carry_head(df,old,since,columns):
+    """Copy `old` rows before `since` into `df` for `columns`."""
+    head = old.loc[old.index < since]
+    for col in columns:
+        df.loc[head.index,col] = head[col]
+    return df
+
+def first_change(old,new):
+    """Earliest label of `old` whose value differs in `new`.
+
+    Returns the last label of `old` when nothing changed.
+    """
+    new = new.reindex(old.index)
+    same = (new==old) | (new.isna() & old.isna())
+    changed = old.index[~same.values]
+    if len(changed) > 0:
+        return changed[0]
+    return old.index[-1]
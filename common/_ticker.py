@@ -0,0 +1,154 @@
+"""Streaming ticker prices over the exchanges' websocket feeds.
+
+A pricefeed keeps one websocket open on a background thread and
+holds the latest trade price of every subscribed pair in memory.
+Subscribers are called with (pair, price, time) on each update, so
+valuations can follow the market without any REST requests:
+
+    feed = cbpro.markets.live_prices(["BTC-USD","ETH-USD"])
+    portfolio.follow_prices(feed)
+    ...
+    feed.stop()
+
+The exchange specifics (how to connect, subscribe, keep the
+connection alive and parse a message) come from a protocol object.
+"""
+import time
+import threading
+import pandas as pd
+
+class pricefeed:
+    def __init__(
+        self,
+        protocol,
+        pairs,
+        reconnect_delay=1.0,
+        ):
+        self.protocol = protocol
+        self.pairs = list(pairs)
+        self.reconnect_delay = reconnect_delay
+        self.prices = {}
+        self.times = {}
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._updated = threading.Condition(self._lock)
+        self._stop = threading.Event()
+        self._thread = None
+        self._ws = None
+
+        # metrics:
+        self.messages = 0
+        self.updates = 0
+        self.connects = 0
+
+    # -- lifecycle ----------------------------------------------------
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run,daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self,timeout=5):
+        self._stop.set()
+        ws = self._ws
+        if ws is not None:
+            ws.close()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self,*exc):
+        self.stop()
+
+    # -- prices -------------------------------------------------------
+    def subscribe(self,callback):
+        """Call `callback(pair, price, time)` on every price update,
+        from the feed's thread."""
+        self._subscribers.append(callback)
+        return callback
+
+    def unsubscribe(self,callback):
+        if callback in self._subscribers:
+            self._subscribers.remove(callback)
+
+    def price(self,pair):
+        """Latest price of `pair`, None before its first update."""
+        return self.prices.get(pair)
+
+    def snapshot(self):
+        """Latest prices as a Series indexed by pair."""
+        with self._lock:
+            return pd.Series(self.prices,dtype="float64")
+
+    def wait(self,pairs=None,timeout=10):
+        """Block until every pair (all subscribed by default) has a
+        price. Returns False on timeout."""
+        pairs = self.pairs if pairs is None else pairs
+        deadline = time.monotonic()+timeout
+        with self._updated:
+            while not all(pair in self.prices for pair in pairs):
+                remaining = deadline-time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._updated.wait(remaining)
+        return True
+
+    def publish(self,pair,price,when=None):
+        """Record a price and notify the subscribers."""
+        if when is None:
+            when = pd.Timestamp.now()
+        with self._updated:
+            self.prices[pair] = price
+            self.times[pair] = when
+            self.updates += 1
+            self._updated.notify_all()
+        for callback in list(self._subscribers):
+            callback(pair,price,when)
+
+    # -- connection ---------------------------------------------------
+    def _run(self):
+        # reconnect (with a fresh subscription) until stopped:
+        while not self._stop.is_set():
+            try:
+                self._ws = self.protocol.connect()
+                self.connects += 1
+                self.protocol.subscribe(self._ws,self.pairs)
+                self._listen(self._ws)
+            except (OSError, ValueError) as exc:
+                if self._stop.is_set():
+                    break
+                print("price feed disconnected...%s"%exc)
+            finally:
+                if self._ws is not None:
+                    self._ws.close()
+                    self._ws = None
+            self._stop.wait(self.reconnect_delay)
+
+    def _listen(self,ws):
+        interval = self.protocol.ping_interval
+        last_ping = time.monotonic()
+        while not self._stop.is_set():
+            message = ws.recv_json(timeout=interval)
+            if interval is not None and time.monotonic()-last_ping >= interval:
+                self.protocol.ping(ws)
+                last_ping = time.monotonic()
+            if message is None:
+                continue
+            self.messages += 1
+            for pair,price,when in self.protocol.parse(message):
+                self.publish(pair,price,when)
+
+def revalue(df,price):
+    """Value the last row of a performance frame at `price`, in place."""
+    if df is None or len(df)==0:
+        return
+    row = len(df)-1
+    cols = df.columns
+    coins = df.iat[row,cols.get_loc("number_of_coins")]
+    deposits = df.iat[row,cols.get_loc("usd_deposits")]
+    df.iat[row,cols.get_loc("coin_price")] = price
+    df.iat[row,cols.get_loc("coin_usd_value")] = coins*price
+    df.iat[row,cols.get_loc("performance")] = coins*price/deposits
@@ -0,0 +1,205 @@
+"""Pooled HTTP transport shared by the exchange API wrappers.
+
+Connections are kept alive and reused across every apiwrapper
+instance in the process, keyed by (scheme, host, port). The old
+curl subprocess path is kept as an opt-in fallback.
+"""
+import io
+import json
+import ssl
+import threading
+import http.client
+from subprocess import Popen, PIPE
+from urllib.parse import urlsplit
+
+# transport used when an apiwrapper does not set its own.
+# Either "http" (pooled, in-process) or "curl" (one subprocess
+# per request):
+DEFAULT_TRANSPORT = "http"
+
+# errors that mean a kept-alive connection went stale and the
+# request can safely be resent on a fresh connection:
+_STALE_ERRORS = (
+    http.client.RemoteDisconnected,
+    http.client.CannotSendRequest,
+    ConnectionResetError,
+    BrokenPipeError,
+    )
+
+# process-wide connection pools:
+_pools = {}
+_pools_lock = threading.Lock()
+_ssl_context = ssl.create_default_context()
+
+def set_default_transport(name):
+    global DEFAULT_TRANSPORT
+    if name not in ("http","curl"):
+        raise ValueError("unknown transport: %s"%name)
+    DEFAULT_TRANSPORT = name
+
+class response:
+    def __init__(
+        self,
+        status,
+        headers,
+        body,
+        ):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self._json = None
+
+    def json(self):
+        # decoded once, later calls share the parsed object:
+        if self._json is None:
+            self._json = json.loads(self.body)
+        return self._json
+
+class connectionpool:
+    def __init__(
+        self,
+        scheme,
+        host,
+        port,
+        max_idle=16,
+        timeout=30,
+        ):
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def request(
+        self,
+        method,
+        path,
+        headers,
+        body="",
+        ):
+        # a reused connection may have been closed by the server
+        # while idle; retry once on a fresh one in that case:
+        for attempt in range(2):
+            conn,reused = self._checkout()
+            try:
+                conn.request(
+                    method,
+                    path,
+                    body=body if body else None,
+                    headers=headers,
+                    )
+                resp = conn.getresponse()
+                data = resp.read()
+            except _STALE_ERRORS:
+                conn.close()
+                if reused and attempt==0:
+                    continue
+                raise
+            except:
+                conn.close()
+                raise
+            if resp.will_close:
+                conn.close()
+            else:
+                self._checkin(conn)
+            return response(resp.status,resp.headers,data)
+
+    def close(self):
+        with self._lock:
+            idle,self._idle = self._idle,[]
+        for conn in idle:
+            conn.close()
+
+    def _checkout(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop(),True
+        if self.scheme=="https":
+            conn = http.client.HTTPSConnection(
+                self.host,
+                self.port,
+                timeout=self.timeout,
+                context=_ssl_context,
+                )
+        else:
+            conn = http.client.HTTPConnection(
+                self.host,
+                self.port,
+                timeout=self.timeout,
+                )
+        return conn,False
+
+    def _checkin(self,conn):
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+def get_pool(scheme,host,port):
+    key = (scheme,host,port)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = connectionpool(scheme,host,port)
+            _pools[key] = pool
+    return pool
+
+def close_pools():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+def request(
+    method,
+    url,
+    headers,
+    body="",
+    transport=None,
+    ):
+    if transport is None:
+        transport = DEFAULT_TRANSPORT
+    if transport=="curl":
+        return _curl_request(method,url,headers,body)
+    parts = urlsplit(url)
+    pool = get_pool(parts.scheme,parts.hostname,parts.port)
+    path = parts.path
+    if parts.query:
+        path = "%s?%s"%(path,parts.query)
+    return pool.request(method,path,headers,body)
+
+def curl_command(method,url,headers,body=""):
+    cmd = [
+        "curl",
+        url,
+        "--request",
+        method,
+        ]
+    for key,value in headers.items():
+        cmd += ["--header","%s: %s"%(key,value)]
+    if body:
+        cmd += ["--data",body]
+    return cmd
+
+def _curl_request(method,url,headers,body):
+    cmd = curl_command(method,url,headers,body)
+    cmd += ["--silent","--dump-header","-"]
+    p = Popen(cmd,stdout=PIPE,stderr=PIPE)
+    stdout,stderr = p.communicate()
+
+    # headers come first, separated from the body by a blank
+    # line. Skip any interim "100 Continue" blocks:
+    head,_,data = stdout.partition(b"\r\n\r\n")
+    while head.startswith(b"HTTP/") and b" 100 " in head.split(b"\r\n")[0]:
+        head,_,data = data.partition(b"\r\n\r\n")
+    status_line,_,header_lines = head.partition(b"\r\n")
+    try:
+        status = int(status_line.split()[1])
+    except (IndexError, ValueError):
+        status = 0
+    headers = http.client.parse_headers(io.BytesIO(header_lines+b"\r\n\r\n"))
+    return response(status,headers,data)
@@ -0,0 +1,188 @@
+"""Minimal websocket (RFC 6455) client on the standard library.
+
+Enough of the protocol for the exchanges' public market data feeds:
+text messages, ping/pong and close, over ws:// or wss://. The frame
+helpers are shared with local stand-in servers.
+"""
+import os
+import ssl
+import json
+import base64
+import socket
+import struct
+import hashlib
+from urllib.parse import urlsplit
+
+# opcodes:
+CONTINUATION = 0x0
+TEXT = 0x1
+BINARY = 0x2
+CLOSE = 0x8
+PING = 0x9
+PONG = 0xA
+
+_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+_ssl_context = ssl.create_default_context()
+
+class WebSocketClosed(ConnectionError):
+    pass
+
+def accept_key(key):
+    """Sec-WebSocket-Accept value for a Sec-WebSocket-Key."""
+    digest = hashlib.sha1((key+_GUID).encode()).digest()
+    return base64.b64encode(digest).decode()
+
+def encode_frame(opcode,payload,mask=True):
+    """One final frame; clients must mask, servers must not."""
+    head = bytearray([0x80 | opcode])
+    flag = 0x80 if mask else 0
+    n = len(payload)
+    if n < 126:
+        head.append(flag | n)
+    elif n < 2**16:
+        head.append(flag | 126)
+        head += struct.pack("!H",n)
+    else:
+        head.append(flag | 127)
+        head += struct.pack("!Q",n)
+    if not mask:
+        return bytes(head) + payload
+    key = os.urandom(4)
+    return bytes(head) + key + _mask(payload,key)
+
+def read_frame(recv_exactly):
+    """(fin, opcode, payload) of the next frame, reading through
+    `recv_exactly(n)`."""
+    b0,b1 = recv_exactly(2)
+    n = b1 & 0x7F
+    if n==126:
+        n = struct.unpack("!H",recv_exactly(2))[0]
+    elif n==127:
+        n = struct.unpack("!Q",recv_exactly(8))[0]
+    key = recv_exactly(4) if b1 & 0x80 else None
+    payload = recv_exactly(n)
+    if key is not None:
+        payload = _mask(payload,key)
+    return bool(b0 & 0x80),b0 & 0x0F,payload
+
+def _mask(payload,key):
+    # XOR with the repeated 4-byte key, a machine word at a time:
+    n = len(payload)
+    repeated = (key*(n//4+1))[:n]
+    masked = int.from_bytes(payload,"little") ^ int.from_bytes(repeated,"little")
+    return masked.to_bytes(n,"little")
+
+def connect(url,timeout=30,headers=None):
+    """Open a client connection to a ws:// or wss:// url."""
+    parts = urlsplit(url)
+    secure = parts.scheme=="wss"
+    port = parts.port or (443 if secure else 80)
+    sock = socket.create_connection((parts.hostname,port),timeout=timeout)
+    if secure:
+        sock = _ssl_context.wrap_socket(sock,server_hostname=parts.hostname)
+    path = parts.path or "/"
+    if parts.query:
+        path = "%s?%s"%(path,parts.query)
+    key = base64.b64encode(os.urandom(16)).decode()
+    lines = [
+        "GET %s HTTP/1.1"%path,
+        "Host: %s"%parts.netloc,
+        "Upgrade: websocket",
+        "Connection: Upgrade",
+        "Sec-WebSocket-Key: %s"%key,
+        "Sec-WebSocket-Version: 13",
+        ]
+    for name,value in (headers or {}).items():
+        lines.append("%s: %s"%(name,value))
+    sock.sendall(("\r\n".join(lines)+"\r\n\r\n").encode())
+
+    # read the handshake response up to the blank line; anything
+    # after it already belongs to the first frames:
+    data = b""
+    while b"\r\n\r\n" not in data:
+        chunk = sock.recv(4096)
+        if not chunk:
+            sock.close()
+            raise WebSocketClosed("connection closed during handshake")
+        data += chunk
+    head,_,rest = data.partition(b"\r\n\r\n")
+    status_line,*header_lines = head.decode("latin-1").split("\r\n")
+    fields = {}
+    for line in header_lines:
+        name,_,value = line.partition(":")
+        fields[name.strip().lower()] = value.strip()
+    if status_line.split()[1]!="101" or fields.get("sec-websocket-accept")!=accept_key(key):
+        sock.close()
+        raise ConnectionError("websocket handshake failed: %s"%status_line)
+    return websocket(sock,rest)
+
+class websocket:
+    def __init__(self,sock,buffered=b""):
+        self.sock = sock
+        self.closed = False
+        self._buffer = bytearray(buffered)
+        self._pos = 0
+
+    def send(self,text):
+        self._send(TEXT,text.encode("utf-8"))
+
+    def send_json(self,message):
+        self.send(json.dumps(message))
+
+    def recv(self,timeout=None):
+        """Next text message, or None if none arrives in `timeout`
+        seconds. Pings are answered and fragments joined."""
+        self.sock.settimeout(timeout)
+        fragments = []
+        while True:
+            try:
+                fin,opcode,payload = read_frame(self._recv_exactly)
+            except socket.timeout:
+                # rewind to the start of the partly read frame:
+                self._pos = 0
+                if fragments:
+                    raise
+                return None
+            del self._buffer[:self._pos]
+            self._pos = 0
+            if opcode==PING:
+                self._send(PONG,payload)
+                continue
+            if opcode==PONG:
+                continue
+            if opcode==CLOSE:
+                self.close()
+                raise WebSocketClosed("closed by server")
+            fragments.append(payload)
+            if fin:
+                return b"".join(fragments).decode("utf-8")
+
+    def recv_json(self,timeout=None):
+        text = self.recv(timeout)
+        return None if text is None else json.loads(text)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self._send(CLOSE,b"")
+        except OSError:
+            pass
+        self.sock.close()
+
+    def _send(self,opcode,payload):
+        self.sock.sendall(encode_frame(opcode,payload))
+
+    def _recv_exactly(self,n):
+        # bytes stay buffered until their frame is complete, so a
+        # timeout in the middle of a frame loses nothing:
+        while len(self._buffer)-self._pos < n:
+            chunk = self.sock.recv(65536)
+            if not chunk:
+                self.closed = True
+                raise WebSocketClosed("connection closed")
+            self._buffer += chunk
+        data = bytes(self._buffer[self._pos:self._pos+n])
+        self._pos += n
+        return data
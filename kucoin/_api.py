@@ -1,14 +1,48 @@
 import numpy as np
 import pandas as pd
-from subprocess import Popen, PIPE
-import json
-from datetime import datetime
+
+# HTTP transport and rate limiting:
+import common._transport as transport
+from common._ratelimit import budget_bucket
+import common._instrument as instrument
 
 # API authentification:
 import time
-import hmac
-import hashlib
-import base64
+from common._signing import hmacsigner
+
+# KuCoin request budgets as (requests, per seconds). One bucket
+# per endpoint class is shared by every apiwrapper in the process:
+RATE_LIMITS = {
+    "ledger": (18,3.0),
+    "fills": (9,3.0),
+    "market": (30,3.0),
+    "default": (18,3.0),
+    }
+RATE_LIMIT_PREFIXES = [
+    ("/api/v1/accounts/ledgers","ledger"),
+    ("/api/v1/fills","fills"),
+    ("/api/v1/market","market"),
+    ]
+buckets = {
+    name: budget_bucket(name,limit,period)
+    for name,(limit,period) in RATE_LIMITS.items()
+    }
+
+def rate_limit_bucket(request_path):
+    for prefix,name in RATE_LIMIT_PREFIXES:
+        if request_path.startswith(prefix):
+            return buckets[name]
+    return buckets["default"]
+
+def rate_limit_stats():
+    """Requests, waits, 429s and seconds spent waiting per bucket."""
+    return pd.DataFrame({
+        name: bucket.stats() for name,bucket in buckets.items()
+        }).transpose()
+
+# default REST endpoint; point it elsewhere (e.g. a local stand-in
+# server) to redirect every wrapper created afterwards:
+BASE_URL = "https://api.kucoin.com"
 
 # KuCoin API docs: 
 # https://docs.kucoin.com/?lang=en_US#general
@@ -16,16 +50,24 @@ import base64
 class apiwrapper:
     def __init__(
         self,
-        base_url="https://api.kucoin.com",
+        base_url=None,
+        transport=None,
+        max_retries=5,
         ):
-        self.base_url=base_url
+        self.base_url=BASE_URL if base_url is None else base_url
+        self.transport=transport
+        self.max_retries=max_retries
         self.api_key_file = None
+        self.credentials = None
 
     def read_keyfile(
         self,
         api_key_file,
         ):
-        self._read_api_key(api_key_file)
+        # public-only wrappers (and accounts restored with load)
+        # have no key file:
+        if api_key_file is not None:
+            self._read_api_key(api_key_file)
 
     def query(
         self,
@@ -36,75 +78,111 @@ class apiwrapper:
 
         # create query:
         url = "%s%s"%(self.base_url,request_path)
-        unauth_cmd = [
-            "curl",
-            url,
-            "--header",
-            "Accept: application/json",
-            "--header",
-            "Content-Type: application/json",
-            ]
-        auth_cmd = self._auth_commands(method,request_path,body)
-        cmd = unauth_cmd + auth_cmd
-
-        # submit query and return answer in JSON:  
-        p = Popen(cmd,stdout=PIPE,stderr=PIPE)
-        stdout,stderr = p.communicate()
-        return json.loads(stdout)
+        headers = {
+            "Accept": "application/json",
+            "Content-Type": "application/json",
+            }
+
+        # submit query through the endpoint's rate limit bucket,
+        # backing off and resubmitting while KuCoin answers 429:
+        bucket = rate_limit_bucket(request_path)
+        ti = time.perf_counter()
+        wait = transfer = decode = 0.0
+        for attempt in range(self.max_retries+1):
+            wait += bucket.acquire()
+            headers.update(self._auth_headers(method,request_path,body))
+            tt = time.perf_counter()
+            resp = transport.request(
+                method,
+                url,
+                headers,
+                body,
+                transport=self.transport,
+                )
+            td = time.perf_counter()
+            output = resp.json()
+            transfer += td-tt
+            decode += time.perf_counter()-td
+            if not self._rate_limited(resp,output):
+                break
+            bucket.backoff(self._retry_after(resp))
+        if instrument.active:
+            instrument.query_event(
+                "kucoin",
+                method,
+                request_path,
+                resp.status,
+                time.perf_counter()-ti,
+                wait,
+                transfer,
+                decode,
+                len(resp.body),
+                len(body),
+                attempt,
+                )
+        return output
+
+    def _rate_limited(self,resp,output):
+        if resp.status==429:
+            return True
+        return isinstance(output,dict) and output.get("code")=="429000"
+
+    def _retry_after(self,resp):
+        # milliseconds until the current rate limit window resets:
+        reset = resp.headers.get("gw-ratelimit-reset")
+        try:
+            return int(reset)/1000
+        except (TypeError, ValueError):
+            return None
 
     def _read_api_key(
         self,
         api_key_file,
         ):
         self.api_key_file=api_key_file  
-        with open(self.api_key_file,"r") as of:
-            self.API_KEY = of.readline().rstrip()
-            self.API_SECRET = of.readline().rstrip()
-            self.API_PASSPHRASE = of.readline().rstrip()
-
-    def _auth_commands(self,method,request_path,body):
-        if self.api_key_file!=None:
-            api_key = self.API_KEY
-            api_secret = self.API_SECRET
-            api_passphrase = self.API_PASSPHRASE
-            now = int(time.time() * 1000)
-            str_to_sign = str(now) + method + request_path + body
-            signature = base64.b64encode(
-                hmac.new(
-                    api_secret.encode('utf-8'),
-                    str_to_sign.encode('utf-8'),
-                    hashlib.sha256,
-                    ).digest()
-                ).decode('utf-8') #b64encode signature
-            passphrase = base64.b64encode(
-                hmac.new(
-                    api_secret.encode('utf-8'),
-                    api_passphrase.encode('utf-8'),
-                    hashlib.sha256,
-                    ).digest()
-                ).decode('utf-8') #b64encode passphrase
-            
-            # create authentication commands:
-            auth_cmd = [
-                "--header",
-                "KC-API-SIGN:%s"%signature,
-                "--header",
-                "KC-API-TIMESTAMP:%s"%(str(now)),
-                "--header",
-                "KC-API-KEY:%s"%api_key,
-                "--header",
-                "KC-API-PASSPHRASE:%s"%passphrase,
-                "--header",
-                "KC-API-KEY-VERSION:2",
-                ]
-        else:
-            auth_cmd = []
-        return auth_cmd
-
-
-
-
-
-
+        self.credentials = credentials.from_keyfile(api_key_file)
+        self.API_KEY = self.credentials.api_key
+        self.API_SECRET = self.credentials.api_secret
+        self.API_PASSPHRASE = self.credentials.api_passphrase
 
+    def _auth_headers(self,method,request_path,body):
+        if self.credentials is None:
+            return {}
+        return self.credentials.headers(method,request_path,body)
 
+class credentials:
+    def __init__(
+        self,
+        api_key,
+        api_secret,
+        api_passphrase,
+        ):
+        """KuCoin API key, keyed once for signing.
+
+        With key version 2 the passphrase is sent HMAC-signed with the
+        secret; it never changes, so it is signed here once.
+        """
+        self.api_key = api_key
+        self.api_secret = api_secret
+        self.api_passphrase = api_passphrase
+        self._signer = hmacsigner(api_secret.encode("utf-8"))
+        self.static_headers = {
+            "KC-API-KEY": api_key,
+            "KC-API-PASSPHRASE": self._signer.sign(api_passphrase.encode("utf-8")),
+            "KC-API-KEY-VERSION": "2",
+            }
+
+    @classmethod
+    def from_keyfile(cls,api_key_file):
+        # key, secret and passphrase on the first three lines:
+        with open(api_key_file,"r") as of:
+            return cls(*[of.readline().rstrip() for ii in range(3)])
+
+    def headers(self,method,request_path,body="",timestamp=None):
+        if timestamp is None:
+            timestamp = str(int(time.time() * 1000))
+        message = (timestamp + method + request_path + body).encode("utf-8")
+        headers = dict(self.static_headers)
+        headers["KC-API-SIGN"] = self._signer.sign(message)
+        headers["KC-API-TIMESTAMP"] = timestamp
+        return headers
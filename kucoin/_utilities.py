@@ -1,17 +1,27 @@
 """Utilities to support KuCoin account class."""
 import numpy as np
 import pandas as pd
-from datetime import datetime
 
 def update_createdAt(df):
-    df.loc[:,"createdAt"] = df.createdAt.apply(
-        lambda x: datetime.fromtimestamp(x/1000)
+    # millisecond epochs to naive UTC datetimes in one call:
+    df["createdAt"] = pd.to_datetime(
+        df.createdAt.to_numpy(dtype=np.int64),
+        unit="ms",
         )
 
+def parse_records(items,float_columns):
+    """Typed dataframe, indexed by createdAt, from KuCoin records."""
+    df = pd.DataFrame.from_records(items)
+    for col in float_columns:
+        df[col] = df[col].to_numpy().astype(np.float64)
+    update_createdAt(df)
+    return df.set_index("createdAt")
+
 def ledger_request_url(
     name,
     ti,
     te,
+    current_page=1,
     page_size=500,
     ): 
     endpoint = "/api/v1/accounts/ledgers"
@@ -19,6 +29,7 @@ def ledger_request_url(
         "currency=%s"%name,
         "startAt=%d"%ti,
         "endAt=%d"%te,
+        "currentPage=%d"%current_page,
         "pageSize=%d"%page_size,
         ]
     options = "&".join(options)
@@ -28,6 +39,7 @@ def fill_request_url(
     symbol,
     ti,
     te,
+    current_page=1,
     page_size=500,
     ):
     endpoint = "/api/v1/fills"
@@ -35,6 +47,7 @@ def fill_request_url(
         "symbol=%s"%symbol,
         "startAt=%d"%ti,
         "endAt=%d"%te,
+        "currentPage=%d"%current_page,
         "pageSize=%d"%page_size,
         ]
     options = "&".join(options)
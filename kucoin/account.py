@@ -5,50 +5,119 @@ Assumes USD fills made with USDT.
 import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta
-import time
 
 # KuCoin toolset:
 from kucoin._api import apiwrapper
 from kucoin.markets import price_history
 import kucoin._utilities as utils
 import kucoin._messages as messages
+import kucoin._fetch as fetch
+from common._sync import (
+    default_store,
+    account_key,
+    resume_from,
+    carry_head,
+    first_change,
+    )
+from common._store import save_frames, load_frames
+from common._stream import periodaccumulator
+from common._datasets import dataset, invalidate, computed, readonly
+from common._ticker import revalue
+import common._instrument as instrument
 
 # Pandas index slices:
 idx = pd.IndexSlice
 
+# datasets kept by each account, derived lazily on first access (see
+# common._datasets). Their return_* accessors hand out read-only
+# frames sharing the stored data, so writing into one raises; pass
+# copy=True for a private, mutable copy:
+DATASETS = [
+    "ledger",
+    "usd_fills",
+    "deposits",
+    "balance_sheet",
+    "performance_data",
+    ]
+
+def list_accounts(api_key_file):
+    """Every currency held by the key's user, indexed by currency.
+
+    One request lists the main, trade and other accounts of every
+    currency; their balances are summed per currency.
+    """
+    kuapi = apiwrapper()
+    kuapi.read_keyfile(api_key_file)
+    output = kuapi.query("/api/v1/accounts")
+    if output.get("code")!="200000":
+        raise RuntimeError("KuCoin rejected /api/v1/accounts: %s"%output.get("msg"))
+    df = pd.DataFrame.from_records(
+        output["data"],
+        columns=["id","currency","type","balance","available","holds"],
+        )
+    for col in ["balance","available","holds"]:
+        df[col] = df[col].to_numpy().astype(np.float64)
+    return df.groupby("currency").agg(
+        balance=("balance","sum"),
+        available=("available","sum"),
+        holds=("holds","sum"),
+        types=("type",",".join),
+        )
+
 # accounts class:
 class account(apiwrapper):
+    ledger = dataset("get_ledger")
+    usd_fills = dataset("get_usd_fills")
+    deposits = dataset("extract_deposits",["usd_fills"])
+    balance_sheet = dataset("extract_balance_sheet",["ledger"])
+    performance_data = dataset(
+        "extract_performance",
+        ["deposits","balance_sheet"],
+        )
+
+    # columns the deposits and balance sheet read, all that is sent
+    # to a worker process deriving them:
+    DERIVED_FROM = {
+        "ledger": ["balance"],
+        "usd_fills": ["side","funds","fee"],
+        }
+
     def __init__(
         self,
         name,
         api_key_file=None,
         verbose=True,
+        stream_frequency=None,
         ):
         apiwrapper.__init__(self)
         self.read_keyfile(api_key_file)
         self.name=name
         self.verbose_flag = verbose
+
+        # with a fixed frequency (e.g. "D") the ledger is streamed
+        # and kept as one row per period: the last entry's id, the
+        # summed amount and the balance after it. Derive datasets
+        # at that frequency or coarser:
+        self.stream_frequency = stream_frequency
         self.usd_pair="%s-USDT"%name
-        self.ledger=pd.DataFrame()
-        self.usd_fills=pd.DataFrame()
-        self.deposits=pd.DataFrame()
-        self.balance_sheet=pd.DataFrame()
-        self.performance_data=pd.DataFrame()
+        self._store=None
+        self._ledger_tail=None
 
     def set_date_range(self,di,de):
+        # every dataset covers the date range:
+        if (di,de)!=(getattr(self,"start_date",None),getattr(self,"end_date",None)):
+            invalidate(self)
         self.start_date = di
         self.end_date = de
 
     def standard_setup(self):
+        # derive everything afresh; the final dataset pulls in the
+        # stages it depends on:
+        invalidate(self)
         if self.name=="USD":
-            self.get_ledger()
-            self.extract_balance_sheet()
+            self.return_balance_sheet()
         else:
-            self.get_ledger()
-            self.get_usd_fills()
-            self.extract_deposits()
-            self.extract_balance_sheet()
-            self.extract_performance()
+            self.return_performance_data()
 
     def save_as_spreadsheet(self,loc):
         fi = "%s/%s-kucoin-data.xlsx"%(loc,self.name)
@@ -64,93 +133,194 @@ class account(apiwrapper):
             balance_sheet.to_excel(writer,sheet_name="balance_sheet")
             perf.to_excel(writer,sheet_name="portfolio_performance")
     
-    def get_ledger(self):
-        date_range = self._discretize_date_range("ledger")
-        frames = []
-        for start_date in date_range:
-            end_date = start_date + timedelta(days=1)
-            messages.ledger(
-                self.verbose_flag,
-                self.name,
-                start_date,
-                end_date,
+    def save(self,loc):
+        """Store every dataset in the columnar frame store."""
+        frames = {
+            name: getattr(self,name)
+            for name in DATASETS if computed(self,name)
+            }
+        attrs = {
+            "name": self.name,
+            "start_date": getattr(self,"start_date",None),
+            "end_date": getattr(self,"end_date",None),
+            }
+        path = "%s/%s-kucoin-data"%(loc,self.name)
+        save_frames(path,frames,attrs)
+
+    def load(self,loc,mmap=True):
+        """Restore datasets written by save, memory-mapped by default."""
+        path = "%s/%s-kucoin-data"%(loc,self.name)
+        frames,attrs = load_frames(path,mmap=mmap)
+        if frames is None:
+            raise FileNotFoundError("no saved account data in %s"%path)
+        self.set_date_range(*[
+            None if attrs[name] is None else pd.Timestamp(attrs[name]).date()
+            for name in ["start_date","end_date"]
+            ])
+        for name,df in frames.items():
+            setattr(self,name,df)
+
+    @instrument.stage
+    def get_ledger(self,sync=True):
+        # with sync enabled the ledger persisted by the last run is
+        # reused and only days from its latest entry on are walked
+        # again. Start one day early to absorb timezone offsets in
+        # createdAt; duplicates are dropped by id:
+        self._store = default_store() if sync else None
+        stored = None
+        first_day = None
+        if self._store is not None:
+            stored,attrs = self._store.load("kucoin",self._sync_key())
+            if stored is not None:
+                if attrs["start_date"]!=str(pd.Timestamp(self.start_date)):
+                    stored = None
+                else:
+                    # a run over a later end date may have stored
+                    # entries past this range; balances are running
+                    # totals from the start, so the head stays valid:
+                    end = pd.Timestamp(self.end_date) + timedelta(days=1)
+                    stored = stored[stored.index < end]
+                    if len(stored)==0:
+                        stored = None
+                    else:
+                        first_day = stored.index.max().floor("D") - timedelta(days=1)
+        # walk adaptive windows concurrently; the shared ledger
+        # bucket keeps us within KuCoin's request budget:
+        request_url = lambda ti,te,page,size: utils.ledger_request_url(
+            self.name,ti,te,page,size,
+            )
+        on_dispatch = lambda ti,te: messages.ledger(
+            self.verbose_flag,
+            self.name,
+            pd.Timestamp(ti,unit="ms"),
+            pd.Timestamp(te,unit="ms"),
+            )
+        if self.stream_frequency is not None:
+            results = self._stream_ledger(
+                request_url,
+                on_dispatch,
+                first_day,
+                stored,
                 )
-            te = int(end_date.timestamp()*1000)
-            ti = int(start_date.timestamp()*1000)
-            request = utils.ledger_request_url(self.name,ti,te)
-            output = self.query(request)
-            output_data = output["data"]
-            if output_data["totalNum"] > 0:
-                for item in output_data["items"]:
-                    s = pd.Series(item)
-                    frames.append(s)
-            
-            # make sure we never exceed 6 requests per second:
-            time.sleep(0.17)
+        else:
+            items = fetch.fetch_windows(
+                self,
+                request_url,
+                *self._request_span(start=first_day),
+                request_type="ledger",
+                on_dispatch=on_dispatch,
+                )
+
+            # build a typed dataframe from all records at once:
+            results = None
+            if len(items) > 0:
+                results = self._parse_ledger(items).sort_index(kind="stable")
         
-        # concatenate results into single dataframe:
-        if len(frames) > 0:
-            results = pd.concat(frames, axis=1).transpose()
-            utils.update_createdAt(results)
-            results = results.set_index("createdAt")
-            for col in ["amount","fee","balance"]:
-                results.loc[:,col] = results[col].apply(float)
-            results = results.sort_index()
-            
-            # multiply purchase amounts by negative 1:
-            negid = results[
-                (results.direction=="out")
-                & (results.accountType=="TRADE")
-                ].index
-            results.loc[negid,"amount"] *= -1.0
-            
-            # calculate balance and return:
-            results.loc[:,"balance"] = results.amount.cumsum()
-            self.ledger=results
+        # calculate balance, appending to the stored ledger if any:
+        if stored is None:
+            self._ledger_tail = None
+            if results is not None:
+                results.loc[:,"balance"] = results.amount.cumsum()
+                self.ledger=results
+        else:
+            self.ledger = self._append_ledger(stored,results)
+        if len(self.ledger) > 0:
+            self._save_synced(
+                "ledger",
+                self.ledger,
+                {
+                    "start_date": str(pd.Timestamp(self.start_date)),
+                    "end_date": str(pd.Timestamp(self.end_date)),
+                    "last_created_at": self.ledger.index.max().isoformat(),
+                    },
+                )
     
-    def return_ledger(self):
-        return self.ledger.copy()
+    def return_ledger(self,copy=False):
+        return self.ledger.copy() if copy else readonly(self.ledger)
+
+    def _parse_ledger(self,items):
+        results = utils.parse_records(items,["amount","fee","balance"])
+            
+        # multiply purchase amounts by negative 1:
+        negative = (
+            (results.direction=="out")
+            & (results.accountType=="TRADE")
+            ).to_numpy()
+        results["amount"] = np.where(
+            negative,
+            -results.amount.to_numpy(),
+            results.amount.to_numpy(),
+            )
+        return results
+
+    def _stream_ledger(self,request_url,on_dispatch,first_day,stored):
+        # reduce each page to per-period amounts as it arrives, so
+        # the full ledger is never held. Entries the stored ledger
+        # already counted are dropped by time, as a stored streamed
+        # ledger keeps one id per period:
+        periods = periodaccumulator(
+            self.stream_frequency,
+            last=["id"],
+            sums=["amount"],
+            )
+        def reduce(items):
+            if len(items)==0:
+                return
+            df = self._parse_ledger(items)
+            if stored is not None:
+                last = stored.index.max()
+                df = df[
+                    (df.index > last)
+                    | ((df.index==last) & ~df.id.isin(stored.id))
+                    ]
+            periods.add(df[["id","amount"]])
+        fetch.fetch_windows(
+            self,
+            request_url,
+            *self._request_span(start=first_day),
+            request_type="ledger",
+            on_dispatch=on_dispatch,
+            on_items=reduce,
+            )
+        if periods.rows==0:
+            return None
+        return periods.result().rename_axis("createdAt")
 
+    @instrument.stage
     def get_usd_fills(self):
-        date_range = self._discretize_date_range("fill")
-        frames = []
-        for start_date in date_range:
-            end_date = start_date + timedelta(days=7)
-            messages.usd_fills(
+        # walk adaptive windows concurrently; the shared fills
+        # bucket keeps us within KuCoin's request budget:
+        items = fetch.fetch_windows(
+            self,
+            lambda ti,te,page,size: utils.fill_request_url(
+                self.usd_pair,ti,te,page,size,
+                ),
+            *self._request_span(),
+            request_type="fill",
+            key="tradeId",
+            on_dispatch=lambda ti,te: messages.usd_fills(
                 self.verbose_flag,
                 self.name,
-                start_date,
-                end_date,
-                )
-            te = int(end_date.timestamp()*1000)
-            ti = int(start_date.timestamp()*1000)
-            request = utils.fill_request_url(self.usd_pair,ti,te)
-            output = self.query(request)
-            output_data = output["data"]
-            if output_data["totalNum"] > 0:
-                for item in output_data["items"]:
-                    s = pd.Series(item)
-                    frames.append(s)
-            
-            # make sure we never exceed 3 requests per second:
-            time.sleep(0.33)
+                pd.Timestamp(ti,unit="ms"),
+                pd.Timestamp(te,unit="ms"),
+                ),
+            )
         
-        # concatenate results into single dataframe:
-        if len(frames) > 0:
-            results = pd.concat(frames,axis=1).transpose()
-            utils.update_createdAt(results)
-            results = results.set_index("createdAt")
-            for col in ["price","size","funds","fee"]:
-                results.loc[:,col] = results[col].apply(float)
-            self.usd_fills = results
+        # build a typed dataframe from all records at once:
+        if len(items) > 0:
+            self.usd_fills = utils.parse_records(
+                items,
+                ["price","size","funds","fee"],
+                )
     
-    def return_usd_fills(self):
-        return self.usd_fills.copy()
+    def return_usd_fills(self,copy=False):
+        return self.usd_fills.copy() if copy else readonly(self.usd_fills)
 
+    @instrument.stage
     def extract_deposits(self):
         usd_fills = self.return_usd_fills()
-        usd_fills["usd_volume"] = usd_fills.funds + usd_fills.fee
-        usd_fills = usd_fills[
+        usd_volume = usd_fills.funds + usd_fills.fee
+        usd_volume = usd_volume[
             (usd_fills.side=="buy")
             ].resample("D"
             ).sum(
@@ -164,13 +334,14 @@ class account(apiwrapper):
             start=self.start_date,
             end=self.end_date,
             )
-        tdates = usd_fills.index
-        deposits.loc[tdates,"usd"] = usd_fills.usd_volume
+        tdates = usd_volume.index
+        deposits.loc[tdates,"usd"] = usd_volume
         self.deposits = deposits
     
-    def return_deposits(self):
-        return self.deposits.copy()
+    def return_deposits(self,copy=False):
+        return self.deposits.copy() if copy else readonly(self.deposits)
 
+    @instrument.stage
     def extract_balance_sheet(self,frequency="D"):
         col = "num_%s"%self.name
         df = utils.new_history_df(
@@ -179,57 +350,114 @@ class account(apiwrapper):
             end=self.end_date,
             frequency=frequency,
             )
-        ledger = self.return_ledger().resample(frequency).last()
-        df.loc[ledger.index,col] = ledger.balance.copy()
+        ledger = self.return_ledger()
+
+        # reuse the stored balance sheet up to the appended tail:
+        old = self._load_synced("balance_sheet")
+        since = resume_from(old,df.index,self._ledger_tail)
+        if since is not None:
+            carry_head(df,old,since,[col])
+            ledger = ledger[ledger.index >= since]
+        balance = ledger.balance.resample(frequency).last()
+        df.loc[balance.index,col] = balance
         df = df.ffill()
         self.balance_sheet = df
+        self._save_synced("balance_sheet",df)
     
-    def return_balance_sheet(self):
-        return self.balance_sheet.copy()
+    def return_balance_sheet(self,copy=False):
+        return self.balance_sheet.copy() if copy else readonly(self.balance_sheet)
 
+    @instrument.stage
     def extract_performance(
         self,
         granularity=86400, #daily
         ):
-        ph = price_history(
-            pair="%s-USDT"%self.name,
-            start=self.start_date,
-            end=self.end_date,
-            granularity=granularity,
-            )
         cols = [
             "usd_deposits",
             "number_of_coins",
+            "coin_price",
             ]
         df = utils.new_history_df(
             cols,
             start=self.start_date,
             end=self.end_date,
             )
-        deposits = self.return_deposits()
+        deposits = self.return_deposits().usd.cumsum()
         balance_sheet = self.return_balance_sheet()
-        num_coins = balance_sheet["num_%s"%self.name].copy()
-        df.loc[deposits.index,"usd_deposits"] = deposits.usd.cumsum()
-        df.loc[balance_sheet.index,"number_of_coins"] = num_coins
-        df["coin_price"] = ph.open.copy()
+
+        # reuse the stored performance data up to the appended
+        # ledger tail or the first day the deposits changed:
+        old = self._load_synced("performance_data")
+        since = resume_from(old,df.index,self._ledger_tail)
+        if since is not None:
+            since = min(since,first_change(old.usd_deposits,deposits.ffill()))
+            carry_head(df,old,since,cols)
+        else:
+            since = df.index[0]
+        ph = price_history(
+            pair="%s-USDT"%self.name,
+            start=since,
+            end=self.end_date,
+            granularity=granularity,
+            )
+        deposits = deposits.loc[since:]
+        num_coins = balance_sheet["num_%s"%self.name].loc[since:]
+        df.loc[deposits.index,"usd_deposits"] = deposits
+        df.loc[num_coins.index,"number_of_coins"] = num_coins
+        tail = df.index >= since
+        df.loc[tail,"coin_price"] = ph.open.reindex(df.index[tail]).values
         df = df.ffill()
         df["coin_usd_value"] = df.coin_price*df.number_of_coins
         df["performance"] = df.coin_usd_value/df.usd_deposits
         self.performance_data = df
+        self._save_synced("performance_data",df)
     
-    def return_performance_data(self):
-        return self.performance_data.copy()
+    def set_live_price(self,price):
+        # value the latest row at a streamed price, in place. Nothing
+        # is derived or downloaded when there is no data yet:
+        if computed(self,"performance_data"):
+            revalue(self.performance_data,price)
 
-    def _discretize_date_range(self,request_type):
-        freqbin = {
-            "ledger": "D",
-            "fill": "7D",
-            }
-        return pd.date_range(
-            self.start_date,
-            self.end_date,
-            freq=freqbin[request_type]
+    def return_performance_data(self,copy=False):
+        return self.performance_data.copy() if copy else readonly(self.performance_data)
+
+    def _request_span(self,start=None):
+        # (startAt, endAt) in ms, through the end of the last day:
+        if start is None:
+            start = self.start_date
+        ti = pd.Timestamp(start)
+        te = pd.Timestamp(self.end_date) + timedelta(days=1)
+        return int(ti.timestamp()*1000),int(te.timestamp()*1000)
+
+    def _append_ledger(self,stored,results):
+        # continue the stored running balance with the new entries;
+        # the tail start marks what has to be derived again:
+        if results is not None:
+            results = results[~results.id.isin(stored.id)]
+        if results is None or len(results)==0:
+            self._ledger_tail = pd.Timestamp(datetime.now())
+            return stored
+        results = results.assign(
+            balance=stored.balance.iloc[-1] + results.amount.cumsum(),
             )
+        self._ledger_tail = results.index.min()
+        return pd.concat([stored,results])
+
+    def _sync_key(self):
+        # streamed ledgers are stored apart from full ones:
+        if self.stream_frequency is not None:
+            return account_key(self.API_KEY,self.name,self.stream_frequency)
+        return account_key(self.API_KEY,self.name)
+
+    def _load_synced(self,name):
+        if self._store is None or self._ledger_tail is None:
+            return None
+        df,attrs = self._store.load("kucoin",self._sync_key(),name)
+        return df
+
+    def _save_synced(self,name,df,attrs=None):
+        if self._store is not None:
+            self._store.save("kucoin",self._sync_key(),name,df,attrs)
     
     
     
@@ -6,12 +6,183 @@ from datetime import datetime
 # internal functions:
 from kucoin._api import apiwrapper
 import kucoin._utilities as utils
+from common._candles import (
+    default_cache,
+    align,
+    last_closed,
+    fetch_range,
+    history_many,
+    )
+from common._memo import price_memo
+from common._ticker import pricefeed
+import common._websocket as websocket
 
 # pandas index slices:
 idx = pd.IndexSlice
 
+# most candles KuCoin returns per request, less the one extra
+# candle each slice asks for:
+MAX_CANDLES = 1499
+
+# KuCoin candle type for each granularity in seconds:
+CANDLE_TYPES = {
+    60: "1min",
+    180: "3min",
+    300: "5min",
+    900: "15min",
+    1800: "30min",
+    3600: "1hour",
+    7200: "2hour",
+    14400: "4hour",
+    21600: "6hour",
+    28800: "8hour",
+    43200: "12hour",
+    86400: "1day",
+    604800: "1week",
+    }
+
 # price history function:
 def price_history(
+    pair,
+    start,
+    end,
+    granularity=86400, #default    
+    cache=True,
+    dtype=np.float64,
+    ):
+    # granularity (seconds) must be one of CANDLE_TYPES. Prices come
+    # back as `dtype` columns; np.float32 halves the memory of long
+    # intraday ranges (a year of 1min candles is ~525k rows):
+    _check_granularity(granularity)
+
+    # Identical requests within the process are served from memory
+    # and concurrent ones share one download. Behind that, candles
+    # come from the on-disk candle cache when it is enabled, so only
+    # missing ranges and the still-open final candle are downloaded:
+    if not cache:
+        return _fetch_history(pair,start,end,granularity).astype(dtype)
+    start = align(start,granularity)
+    end = align(end,granularity)
+    results = price_memo.get(
+        ("kucoin",pair,granularity,start,end),
+        lambda: _cached_history(pair,start,end,granularity),
+        volatile=end > last_closed(granularity),
+        )
+    return results.astype(dtype)
+
+def price_history_many(
+    pairs,
+    start,
+    end,
+    granularity=86400, #default
+    field="open",
+    cache=True,
+    dtype=np.float64,
+    ):
+    # one wide frame (time x pair) of `field` for all pairs. Every
+    # pair's slices are downloaded through a single concurrent,
+    # rate limited pipeline:
+    _check_granularity(granularity)
+    kuapi = apiwrapper()
+    results = history_many(
+        "kucoin",
+        pairs,
+        start,
+        end,
+        granularity,
+        MAX_CANDLES,
+        lambda pair,di,de: _fetch_slice(kuapi,pair,di,de,granularity),
+        field=field,
+        cache=default_cache() if cache else None,
+        )
+    return results.astype(dtype)
+
+def live_prices(pairs):
+    # latest trade price of each pair, streamed from the websocket
+    # ticker topic into memory on a background thread:
+    return pricefeed(tickerprotocol(),pairs).start()
+
+class tickerprotocol:
+    # pairs per subscription topic:
+    MAX_TOPIC_PAIRS = 100
+
+    def __init__(self):
+        # replaced by the interval the server asks for on connect:
+        self.ping_interval = 18.0
+        self._ids = 0
+
+    def connect(self):
+        # a public token and the feed's address come from one REST
+        # request per connection; the first message is a welcome:
+        bullet = apiwrapper().query("/api/v1/bullet-public",method="POST")
+        if bullet.get("code")!="200000":
+            raise ValueError("no websocket token: %s"%bullet.get("msg"))
+        server = bullet["data"]["instanceServers"][0]
+        self.ping_interval = server["pingInterval"]/1000
+        url = "%s?token=%s&connectId=%s"%(
+            server["endpoint"],
+            bullet["data"]["token"],
+            self._next_id(),
+            )
+        ws = websocket.connect(url)
+        welcome = ws.recv_json(timeout=server["pingTimeout"]/1000)
+        if welcome is None or welcome.get("type")!="welcome":
+            ws.close()
+            raise ValueError("no welcome from %s"%server["endpoint"])
+        return ws
+
+    def subscribe(self,ws,pairs):
+        pairs = list(pairs)
+        for ii in range(0,len(pairs),self.MAX_TOPIC_PAIRS):
+            ws.send_json({
+                "id": self._next_id(),
+                "type": "subscribe",
+                "topic": "/market/ticker:%s"%",".join(
+                    pairs[ii:ii+self.MAX_TOPIC_PAIRS],
+                    ),
+                "privateChannel": False,
+                "response": True,
+                })
+
+    def ping(self,ws):
+        ws.send_json({"id": self._next_id(), "type": "ping"})
+
+    def parse(self,message):
+        # [(pair, price, time)] from one feed message:
+        kind = message.get("type")
+        if kind=="error":
+            raise ValueError("%s: %s"%(message.get("code"),message.get("data")))
+        if kind!="message" or message.get("subject")!="trade.ticker":
+            return []
+        data = message["data"]
+        when = pd.Timestamp(int(data["time"]),unit="ms")
+        return [(message["topic"].split(":")[1],float(data["price"]),when)]
+
+    def _next_id(self):
+        self._ids += 1
+        return str(self._ids)
+
+def _check_granularity(granularity):
+    if granularity not in CANDLE_TYPES:
+        raise ValueError("unsupported granularity %s, use one of %s"%(
+            granularity,
+            sorted(CANDLE_TYPES),
+            ))
+
+def _cached_history(pair,start,end,granularity):
+    candles = default_cache()
+    if candles is None:
+        return _fetch_history(pair,start,end,granularity)
+    return candles.get(
+        "kucoin",
+        pair,
+        granularity,
+        start,
+        end,
+        lambda di,de: _fetch_history(pair,di,de,granularity),
+        )
+
+def _fetch_history(
     pair,
     start,
     end,
@@ -19,82 +190,51 @@ def price_history(
     ):
     # The max number of data per request is 1500. 
     # 
-    # granularity: Type of candlestick patterns: 
-    # - 1min, 3min, 5min, 15min, 30min
-    # - 1hour, 2hour, 4hour, 6hour, 8hour
-    # - 12hour, 1day, 1week
-    # 
-    # check to make sure the number of data points
-    # is within 1500. If not within 1500, discretize. 
-    df_index = pd.date_range(
-        start=start,
-        end=end,
-        freq="%dS"%granularity
-        )
-    index_slices = []
-    if len(df_index) >= 1500:
-        start=0
-        end=1499
-        num_slices,remainder = divmod(len(df_index),1500)
-        for ii in range(num_slices):
-            index_slices.append([
-                df_index[start],
-                df_index[end],
-                ])
-            start += 1500
-            end += 1500
-        index_slices.append([
-            df_index[-remainder],
-            df_index[-1]
-            ])
-    else:
-        index_slices.append([
-            df_index[0],
-            df_index[-1],
-            ])
-    
-    # iterate over each (start,end) pair:
+    # fetch slices concurrently. Each request asks for one
+    # candle past its slice, so nothing is lost whether endAt is
+    # inclusive or not; the overlap is dropped on merge:
     kuapi = apiwrapper()
+    return fetch_range(
+        start,
+        end,
+        granularity,
+        MAX_CANDLES,
+        lambda di,de: _fetch_slice(kuapi,pair,di,de,granularity),
+        )
+
+def _fetch_slice(kuapi,pair,start,end,granularity):
     endpoint = "/api/v1/market/candles"
-    frames = []
-    for di,de in index_slices:
-        utc_start = int(di.timestamp())
-        utc_end = int(de.timestamp())
-        options = [
-            "type=1day",
-            "symbol=%s"%pair,
-            "startAt=%d"%utc_start,
-            "endAt=%d"%utc_end,
-            ]
-        options = "&".join(options)
-        request_url = "%s?%s"%(endpoint,options)
-        
-        # query api:
-        api_output = kuapi.query(request_url)
-        df = pd.DataFrame(api_output["data"])
-        frames.append(df)
-    
-    # create and return dataframe:
-    results = pd.concat(frames)
-    results.loc[:,0] = pd.to_datetime(results[0],unit="s")
-    results.columns = [
-        "time",
-        "open",
-        "close",
-        "high",
-        "low",
-        "volume",
-        "turnover",
+    utc_start = int(start.timestamp())
+    utc_end = int(end.timestamp()) + granularity
+    options = [
+        "type=%s"%CANDLE_TYPES[granularity],
+        "symbol=%s"%pair,
+        "startAt=%d"%utc_start,
+        "endAt=%d"%utc_end,
         ]
-    results = results.set_index("time")
-    for col in results.columns:
-        results.loc[:,col] = results[col].apply(float)
-    return results
-    
-    
+    options = "&".join(options)
+    request_url = "%s?%s"%(endpoint,options)
     
-    
-    
-
-
+    # query api:
+    api_output = kuapi.query(request_url)
+    if api_output.get("code")!="200000":
+        raise RuntimeError("KuCoin rejected %s: %s"%(request_url,api_output.get("msg")))
 
+    # rows of [time, open, close, high, low, volume, turnover]
+    # strings, parsed into one float array at once:
+    values = np.array(api_output["data"],dtype=np.float64).reshape(-1,7)
+    return pd.DataFrame(
+        values[:,1:],
+        index=pd.to_datetime(
+            values[:,0].astype(np.int64),
+            unit="s",
+            ).rename("time"),
+        columns=[
+            "open",
+            "close",
+            "high",
+            "low",
+            "volume",
+            "turnover",
+            ],
+        )
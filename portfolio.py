@@ -1,51 +1,319 @@
 """Portfolio class."""
 import numpy as np
 import pandas as pd
+import json
+import time
+import importlib
+from concurrent.futures import ThreadPoolExecutor
+
+from common._matrix import assetmatrix
+from common._datasets import computed, invalidate, sources
+from common._pool import derive_many
 
 class portfolio:
-    def __init__(self,name):
+    def __init__(self,name,processes=None):
         self.name = name
+
+        # with a number of processes, load_accounts derives deposits
+        # and balance sheets in a process pool of that size; None
+        # keeps every stage on threads:
+        self.processes = processes
         self.all_accounts = []
         self.num_accounts = 0
+        self.pending_accounts = []
+        self.load_report = pd.DataFrame()
+        self.matrix = assetmatrix()
         
     def add_account(self,account):
+        # the running totals take the new account's rows only:
         self.all_accounts.append(account)
         self.num_accounts += 1
-        self.usd_deposits=pd.DataFrame()
-        self.coin_usd_values=pd.DataFrame()
-        self.total_performance=pd.DataFrame()
+        if _has_performance(account):
+            self.matrix.add(account,account.name,account.performance_data)
+
+    def remove_account(self,account):
+        self.all_accounts.remove(account)
+        self.num_accounts -= 1
+        if account in self.matrix:
+            self.matrix.remove(account)
+
+    def refresh_account(self,account,setup=True):
+        """Set up one account again and update the totals from the
+        first row that changed."""
+        if setup:
+            account.standard_setup()
+        if _has_performance(account):
+            self.matrix.refresh(account,account.name,account.performance_data)
+        elif account in self.matrix:
+            self.matrix.remove(account)
+
+    def append_prices(self,prices):
+        """Extend the totals by new rows (e.g. the latest daily
+        candles) from a (time x coin name) frame of prices."""
+        self.matrix.append_prices(prices)
     
-    def aggregate_accounts(self):
-        deposit_frames = []
-        value_frames = []
-        coin_names = []
+    def follow_prices(self,feed):
+        """Revalue the latest row of each account, and the totals, on
+        every update of a pricefeed (e.g. live_prices of either
+        exchange's markets module); no REST requests are made."""
+        return feed.subscribe(self._on_price)
+
+    def unfollow_prices(self,feed):
+        feed.unsubscribe(self._on_price)
+
+    def _on_price(self,pair,price,when):
         for account in self.all_accounts:
-            coin = account.name
-            perf = account.return_performance_data()
-            deposit_frames.append(perf.usd_deposits)
-            value_frames.append(perf.coin_usd_value)
-            coin_names.append(coin)
-        
-        # USD deposits:
-        deposits_df = pd.concat(deposit_frames, axis=1, keys=coin_names)
-        deposits_df["total"] = deposits_df.sum(axis=1)
-        self.usd_deposits = deposits_df
-        
-        # coin balance USD values:
-        cvalues_df = pd.concat(value_frames, axis=1, keys=coin_names)
-        cvalues_df["total"] = cvalues_df.sum(axis=1)
-        self.coin_usd_values = cvalues_df
-        
-        # calculate total return:
-        perf_df = pd.DataFrame(
-            [cvalues_df.total,deposits_df.total],
-            index=["coin_usd_value","deposits_usd"],
-            ).transpose()
-        perf_df["performance"] = perf_df.coin_usd_value/perf_df.deposits_usd
-        self.total_performance = perf_df
-        print(perf_df)
+            if getattr(account,"usd_pair",None)!=pair:
+                continue
+            if not _has_performance(account):
+                continue
+            account.set_live_price(price)
+            if account in self.matrix:
+                last = account.performance_data.index[-1]
+                self.matrix.set_price(account,last,price)
+    
+    def register_account(self,account):
+        """Queue an account to be set up by load_accounts."""
+        self.pending_accounts.append(account)
+
+    def discover_accounts(
+        self,
+        cbpro_key=None,
+        kucoin_key=None,
+        start=None,
+        end=None,
+        min_balance=0.0,
+        include=(),
+        exclude=("USDT",),
+        ):
+        """Register every account worth setting up on both exchanges.
+
+        Each exchange lists all of its accounts in one request, both
+        at once. Currencies holding no more than `min_balance` are
+        skipped before any ledger, fills or candle request is made;
+        name closed positions whose history matters in `include`.
+        `exclude` drops currencies regardless, by default USDT, which
+        KuCoin accounts are valued in. KuCoin accounts cover [start,
+        end], end defaulting to today. Returns what was done with
+        every listed currency.
+        """
+        sources = []
+        if cbpro_key is not None:
+            sources.append(("cbpro",cbpro_key))
+        if kucoin_key is not None:
+            if start is None:
+                raise ValueError("KuCoin accounts need a start date")
+            sources.append(("kucoin",kucoin_key))
+        if end is None:
+            end = pd.Timestamp.now().date()
+        modules = {
+            exchange: importlib.import_module("%s.account"%exchange)
+            for exchange,key in sources
+            }
+        with ThreadPoolExecutor(max(len(sources),1)) as pool:
+            listings = list(pool.map(
+                lambda source: modules[source[0]].list_accounts(source[1]),
+                sources,
+                ))
+        rows = []
+        for (exchange,key),listing in zip(sources,listings):
+            for currency,entry in listing.iterrows():
+                if currency in exclude:
+                    status = "excluded"
+                elif currency in include or entry.balance > min_balance:
+                    status = "registered"
+                else:
+                    status = "empty"
+                if status=="registered" and exchange=="cbpro":
+                    self.register_account(
+                        modules[exchange].account(currency,entry.id,key),
+                        )
+                elif status=="registered":
+                    account = modules[exchange].account(currency,key)
+                    account.set_date_range(start,end)
+                    self.register_account(account)
+                rows.append({
+                    "exchange": exchange,
+                    "currency": currency,
+                    "balance": entry.balance,
+                    "status": status,
+                    })
+        return pd.DataFrame(
+            rows,
+            columns=["exchange","currency","balance","status"],
+            )
+
+    def load_accounts(self,max_workers=8):
+        """Run standard_setup on every registered account concurrently.
+
+        Each exchange's shared rate limit buckets keep the combined
+        request rate within budget. Accounts that fail are reported
+        and left out of the portfolio instead of aborting the run.
+        """
+        pending = self.pending_accounts
+        if self.processes is None:
+            with ThreadPoolExecutor(max_workers) as pool:
+                results = list(pool.map(_timed_setup,pending))
+        else:
+            results = _pooled_setup(pending,max_workers,self.processes)
+        rows = []
+        for account,(seconds,error) in zip(pending,results):
+            if error is None:
+                self.add_account(account)
+            else:
+                print("%s account failed to load...%s"%(account.name,error))
+            rows.append({
+                "account": account.name,
+                "exchange": account.__module__.split(".")[0],
+                "seconds": seconds,
+                "status": "ok" if error is None else "failed",
+                "error": error,
+                })
+        self.pending_accounts = []
+        self.load_report = pd.DataFrame(
+            rows,
+            columns=["account","exchange","seconds","status","error"],
+            ).set_index("account")
+        return self.load_report
+
+    def save(self,loc):
+        """Save every account's datasets in the columnar frame store."""
+        entries = []
+        for account in self.all_accounts:
+            account.save(loc)
+            entries.append({
+                "exchange": account.__module__.split(".")[0],
+                "name": account.name,
+                "account_id": getattr(account,"account_id",None),
+                })
+        with open("%s/%s-portfolio.json"%(loc,self.name),"w") as of:
+            json.dump({"accounts": entries},of)
+
+    def load(self,loc,mmap=True):
+        """Restore accounts written by save without querying any API."""
+        with open("%s/%s-portfolio.json"%(loc,self.name),"r") as of:
+            entries = json.load(of)["accounts"]
+        for entry in entries:
+            module = importlib.import_module("%s.account"%entry["exchange"])
+            if entry["account_id"] is None:
+                account = module.account(entry["name"])
+            else:
+                account = module.account(entry["name"],entry["account_id"])
+            account.load(loc,mmap=mmap)
+            self.add_account(account)
+
+    def aggregate_accounts(self):
+        # deposits, balances and prices of every account on one
+        # time index, rebuilt in one pass; totals are vectorized
+        # sums over the assets:
+        self.matrix = assetmatrix.from_accounts(self.all_accounts)
+        print(self.total_performance)
+
+    # USD deposits:
+    @property
+    def usd_deposits(self):
+        return self.matrix.asset_deposits()
+
+    # coin balance USD values:
+    @property
+    def coin_usd_values(self):
+        return self.matrix.asset_values()
+
+    # total return:
+    @property
+    def total_performance(self):
+        return self.matrix.performance()
+
+    def sub_portfolio(self,names):
+        """Total performance of the named accounts only."""
+        return self.matrix.performance(names)
         
     def return_total_performance(self):
-        return self.total_performance.copy()
-        
-        
+        return self.total_performance
+
+def _has_performance(account):
+    # without deriving it, which may download the account's history:
+    if not computed(account,"performance_data"):
+        return False
+    df = account.performance_data
+    return df is not None and len(df) > 0
+
+def _timed_setup(account):
+    return _timed(account.standard_setup)
+
+def _timed(fn):
+    ti = time.perf_counter()
+    try:
+        fn()
+        error = None
+    except Exception as exc:
+        error = "%s: %s"%(type(exc).__name__,exc)
+    return time.perf_counter()-ti,error
+
+def _derived(account):
+    # what standard_setup derives in the worker processes; the
+    # performance data needs candles, so it stays with the rate
+    # limited requests in this process:
+    if account.name=="USD":
+        return ["balance_sheet"]
+    return ["deposits","balance_sheet"]
+
+def _downloaded(account):
+    return sources(type(account),_derived(account))
+
+def _shipped(account):
+    # only the columns the derivation reads:
+    columns = getattr(account,"DERIVED_FROM",{})
+    frames = {}
+    for name in _downloaded(account):
+        df = getattr(account,name)
+        frames[name] = df[columns[name]] if name in columns else df
+    return frames
+
+def _timed_download(account):
+    def download():
+        invalidate(account)
+        for name in _downloaded(account):
+            getattr(account,name)
+    return _timed(download)
+
+def _timed_performance(account):
+    return _timed(account.return_performance_data)
+
+def _pooled_setup(accounts,max_workers,processes):
+    # standard_setup in three steps: ledgers and fills on threads,
+    # deposits and balance sheets in processes, then performance
+    # data (and its candles) on threads again:
+    with ThreadPoolExecutor(max_workers) as pool:
+        fetched = list(pool.map(_timed_download,accounts))
+    ready = [
+        account for account,(seconds,error) in zip(accounts,fetched)
+        if error is None
+        ]
+    derived = dict(zip(
+        ready,
+        derive_many(ready,_shipped,_derived,processes),
+        ))
+    for account,(seconds,frames,error) in derived.items():
+        for name in _derived(account):
+            if name in frames:
+                setattr(account,name,frames[name])
+    finishing = [
+        account for account in ready
+        if derived[account][2] is None and account.name!="USD"
+        ]
+    with ThreadPoolExecutor(max_workers) as pool:
+        finished = dict(zip(
+            finishing,
+            pool.map(_timed_performance,finishing),
+            ))
+    results = []
+    for account,(seconds,error) in zip(accounts,fetched):
+        if error is None:
+            extra,frames,error = derived[account]
+            seconds += extra
+        if error is None and account in finished:
+            extra,error = finished[account]
+            seconds += extra
+        results.append((seconds,error))
+    return results
@@ -0,0 +1,89 @@
+"""Candle slice planning and the downloads built on it.
+
+benchmarks/slices.py runs the same checks around its timings:
+
+    python -m pytest tests
+"""
+import os
+import sys
+import pandas as pd
+import pytest
+
+# repository root and the mock exchange:
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0,ROOT)
+sys.path.insert(0,os.path.join(ROOT,"benchmarks"))
+import cbpro._api
+import kucoin._api
+import cbpro.markets
+import kucoin.markets
+import common._store as store
+from common._candles import plan_slices
+from mockexchange import mockexchange
+
+# (name, price_history, pair, granularity, days) per exchange:
+EXCHANGES = [
+    ("cbpro",cbpro.markets.price_history,"BTC-USD",60,3),
+    ("kucoin",kucoin.markets.price_history,"BTC-USDT",60,10),
+    ]
+
+def check_plan(slices,start,end,granularity,max_candles):
+    step = pd.Timedelta(seconds=granularity)
+    assert slices[0][0]==start and slices[-1][1]==end
+    for (di,de),(ni,ne) in zip(slices[:-1],slices[1:]):
+        assert ni==de+step, "gap or overlap at %s"%de
+    for di,de in slices:
+        assert (de-di)//step+1 <= max_candles, "slice too large at %s"%di
+
+def check_candles(name,fetch,pair,granularity,days):
+    # candles from the mock server up to yesterday; every open time
+    # must be present exactly once:
+    end = pd.Timestamp.now().floor("D") - pd.Timedelta(days=1)
+    start = end - pd.Timedelta(days=days)
+    df = fetch(pair,start,end,granularity,cache=False)
+    expected = pd.date_range(start,end,freq="%ds"%granularity)
+    assert df.index.equals(expected), "%s candles differ"%name
+    return df
+
+@pytest.fixture
+def mock():
+    # the mock exchange with the rate limits lifted and no cache,
+    # put back afterwards:
+    buckets = list(cbpro._api.buckets.values())+list(kucoin._api.buckets.values())
+    saved = (
+        store.cache_dir(),
+        cbpro._api.ENDPOINT,
+        kucoin._api.BASE_URL,
+        [(b.rate,b.capacity,b._tokens) for b in buckets],
+        )
+    store.set_cache_dir(None)
+    for bucket in buckets:
+        bucket.rate = bucket.capacity = bucket._tokens = 1e6
+    try:
+        with mockexchange() as server:
+            cbpro._api.ENDPOINT = server.url
+            kucoin._api.BASE_URL = server.url
+            yield server
+    finally:
+        store.set_cache_dir(saved[0])
+        cbpro._api.ENDPOINT = saved[1]
+        kucoin._api.BASE_URL = saved[2]
+        for bucket,(rate,capacity,tokens) in zip(buckets,saved[3]):
+            bucket.rate,bucket.capacity,bucket._tokens = rate,capacity,tokens
+
+@pytest.mark.parametrize("max_candles",[300,1499,1500])
+def test_plan_tiles_years(max_candles):
+    start = pd.Timestamp("2015-01-01")
+    end = start + pd.DateOffset(years=5) - pd.Timedelta(minutes=1)
+    check_plan(plan_slices(start,end,60,max_candles),start,end,60,max_candles)
+
+# exact multiples and a single candle, which the old slicing got wrong:
+@pytest.mark.parametrize("count",[1,299,300,301,600,1500])
+def test_plan_edges(count):
+    start = pd.Timestamp("2015-01-01")
+    end = start + pd.Timedelta(minutes=count-1)
+    check_plan(plan_slices(start,end,60,300),start,end,60,300)
+
+@pytest.mark.parametrize("name,fetch,pair,granularity,days",EXCHANGES)
+def test_candles(mock,name,fetch,pair,granularity,days):
+    check_candles(name,fetch,pair,granularity,days)